@@ -1,23 +1,39 @@
 """Chat routes."""
 
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.core.database import get_db
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app.core.database import AsyncSessionLocal, SessionLocal, get_async_db, get_db
+from app.core.history_cache import history_cache
+from app.core.llm_scheduler import LLMPreempted
+from app.models import Message
 from app.schemas.chat import ChatRequest, ChatResponse, ConversationResponse, MessageResponse
 from app.services.ai_service import ai_service
+from app.services.context_assembler import context_assembler
 from app.services.conversation_service import conversation_service
 from app.services.rag_service import rag_service
+from app.services.indexing_queue import indexing_queue
 from app.services.summarization_service import summarization_service
-from app.services.preference_service import preference_service
-from app.characters import get_character_profile
+from app.services.preference_service import NEUTRAL_SENTIMENT, preference_service
+from app.services.prompt_registry import prompt_registry
 from datetime import datetime
 from pydantic import BaseModel
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/api", tags=["chat"])
 
 
 @router.post("/chat", response_model=ChatResponse)
-def send_message(request: ChatRequest, db: Session = Depends(get_db)):
+async def send_message(request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Send a message to a character and get a response with Phase 2 enhancements.
     
@@ -27,142 +43,408 @@ def send_message(request: ChatRequest, db: Session = Depends(get_db)):
     - User Preferences: Tracks and uses user preferences
     - Sentiment Analysis: Adapts to user's emotional state
     """
-    # Get character profile
-    character_profile = get_character_profile(request.character_id)
-    if not character_profile:
+    turn = await _prepare_turn(db, request, analyze_sentiment=not settings.combined_generation)
+    
+    # Generate AI response
+    combined = None
+    if settings.combined_generation:
+        combined = await ai_service.generate_combined_response_async(
+            system_prompt=turn["system_prompt"],
+            conversation_history=turn["prompt_history"],
+            user_message=request.message,
+            context=turn["context"]
+        )
+    if combined:
+        ai_response = combined["reply"]
+        turn["sentiment"] = combined["sentiment"] or dict(NEUTRAL_SENTIMENT)
+        turn["preferences"] = combined["preferences"]
+    else:
+        if settings.combined_generation:
+            # Fall back to the separate sentiment call the prompt normally gets
+            turn["sentiment"] = await _sentiment_stage(request, turn["stage_ms"])
+            _assemble_context(request, turn)
+        ai_response = await ai_service.generate_response_async(
+            system_prompt=turn["system_prompt"],
+            conversation_history=turn["prompt_history"],
+            user_message=request.message,
+            context=turn["context"]
+        )
+    
+    await _complete_turn(db, request, turn, ai_response)
+    
+    return ChatResponse(
+        conversation_id=turn["conversation_id"],
+        character_response=ai_response,
+        timestamp=datetime.utcnow(),
+        metadata=_turn_metadata(turn)
+    )
+
+
+@router.post("/chat/stream")
+async def stream_message(request: ChatRequest, http_request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Like `/chat`, but streams the reply as Server-Sent Events while Gemini
+    generates it: a `start` event with the conversation ID, `token` events
+    with text chunks, then `done` with the saved message and metadata (or
+    `error`). The reply is saved once the stream completes. If the client
+    disconnects first, generation is cancelled and the text streamed so far
+    is saved as the reply, or, if there is none, the user's message is
+    removed, so the conversation never ends on an unanswered message.
+    """
+    turn = await _prepare_turn(db, request)
+    chunks = ai_service.stream_response_async(
+        system_prompt=turn["system_prompt"],
+        conversation_history=turn["prompt_history"],
+        user_message=request.message,
+        context=turn["context"]
+    )
+    return StreamingResponse(
+        _stream_events(request, http_request, turn, chunks),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _stream_events(request: ChatRequest, http_request: Request, turn: Dict, chunks: AsyncIterator[str]):
+    yield _sse("start", {"conversation_id": turn["conversation_id"]})
+    
+    parts = []
+    finished = False
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield _sse("token", {"text": chunk})
+            if await http_request.is_disconnected():
+                logger.info(f"Client left conversation {turn['conversation_id']} mid-stream, cancelling generation")
+                break
+        else:
+            finished = True
+    finally:
+        # Cancels the Gemini stream if it did not run to completion
+        await chunks.aclose()
+        if not finished:
+            # Also reached when the response task is cancelled; shielded so
+            # a second cancellation cannot interrupt the write
+            await asyncio.shield(_abandon_turn(request, turn, "".join(parts).strip()))
+    if not finished:
+        return
+    
+    ai_response = "".join(parts).strip()
+    try:
+        # The request's session may already be closed by now
+        async with AsyncSessionLocal() as db:
+            ai_msg = await _complete_turn(db, request, turn, ai_response)
+    except Exception as e:
+        logger.error(f"Error saving streamed reply: {e}", exc_info=True)
+        yield _sse("error", {"detail": "Failed to save the reply"})
+        return
+    
+    yield _sse("done", {
+        "conversation_id": turn["conversation_id"],
+        "message_id": ai_msg.id,
+        "character_response": ai_response,
+        "timestamp": ai_msg.timestamp.isoformat(),
+        "metadata": _turn_metadata(turn)
+    })
+
+
+async def _abandon_turn(request: ChatRequest, turn: Dict, partial_response: str):
+    """Settle a turn whose stream ended early: keep the partial reply, or drop the unanswered user message."""
+    try:
+        async with AsyncSessionLocal() as db:
+            if partial_response:
+                await _complete_turn(db, request, turn, partial_response)
+            else:
+                await conversation_service.delete_message_async(db, turn["user_msg"].id)
+    except Exception as e:
+        logger.error(f"Error settling interrupted turn in conversation {turn['conversation_id']}: {e}", exc_info=True)
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _prepare_turn(db: AsyncSession, request: ChatRequest, analyze_sentiment: bool = True) -> Dict:
+    """Save the user message and gather everything the reply prompt needs."""
+    # Get character prompt, compiled at startup
+    character_prompt = prompt_registry.get(request.character_id)
+    if not character_prompt:
         raise HTTPException(status_code=404, detail="Character not found")
     
     # Get or create conversation
     if request.conversation_id:
-        conversation = conversation_service.get_conversation(db, request.conversation_id)
+        conversation = await conversation_service.get_conversation_async(db, request.conversation_id)
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
     else:
         # Create new conversation
-        conversation = conversation_service.create_conversation(
+        conversation = await conversation_service.create_conversation_async(
             db,
             character_id=request.character_id,
             user_id=request.user_id or "anonymous"
         )
+    conversation_id = conversation.id
     
     # Save user message
-    user_msg = conversation_service.add_message(
+    user_msg = await conversation_service.add_message_async(
         db,
-        conversation_id=conversation.id,
+        conversation_id=conversation_id,
         role="user",
         content=request.message
     )
-    
-    # Get conversation history
-    history = conversation_service.get_conversation_history(db, conversation.id)
+    # End the transaction so the connection goes back to the pool while the
+    # reply is generated
+    await db.commit()
     
     # === PHASE 2 ENHANCEMENTS ===
+    # None of these depend on each other, so they run concurrently, each
+    # with its own session. Enrichments slower than their timeout are
+    # skipped for this turn; the history is required
+    stage_ms: Dict[str, float] = {}
+    user_id = request.user_id or "anonymous"
+    stages = [
+        # Get the recent conversation history: the messages that can make it
+        # into the prompt, plus the one just saved
+        _run_stage(stage_ms, "history", None, lambda stage_db: conversation_service.get_recent_history_async(
+            stage_db,
+            conversation_id,
+            limit=settings.max_conversation_history + 1,
+            token_budget=settings.context_token_budget
+        )),
+        # 1. Check if summarization is needed (queued as a job after the
+        # reply when the job queue is on)
+        _run_stage(stage_ms, "summary", settings.chat_summary_timeout, lambda stage_db: _summary_stage(
+            stage_db, conversation_id
+        ), default=""),
+        # 2. RAG: Retrieve relevant context from past conversations
+        _run_stage(stage_ms, "rag", settings.chat_rag_timeout, lambda stage_db: rag_service.retrieve_relevant_context_async(
+            stage_db,
+            user_message=request.message,
+            user_id=user_id,
+            character_id=request.character_id,
+            current_conversation_id=conversation_id,
+            n_results=3
+        ), default=""),
+        # 3. Get user preferences
+        _run_stage(stage_ms, "profile", settings.chat_profile_timeout, lambda stage_db: preference_service.get_user_profile_async(
+            stage_db, user_id=user_id, character_id=request.character_id
+        ), default="")
+    ]
+    # 4. Analyze sentiment
+    if analyze_sentiment:
+        stages.append(_sentiment_stage(request, stage_ms))
+    history, summary, rag_context, user_profile, *sentiment = await asyncio.gather(*stages)
     
-    # 1. Check if summarization is needed
-    summary = ""
-    if summarization_service.should_summarize(db, conversation.id):
-        summary = summarization_service.create_progressive_summary(db, conversation.id)
-    else:
-        summary = summarization_service.get_conversation_summary(db, conversation.id)
-    
-    # 2. RAG: Retrieve relevant context from past conversations
-    rag_context = rag_service.retrieve_relevant_context(
-        user_message=request.message,
-        user_id=request.user_id or "anonymous",
-        character_id=request.character_id,
-        current_conversation_id=conversation.id,
-        n_results=3
-    )
-    
-    # 3. Get user preferences
-    user_profile = preference_service.get_user_profile(
-        db,
-        user_id=request.user_id or "anonymous",
-        character_id=request.character_id
+    turn = {
+        "conversation_id": conversation_id,
+        "user_msg": user_msg,
+        "history": history,
+        "summary": summary,
+        "rag_context": rag_context,
+        "user_profile": user_profile,
+        "sentiment": sentiment[0] if sentiment else dict(NEUTRAL_SENTIMENT),
+        "preferences": None,
+        "stage_ms": stage_ms,
+        "system_prompt": character_prompt
+    }
+    _assemble_context(request, turn)
+    return turn
+
+
+async def _run_stage(
+    stage_ms: Dict[str, float],
+    name: str,
+    timeout: Optional[float],
+    stage: Callable[[AsyncSession], Awaitable],
+    default: Any = None
+):
+    """
+    Run one pre-generation stage on its own session and record its time.
+    With a timeout the stage is optional: when slow or failing it yields
+    `default`. Without one, errors propagate.
+    """
+    started = time.monotonic()
+    try:
+        async with AsyncSessionLocal() as stage_db:
+            return await asyncio.wait_for(stage(stage_db), timeout)
+    except asyncio.TimeoutError:
+        if timeout is None:
+            raise
+        logger.warning(f"Skipping {name} for this turn: took more than {timeout}s")
+        return default
+    except Exception as e:
+        if timeout is None:
+            raise
+        logger.error(f"Skipping {name} for this turn: {e}", exc_info=True)
+        return default
+    finally:
+        stage_ms[name] = round((time.monotonic() - started) * 1000, 1)
+
+
+async def _summary_stage(db: AsyncSession, conversation_id: int) -> str:
+    if settings.job_queue_enabled:
+        return await summarization_service.get_conversation_summary_async(db, conversation_id)
+    # asyncio's executor (unlike run_in_threadpool) lets the stage timeout
+    # abandon a slow summary; it still completes in the background
+    return await asyncio.to_thread(_summarize_inline, conversation_id)
+
+
+async def _sentiment_stage(request: ChatRequest, stage_ms: Dict[str, float]) -> Dict:
+    return await _run_stage(
+        stage_ms,
+        "sentiment",
+        settings.chat_sentiment_timeout,
+        lambda _: preference_service.analyze_sentiment_async(request.message),
+        default=dict(NEUTRAL_SENTIMENT)
     )
-    
-    # 4. Analyze sentiment
-    sentiment = preference_service.analyze_sentiment(request.message)
-    
-    # Build enhanced prompt
-    system_prompt = character_profile.build_system_prompt()
-    
-    # Add Phase 2 context
-    enhanced_context = []
-    if summary:
-        enhanced_context.append(f"CONVERSATION SUMMARY:\n{summary}")
-    if rag_context:
-        enhanced_context.append(rag_context)
-    if user_profile:
-        enhanced_context.append(user_profile)
+
+
+def _assemble_context(request: ChatRequest, turn: Dict):
+    """Fit this turn's context and history into the prompt token budget."""
+    # Phase 2 context
+    summary = turn["summary"]
+    sentiment = turn["sentiment"]
+    sections = {
+        "summary": f"CONVERSATION SUMMARY:\n{summary}" if summary else "",
+        "rag": turn["rag_context"],
+        "profile": turn["user_profile"],
+        "emotion": ""
+    }
     if sentiment.get('emotion') != 'calm':
-        enhanced_context.append(f"USER EMOTIONAL STATE: {sentiment.get('emotion')} ({sentiment.get('sentiment')})")
+        sections["emotion"] = f"USER EMOTIONAL STATE: {sentiment.get('emotion')} ({sentiment.get('sentiment')})"
     
-    if enhanced_context:
-        system_prompt += "\n\n" + "\n\n".join(enhanced_context)
-    
-    # Generate AI response
-    ai_response = ai_service.generate_response(
-        system_prompt=system_prompt,
-        conversation_history=history[:-1],  # Exclude the just-added user message
-        user_message=request.message
+    assembled = context_assembler.assemble(
+        turn["system_prompt"].tokens,
+        turn["history"][:-1],  # Exclude the just-added user message
+        request.message,
+        sections
     )
-    
+    turn["context"] = assembled["context"]
+    turn["prompt_history"] = assembled["history"]
+    turn["context_tokens"] = assembled["tokens"]
+
+
+def _summarize_inline(conversation_id: int) -> str:
+    db = SessionLocal()
+    try:
+        if summarization_service.should_summarize(db, conversation_id):
+            try:
+                return summarization_service.create_progressive_summary(db, conversation_id)
+            except LLMPreempted:
+                # Replies are queued ahead of summaries; try again next turn
+                pass
+        return summarization_service.get_conversation_summary(db, conversation_id)
+    finally:
+        db.close()
+
+
+async def _complete_turn(db: AsyncSession, request: ChatRequest, turn: Dict, ai_response: str) -> Message:
+    """Save the reply and start the post-response work."""
     # Save AI response
-    ai_msg = conversation_service.add_message(
+    ai_msg = await conversation_service.add_message_async(
         db,
-        conversation_id=conversation.id,
+        conversation_id=turn["conversation_id"],
         role="character",
         content=ai_response
     )
     
     # === POST-RESPONSE PHASE 2 TASKS ===
     
-    # 5. Index messages in RAG vector store
-    rag_service.index_message(
-        message_id=user_msg.id,
-        conversation_id=conversation.id,
-        user_id=request.user_id or "anonymous",
-        character_id=request.character_id,
-        role="user",
-        content=request.message,
-        timestamp=user_msg.timestamp
-    )
-    rag_service.index_message(
-        message_id=ai_msg.id,
-        conversation_id=conversation.id,
-        user_id=request.user_id or "anonymous",
-        character_id=request.character_id,
-        role="character",
-        content=ai_response,
-        timestamp=ai_msg.timestamp
-    )
-    
-    # 6. Extract and update user preferences (every 5 messages)
-    if len(history) % 5 == 0:
-        preference_service.extract_preferences(
-            db,
-            messages=[user_msg, ai_msg],
-            user_id=request.user_id or "anonymous",
-            character_id=request.character_id
-        )
+    # Queueing writes to SQLite and, with the job queue off, may index or
+    # extract preferences inline, so it runs in the threadpool
+    await run_in_threadpool(_start_post_response_work, request, turn, ai_msg)
     
     # Generate title if first message
-    if len(history) == 1:
+    if len(turn["history"]) == 1:
         title = ai_service.generate_conversation_title(request.message)
-        conversation_service.update_conversation_title(db, conversation.id, title)
+        await conversation_service.update_conversation_title_async(db, turn["conversation_id"], title)
     
-    return ChatResponse(
-        conversation_id=conversation.id,
-        character_response=ai_response,
-        timestamp=datetime.utcnow(),
-        metadata={
-            "rag_used": bool(rag_context),
-            "summary_available": bool(summary),
-            "user_profile_used": bool(user_profile),
-            "sentiment": sentiment
-        }
-    )
+    return ai_msg
+
+
+def _start_post_response_work(request: ChatRequest, turn: Dict, ai_msg: Message):
+    conversation_id = turn["conversation_id"]
+    user_msg = turn["user_msg"]
+    
+    db = SessionLocal()
+    try:
+        # Every 5th turn of the conversation, counted in the database since
+        # `history` is only the tail. Combined generation already extracted
+        # this turn's preferences
+        extract_preferences = (
+            turn["preferences"] is None
+            and conversation_service.count_user_messages(db, conversation_id) % 5 == 0
+        )
+        if turn["preferences"]:
+            # Never let a bad preference skip indexing or fail the reply
+            try:
+                preference_service.save_preferences(
+                    db,
+                    user_id=request.user_id or "anonymous",
+                    character_id=request.character_id,
+                    preferences=turn["preferences"]
+                )
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error saving preferences from the combined response: {e}", exc_info=True)
+        
+        if settings.job_queue_enabled:
+            # 5-7. Index messages, extract preferences and update the summary as
+            # durable background jobs
+            from app.services.jobs import enqueue_chat_jobs
+            enqueue_chat_jobs(
+                db,
+                conversation_id=conversation_id,
+                user_id=request.user_id or "anonymous",
+                character_id=request.character_id,
+                message_ids=[user_msg.id, ai_msg.id],
+                extract_preferences=extract_preferences
+            )
+        else:
+            # 5. Queue messages for indexing in the RAG vector store
+            indexing_queue.enqueue_message(
+                message_id=user_msg.id,
+                conversation_id=conversation_id,
+                user_id=request.user_id or "anonymous",
+                character_id=request.character_id,
+                role="user",
+                content=request.message,
+                timestamp=user_msg.timestamp
+            )
+            indexing_queue.enqueue_message(
+                message_id=ai_msg.id,
+                conversation_id=conversation_id,
+                user_id=request.user_id or "anonymous",
+                character_id=request.character_id,
+                role="character",
+                content=ai_msg.content,
+                timestamp=ai_msg.timestamp
+            )
+            
+            # 6. Extract and update user preferences (every 5 messages)
+            if extract_preferences:
+                preference_service.extract_preferences(
+                    db,
+                    messages=[user_msg, ai_msg],
+                    user_id=request.user_id or "anonymous",
+                    character_id=request.character_id
+                )
+    finally:
+        db.close()
+
+
+def _turn_metadata(turn: Dict) -> Dict:
+    return {
+        "rag_used": bool(turn["context_tokens"]["rag"]),
+        "summary_available": bool(turn["summary"]),
+        "user_profile_used": bool(turn["context_tokens"]["profile"]),
+        "sentiment": turn["sentiment"],
+        "combined_generation": turn["preferences"] is not None,
+        "prompt_version": turn["system_prompt"].version,
+        "context_tokens": turn["context_tokens"],
+        "stage_ms": turn["stage_ms"]
+    }
 
 
 @router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
@@ -205,8 +487,15 @@ def clear_memory(request: ClearMemoryRequest, db: Session = Depends(get_db)):
     )
     
     if conversation:
+        rag_service.delete_messages(
+            request.user_id,
+            request.character_id,
+            [msg.id for msg in conversation.messages]
+        )
+        conversation_id = conversation.id
         db.delete(conversation)
         db.commit()
+        history_cache.invalidate(conversation_id)
         
         return {"status": "success", "message": "Memory cleared"}
     
@@ -1,6 +1,11 @@
 from fastapi import APIRouter
 from datetime import datetime
 from app.config import settings
+from app.core.history_cache import history_cache
+from app.core.llm_scheduler import llm_scheduler
+from app.services.ai_service import ai_service
+from app.services.indexing_queue import indexing_queue
+from app.services.prompt_registry import prompt_registry
 
 router = APIRouter(prefix="/api", tags=["health"])
 
@@ -11,7 +16,12 @@ def health_check():
         "status": "ok",
         "timestamp": datetime.utcnow().isoformat(),
         "app_name": settings.app_name,
-        "version": settings.version
+        "version": settings.version,
+        "llm": llm_scheduler.get_stats(),
+        "prompt_cache": ai_service.prompt_cache.get_stats() if ai_service.prompt_cache else None,
+        "history_cache": history_cache.get_stats(),
+        "indexing_queue": indexing_queue.get_stats(),
+        "jobs": _job_stats()
     }
 
 
@@ -21,5 +31,13 @@ def get_info():
         "app_name": settings.app_name,
         "version": settings.version,
         "model": settings.gemini_model,
-        "max_conversation_history": settings.max_conversation_history
+        "max_conversation_history": settings.max_conversation_history,
+        "prompt_versions": prompt_registry.versions()
     }
+
+
+def _job_stats():
+    if not settings.job_queue_enabled:
+        return None
+    from app.services.jobs import job_queue
+    return job_queue.get_stats()
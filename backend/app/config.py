@@ -17,11 +17,86 @@ class Settings(BaseSettings):
     secret_key: str
     
     database_url: str = "sqlite:///./data/chat.db"
+    async_db_pool_size: int = 20
+    async_db_max_overflow: int = 30
     
     cors_origins: Union[List[str], str] = []
     
     log_level: str = "INFO"
     max_conversation_history: int = 50
+    history_cache_conversations: int = 2000
+    context_token_budget: int = 6000
+    context_priorities: str = "history,summary,profile,rag"
+    context_history_min_tokens: int = 1000
+    context_summary_min_tokens: int = 300
+    context_profile_min_tokens: int = 100
+    context_rag_min_tokens: int = 200
+    combined_generation: bool = False
+    chat_summary_timeout: float = 2.0
+    chat_rag_timeout: float = 2.0
+    chat_profile_timeout: float = 1.0
+    chat_sentiment_timeout: float = 2.0
+    sentiment_provider: str = "local"
+    prompt_cache: str = "gemini"
+    prompt_cache_ttl: int = 3600
+    prompt_cache_min_tokens: int = 1024
+    prompt_cache_retry_seconds: float = 300.0
+    
+    vector_store_dir: str = "./data"
+    vector_store_socket: str = ""
+    vector_store_timeout: float = 30.0
+    vector_shards: str = ""
+    vector_shard_replicas: int = 64
+    vector_checkpoint_interval: float = 60.0
+    vector_checkpoint_max_ops: int = 500
+    vector_wal_fsync: bool = False
+    vector_max_loaded_partitions: int = 1024
+    vector_partition_idle_seconds: float = 900.0
+    vector_mmap: bool = True
+    vector_index_type: str = "flat"
+    vector_hnsw_m: int = 32
+    vector_hnsw_ef_search: int = 64
+    vector_ivf_train_threshold: int = 4096
+    vector_ivf_max_nlist: int = 1024
+    vector_ivf_nprobe: int = 16
+    vector_ivf_retrain_growth: float = 2.0
+    vector_quantization: str = "none"
+    vector_quantizer_train_threshold: int = 10000
+    vector_pq_m: int = 96
+    vector_pq_nbits: int = 8
+    vector_rerank_factor: int = 4
+    vector_compaction_ratio: float = 0.2
+    rag_text_cache_size: int = 1024
+    llm_max_concurrency: int = 16
+    llm_interactive_concurrency: int = 16
+    llm_near_real_time_concurrency: int = 4
+    llm_batch_concurrency: int = 2
+    llm_interactive_tokens_per_minute: int = 0
+    llm_near_real_time_tokens_per_minute: int = 0
+    llm_batch_tokens_per_minute: int = 0
+    llm_queue_timeout: float = 60.0
+    llm_preempt_batch: bool = True
+    job_queue_enabled: bool = True
+    job_queue_path: str = "./data/jobs.db"
+    job_workers: int = 1
+    job_batch_size: int = 16
+    job_poll_interval: float = 1.0
+    job_visibility_timeout: float = 300.0
+    job_max_attempts: int = 5
+    job_retry_backoff: float = 5.0
+    job_retention_seconds: float = 86400.0
+    indexing_workers: int = 2
+    indexing_queue_size: int = 1000
+    indexing_batch_size: int = 64
+    indexing_batch_window: float = 0.05
+    indexing_enqueue_timeout: float = 1.0
+    embedding_provider: str = "gemini"
+    embedding_workers: int = 2
+    embedding_batch_size: int = 100
+    embedding_batch_max_bytes: int = 1_000_000
+    embedding_cache_size: int = 10000
+    embedding_cache_path: str = "./data/embedding_cache.db"
+    embedding_cache_max_entries: int = 200000
     
     @field_validator('cors_origins', mode='before')
     @classmethod
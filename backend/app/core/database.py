@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from app.config import settings
 import os
@@ -10,8 +11,18 @@ os.makedirs("data", exist_ok=True)
 
 # Conditional connect_args based on database type
 connect_args = {}
-if settings.database_url.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+is_sqlite = settings.database_url.startswith("sqlite")
+if is_sqlite:
+    # The sync and async engines write to the same file concurrently, so
+    # wait for locks instead of failing after the default 5 seconds
+    connect_args = {"check_same_thread": False, "timeout": 30}
+
+
+def _sqlite_wal(dbapi_connection, connection_record):
+    # WAL lets readers and one writer work at the same time
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
 
 # Create engine with production-ready pooling settings
 engine = create_engine(
@@ -24,6 +35,41 @@ engine = create_engine(
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if is_sqlite:
+    event.listen(engine, "connect", _sqlite_wal)
+
+
+def async_database_url(url: str) -> str:
+    """The same database through an asyncio driver: aiosqlite for SQLite, asyncpg for PostgreSQL."""
+    scheme, _, rest = url.partition("://")
+    driver = {
+        "sqlite": "sqlite+aiosqlite",
+        "postgres": "postgresql+asyncpg",
+        "postgresql": "postgresql+asyncpg",
+        "postgresql+psycopg2": "postgresql+asyncpg"
+    }.get(scheme, scheme)
+    if driver == "postgresql+asyncpg":
+        # asyncpg spells libpq's sslmode as ssl
+        rest = rest.replace("sslmode=", "ssl=")
+    return f"{driver}://{rest}"
+
+
+# Used by the async chat routes. Sessions release their connection between
+# transactions, so the pool only needs to cover concurrent queries, not
+# concurrent conversations
+async_engine = create_async_engine(
+    async_database_url(settings.database_url),
+    connect_args={"timeout": 30} if is_sqlite else {},
+    pool_pre_ping=True,
+    pool_recycle=300,
+    pool_size=settings.async_db_pool_size,
+    max_overflow=settings.async_db_max_overflow
+)
+
+if is_sqlite:
+    event.listen(async_engine.sync_engine, "connect", _sqlite_wal)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 class Base(DeclarativeBase):
     pass
@@ -35,6 +81,15 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so add indexes introduced
+    # since they were created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     logger.info("✅ Database tables created successfully!")
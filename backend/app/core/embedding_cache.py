@@ -0,0 +1,168 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by a hash of (model, task_type, text).
+
+    Hot entries live in an in-process LRU; everything is also written to a
+    SQLite file so repeated texts stay cached across restarts and workers.
+    The file keeps at most `disk_max_entries` rows, dropping the least
+    recently used ones when it overflows by more than 10%.
+    """
+    
+    def __init__(self, path: Optional[str], memory_size: int = 10000, disk_max_entries: int = 200000):
+        self.memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.memory_size = memory_size
+        self.disk_max_entries = disk_max_entries
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        # SQLite calls take their own lock so memory hits never wait on disk
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._disk_entries = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    @staticmethod
+    def key(model: str, task_type: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{model}\0{task_type}\0{text}".encode(), digest_size=16).digest()
+    
+    @property
+    def on_disk(self) -> bool:
+        return self._db is not None
+    
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        return self.get_disk(keys, self.get_memory(keys))
+    
+    def get_memory(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Memory-tier hits only; never touches SQLite."""
+        found: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    found[key] = vector
+                    self.stats["memory_hits"] += 1
+        return found
+    
+    def get_disk(self, keys: List[bytes], found: Dict[bytes, np.ndarray]) -> Dict[bytes, List[float]]:
+        """Complete the memory hits in `found` from the disk tier and count the misses."""
+        missing = list({key for key in keys if key not in found})
+        from_disk = {}
+        if missing:
+            with self._db_lock:
+                if self._db is not None:
+                    from_disk = self._read(missing)
+        
+        with self._lock:
+            for key, vector in from_disk.items():
+                found[key] = vector
+                self._remember(key, vector)
+            self.stats["disk_hits"] += len(from_disk)
+            self.stats["misses"] += sum(1 for key in keys if key not in found)
+        return {key: vector.tolist() for key, vector in found.items()}
+    
+    def put_many(self, entries: List[Tuple[bytes, List[float]]]):
+        self.put_disk(self.put_memory(entries))
+    
+    def put_memory(self, entries: List[Tuple[bytes, List[float]]]) -> List[Tuple[bytes, np.ndarray]]:
+        """Add entries to the memory tier; returns them as arrays for `put_disk`."""
+        vectors = [(key, np.asarray(embedding, dtype=np.float32)) for key, embedding in entries]
+        with self._lock:
+            for key, vector in vectors:
+                self._remember(key, vector)
+        return vectors
+    
+    def put_disk(self, vectors: List[Tuple[bytes, np.ndarray]]):
+        if not vectors:
+            return
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                now = time.time()
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, vector.tobytes(), now) for key, vector in vectors]
+                )
+                self._disk_entries += len(vectors)
+                if self._disk_entries > self.disk_max_entries * 1.1:
+                    evicted = self._evict_disk()
+                    with self._lock:
+                        self.stats["evictions"] += evicted
+            except sqlite3.Error as e:
+                print(f"Error writing embedding cache: {e}")
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": (lookups - self.stats["misses"]) / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "disk_entries": self._disk_entries,
+            }
+    
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+    
+    def _read(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        found = {}
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+            if rows:
+                self._db.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                    [time.time(), *chunk]
+                )
+        return found
+    
+    def _remember(self, key: bytes, vector: np.ndarray):
+        if self.memory_size <= 0:
+            return
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+    
+    def _evict_disk(self) -> int:
+        # INSERT OR REPLACE overcounts replaced rows, so recount first
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._disk_entries - self.disk_max_entries
+        if excess <= 0:
+            return 0
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
+        self._disk_entries -= excess
+        return excess
@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+
+# (message id, role, content)
+CachedMessage = Tuple[int, str, str]
+
+
+class _Buffer:
+    def __init__(self, size: int, stamp: Optional[datetime], whole: bool):
+        self.messages: "deque[CachedMessage]" = deque(maxlen=size)
+        # The conversation's last_message_at when the buffer was last in
+        # step with the database
+        self.stamp = stamp
+        # Whether the buffer holds every message of the conversation
+        self.whole = whole
+
+
+class HistoryCache:
+    """
+    Ring buffers of the last `messages_per_conversation` messages of
+    recently active conversations, LRU-evicted beyond `max_conversations`.
+
+    A buffer is primed by the first database read of a conversation and
+    then extended as this process writes messages. Each carries the
+    conversation's `last_message_at` from its last write or read; a write
+    that finds the conversation touched since (by another worker, say)
+    drops the buffer, and the next read goes to the database and refills
+    it. A `max_conversations` of 0 disables the cache.
+    """
+    
+    def __init__(self, max_conversations: int, messages_per_conversation: int):
+        self.max_conversations = max_conversations
+        self.messages_per_conversation = messages_per_conversation
+        self.buffers: "OrderedDict[int, _Buffer]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+        self._lock = threading.Lock()
+    
+    def prime(self, conversation_id: int, messages: List[CachedMessage], stamp: Optional[datetime], whole: bool):
+        """Fill a buffer from the database; `messages` are oldest first."""
+        buffer = _Buffer(self.messages_per_conversation, stamp, whole and len(messages) <= self.messages_per_conversation)
+        buffer.messages.extend(messages)
+        self._put(conversation_id, buffer)
+    
+    def append(
+        self,
+        conversation_id: int,
+        message: CachedMessage,
+        previous_stamp: Optional[datetime],
+        stamp: Optional[datetime]
+    ):
+        """
+        Record a message this process just saved. `previous_stamp` is the
+        conversation's last_message_at as read before the write, `stamp` the
+        value written with it.
+        """
+        with self._lock:
+            buffer = self.buffers.get(conversation_id)
+            if buffer is None:
+                return
+            in_step = buffer.stamp == previous_stamp and (not buffer.messages or buffer.messages[-1][0] < message[0])
+            if not in_step:
+                del self.buffers[conversation_id]
+                self.stats["invalidations"] += 1
+                return
+            if len(buffer.messages) == buffer.messages.maxlen:
+                buffer.whole = False
+            buffer.messages.append(message)
+            buffer.stamp = stamp
+            self.buffers.move_to_end(conversation_id)
+    
+    def get(self, conversation_id: int, limit: int) -> Optional[List[CachedMessage]]:
+        """The last `limit` messages, newest first, or None if the buffer cannot answer."""
+        with self._lock:
+            buffer = self.buffers.get(conversation_id)
+            if buffer is None or (len(buffer.messages) < limit and not buffer.whole):
+                self.stats["misses"] += 1
+                return None
+            self.buffers.move_to_end(conversation_id)
+            self.stats["hits"] += 1
+            messages = list(buffer.messages)
+        return messages[::-1][:limit]
+    
+    def invalidate(self, conversation_id: int):
+        with self._lock:
+            if self.buffers.pop(conversation_id, None) is not None:
+                self.stats["invalidations"] += 1
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "conversations": len(self.buffers)}
+    
+    def _put(self, conversation_id: int, buffer: _Buffer):
+        if not self.max_conversations:
+            return
+        with self._lock:
+            self.buffers[conversation_id] = buffer
+            self.buffers.move_to_end(conversation_id)
+            while len(self.buffers) > self.max_conversations:
+                self.buffers.popitem(last=False)
+                self.stats["evictions"] += 1
+
+
+history_cache = HistoryCache(
+    max_conversations=settings.history_cache_conversations,
+    # The chat path reads the history plus the message just saved
+    messages_per_conversation=settings.max_conversation_history + 1
+)
@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobDeferred(Exception):
+    """Raised by a handler to put its jobs back, without using up an attempt, for another try after `delay` seconds."""
+    
+    def __init__(self, message: str = "", delay: float = 5.0):
+        super().__init__(message)
+        self.delay = delay
+
+
+class Job:
+    def __init__(self, row: sqlite3.Row):
+        self.id = row["id"]
+        self.type = row["type"]
+        self.payload = json.loads(row["payload"])
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+    
+    def __repr__(self):
+        return f"<Job(id={self.id}, type='{self.type}', attempts={self.attempts})>"
+
+
+class JobQueue:
+    """
+    Durable job queue in a SQLite file, shared by every process on the host.
+
+    A claimed job is invisible to other workers for `visibility_timeout`
+    seconds; if its worker dies without completing or failing it, the job
+    becomes claimable again once that time has passed. Failed jobs are
+    retried with exponential backoff until `max_attempts`, then kept with
+    status "failed". Jobs with an idempotency key are enqueued at most once.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        visibility_timeout: float = 300.0,
+        max_attempts: int = 5,
+        retry_backoff: float = 5.0,
+        max_backoff: float = 3600.0
+    ):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self._local = threading.local()
+        # Counts this process's enqueues; idle workers wait for it to change
+        self._enqueues = 0
+        self._wakeup = threading.Condition()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "type TEXT NOT NULL, "
+                "payload TEXT NOT NULL, "
+                "idempotency_key TEXT UNIQUE, "
+                "status TEXT NOT NULL DEFAULT 'queued', "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "max_attempts INTEGER NOT NULL, "
+                "run_after REAL NOT NULL, "
+                "locked_by TEXT, "
+                "locked_until REAL, "
+                "last_error TEXT, "
+                "created_at REAL NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, run_after)")
+    
+    def enqueue(
+        self,
+        job_type: str,
+        payload: Dict,
+        idempotency_key: Optional[str] = None,
+        delay: float = 0.0,
+        max_attempts: Optional[int] = None
+    ) -> int:
+        """Add a job and return its ID; with a key already used, return the existing job's ID instead."""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO jobs "
+                "(type, payload, idempotency_key, max_attempts, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_type, json.dumps(payload), idempotency_key, max_attempts or self.max_attempts, now + delay, now, now)
+            )
+            if not cursor.rowcount:
+                return db.execute("SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()[0]
+        self.wake()
+        return cursor.lastrowid
+    
+    @property
+    def enqueues(self) -> int:
+        return self._enqueues
+    
+    def wait(self, timeout: float, seen: int):
+        """
+        Wait until `enqueues` differs from `seen` (read before the caller
+        last found the queue empty) or `timeout` passes. Jobs enqueued by
+        other processes are seen by polling.
+        """
+        with self._wakeup:
+            self._wakeup.wait_for(lambda: self._enqueues != seen, timeout)
+    
+    def wake(self):
+        """Wake every worker of this process waiting in `wait`."""
+        with self._wakeup:
+            self._enqueues += 1
+            self._wakeup.notify_all()
+    
+    def claim(self, worker_id: str, limit: int = 1, job_types: Optional[List[str]] = None) -> List[Job]:
+        """Lease up to `limit` due jobs to `worker_id`, oldest first."""
+        now = time.time()
+        type_filter = ""
+        params: List = [now, now]
+        if job_types:
+            type_filter = f" AND type IN ({','.join('?' * len(job_types))})"
+            params += job_types
+        with self._transaction() as db:
+            # A job whose worker crashed or hung on every attempt is out of
+            # attempts when its last lease expires
+            db.execute(
+                "UPDATE jobs SET status = 'failed', last_error = 'Lease expired on the last attempt', "
+                "locked_by = NULL, locked_until = NULL, updated_at = ? "
+                "WHERE status = 'running' AND locked_until < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+            rows = db.execute(
+                "SELECT * FROM jobs WHERE run_after <= ? AND "
+                "(status = 'queued' OR (status = 'running' AND locked_until < ?))"
+                f"{type_filter} ORDER BY run_after LIMIT ?",
+                params + [limit]
+            ).fetchall()
+            if not rows:
+                return []
+            db.executemany(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                "locked_by = ?, locked_until = ?, updated_at = ? WHERE id = ?",
+                [(worker_id, now + self.visibility_timeout, now, row["id"]) for row in rows]
+            )
+            ids = [row["id"] for row in rows]
+            rows = db.execute(f"SELECT * FROM jobs WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+        return [Job(row) for row in rows]
+    
+    def complete(self, job: Job, worker_id: str):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'done', locked_by = NULL, locked_until = NULL, updated_at = ? "
+                "WHERE id = ? AND locked_by = ?",
+                (time.time(), job.id, worker_id)
+            )
+    
+    def fail(self, job: Job, worker_id: str, error: str):
+        """Schedule a retry with backoff, or mark the job failed once it is out of attempts."""
+        now = time.time()
+        if job.attempts >= job.max_attempts:
+            status, run_after = "failed", now
+        else:
+            backoff = min(self.retry_backoff * 2 ** (job.attempts - 1), self.max_backoff)
+            status, run_after = "queued", now + backoff * random.uniform(0.8, 1.2)
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, run_after = ?, last_error = ?, "
+                "locked_by = NULL, locked_until = NULL, updated_at = ? "
+                "WHERE id = ? AND locked_by = ?",
+                (status, run_after, error[:2000], now, job.id, worker_id)
+            )
+    
+    def release(self, job: Job, worker_id: str, delay: float):
+        """Requeue a claimed job after `delay` seconds without counting the attempt."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, run_after = ?, "
+                "locked_by = NULL, locked_until = NULL, updated_at = ? "
+                "WHERE id = ? AND locked_by = ?",
+                (now + delay, now, job.id, worker_id)
+            )
+    
+    def prune(self, older_than: float) -> int:
+        """Delete finished jobs last updated more than `older_than` seconds ago."""
+        with self._transaction() as db:
+            return db.execute(
+                "DELETE FROM jobs WHERE status = 'done' AND updated_at < ?",
+                (time.time() - older_than,)
+            ).rowcount
+    
+    def get_stats(self) -> Dict:
+        # Autocommit read: a snapshot without the write lock claims need
+        counts = dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ("queued", "running", "done", "failed")}
+    
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+    
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        # IMMEDIATE takes the write lock up front, so two workers never
+        # claim the same job
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+
+class JobWorker:
+    """
+    Runs claimed jobs with handlers looked up by job type.
+
+    `handlers` maps a job type to a callable taking the list of payloads
+    claimed together for that type. A handler that raises fails all of them,
+    so handlers must be safe to re-run.
+    """
+    
+    def __init__(
+        self,
+        queue: JobQueue,
+        handlers: Dict[str, Callable[[List[Dict]], None]],
+        batch_size: int = 16,
+        poll_interval: float = 1.0,
+        retention: float = 86400.0,
+        name: Optional[str] = None
+    ):
+        self.queue = queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.worker_id = f"{name or 'worker'}-{uuid.uuid4().hex[:8]}@{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def run(self):
+        logger.info(f"Job worker {self.worker_id} started")
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_prune > 3600:
+                    last_prune = time.monotonic()
+                    self.queue.prune(self.retention)
+                seen = self.queue.enqueues
+                if not self.run_once():
+                    self.queue.wait(self.poll_interval, seen)
+            except Exception as e:
+                logger.error(f"Job worker error: {e}", exc_info=True)
+                self._stop.wait(self.poll_interval)
+        logger.info(f"Job worker {self.worker_id} stopped")
+    
+    def run_once(self) -> int:
+        """Claim and run one batch of jobs; returns how many were claimed."""
+        jobs = self.queue.claim(self.worker_id, self.batch_size, list(self.handlers))
+        by_type: Dict[str, List[Job]] = {}
+        for job in jobs:
+            by_type.setdefault(job.type, []).append(job)
+        
+        for job_type, batch in by_type.items():
+            try:
+                self.handlers[job_type]([job.payload for job in batch])
+            except JobDeferred as e:
+                logger.info(f"{len(batch)} {job_type} job(s) deferred {e.delay:.0f}s: {e}")
+                for job in batch:
+                    self.queue.release(job, self.worker_id, e.delay)
+            except Exception as e:
+                logger.warning(f"{len(batch)} {job_type} job(s) failed: {e}")
+                for job in batch:
+                    self.queue.fail(job, self.worker_id, f"{type(e).__name__}: {e}")
+            else:
+                for job in batch:
+                    self.queue.complete(job, self.worker_id)
+        return len(jobs)
+    
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name=f"job-worker-{self.worker_id}", daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout: Optional[float] = None):
+        """Stop after the current batch, waiting up to `timeout` seconds for it to finish."""
+        self._stop.set()
+        self.queue.wake()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,292 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, List, Optional
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+INTERACTIVE = "interactive"
+NEAR_REAL_TIME = "near_real_time"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, NEAR_REAL_TIME, BATCH)
+
+
+class LLMPreempted(Exception):
+    """A queued background call was dropped to make room for interactive ones; retry it later."""
+
+
+class LLMQueueTimeout(Exception):
+    """A call waited longer than its class's queue timeout."""
+
+
+class TokenBucket:
+    """Tokens-per-minute budget; a rate of 0 means unlimited."""
+    
+    def __init__(self, tokens_per_minute: int):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = float(tokens_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, tokens: int) -> float:
+        """Seconds until `tokens` can be spent (0 if now); requests above capacity only need a full bucket."""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        needed = min(tokens, self.capacity) - self.tokens
+        return max(needed / self.rate, 0.0)
+    
+    def spend(self, tokens: int):
+        if self.rate:
+            self._refill()
+            self.tokens -= tokens
+
+
+class _Request:
+    def __init__(self, priority: str, tokens: int, timeout: float):
+        self.priority = priority
+        self.tokens = tokens
+        self.preempted = False
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        # Set for coroutine waiters, which cannot wait on the condition
+        self.wake: Optional[Callable[[], None]] = None
+
+
+class LLMCallSlot:
+    def __init__(self, scheduler: "LLMScheduler", request: _Request):
+        self._scheduler = scheduler
+        self._request = request
+    
+    def record(self, response):
+        """Correct the token budget with the usage Gemini reports for `response`."""
+        usage = getattr(response, "usage_metadata", None)
+        total = getattr(usage, "total_token_count", 0) if usage is not None else 0
+        if total:
+            self._scheduler._adjust(self._request, total)
+
+
+class LLMScheduler:
+    """
+    Admission control for LLM calls made by this process, from threads
+    (`slot`, `generate`) and coroutines (`aslot`, `generate_async`) alike.
+
+    Every call names a priority class. A call starts once its class is under
+    its concurrency limit and token budget, the process-wide limit allows it
+    and no call of a more urgent class is waiting. When an interactive call
+    has to wait, queued batch calls are preempted (they raise `LLMPreempted`
+    and are retried by the job queue), so replies never queue behind
+    background work; background calls already running finish normally.
+    """
+    
+    def __init__(
+        self,
+        max_concurrency: int,
+        concurrency: Dict[str, int],
+        tokens_per_minute: Dict[str, int],
+        queue_timeout: float = 60.0,
+        preempt_batch: bool = True
+    ):
+        self.max_concurrency = max_concurrency
+        self.concurrency = concurrency
+        self.budgets = {priority: TokenBucket(tokens_per_minute.get(priority, 0)) for priority in PRIORITIES}
+        self.queue_timeout = queue_timeout
+        self.preempt_batch = preempt_batch
+        self.running = {priority: 0 for priority in PRIORITIES}
+        self.stats = {priority: {"calls": 0, "tokens": 0, "preempted": 0, "timeouts": 0, "wait_seconds": 0.0} for priority in PRIORITIES}
+        self._waiting: List = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+    
+    @contextmanager
+    def slot(self, priority: str, estimated_tokens: int = 0):
+        """Hold a call slot for the duration of one LLM request."""
+        request = self._acquire(priority, estimated_tokens)
+        try:
+            yield LLMCallSlot(self, request)
+        finally:
+            self._release(priority)
+    
+    @asynccontextmanager
+    async def aslot(self, priority: str, estimated_tokens: int = 0):
+        """`slot` for coroutines; waiting for the slot does not block a thread."""
+        request = await self._acquire_async(priority, estimated_tokens)
+        try:
+            yield LLMCallSlot(self, request)
+        finally:
+            self._release(priority)
+    
+    def generate(self, model, prompt: str, priority: str, expected_output_tokens: int = 256, **kwargs):
+        """`model.generate_content(prompt, **kwargs)` inside a slot of the given class."""
+        with self.slot(priority, estimate_tokens(prompt) + expected_output_tokens) as slot:
+            response = model.generate_content(prompt, **kwargs)
+            slot.record(response)
+            return response
+    
+    async def generate_async(self, model, prompt: str, priority: str, expected_output_tokens: int = 256, **kwargs):
+        """`model.generate_content_async(prompt, **kwargs)` inside a slot of the given class."""
+        async with self.aslot(priority, estimate_tokens(prompt) + expected_output_tokens) as slot:
+            response = await model.generate_content_async(prompt, **kwargs)
+            slot.record(response)
+            return response
+    
+    def get_stats(self) -> Dict:
+        with self._cond:
+            waiting = {priority: 0 for priority in PRIORITIES}
+            for _, _, request in self._waiting:
+                waiting[request.priority] += 1
+            return {
+                priority: {**self.stats[priority], "running": self.running[priority], "waiting": waiting[priority]}
+                for priority in PRIORITIES
+            }
+    
+    def _acquire(self, priority: str, tokens: int) -> _Request:
+        entry = self._enqueue(priority, tokens)
+        with self._cond:
+            while True:
+                wait = self._poll(entry)
+                if wait is None:
+                    return entry[2]
+                self._cond.wait(wait)
+    
+    async def _acquire_async(self, priority: str, tokens: int) -> _Request:
+        entry = self._enqueue(priority, tokens)
+        request = entry[2]
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        request.wake = lambda: loop.call_soon_threadsafe(woken.set)
+        try:
+            while True:
+                with self._cond:
+                    # Cleared under the lock, so a wake-up sent after this
+                    # poll is never lost
+                    woken.clear()
+                    wait = self._poll(entry)
+                if wait is None:
+                    return request
+                try:
+                    await asyncio.wait_for(woken.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._cond:
+                if entry in self._waiting:
+                    self._leave(entry)
+            raise
+    
+    def _enqueue(self, priority: str, tokens: int):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown LLM priority '{priority}', expected one of {PRIORITIES}")
+        entry = (PRIORITIES.index(priority), next(self._sequence), _Request(priority, tokens, self.queue_timeout))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+        return entry
+    
+    def _poll(self, entry) -> Optional[float]:
+        """
+        Admit the waiter if it may start now (returns None), otherwise return
+        how long to wait before polling again. Raises if it was preempted or
+        timed out. Called with the lock held.
+        """
+        request = entry[2]
+        if request.preempted:
+            self._leave(entry)
+            self.stats[request.priority]["preempted"] += 1
+            raise LLMPreempted(f"{request.priority} LLM call preempted by interactive load")
+        delay = self._admission_delay(entry)
+        if delay == 0.0:
+            self._leave(entry)
+            self.running[request.priority] += 1
+            self.budgets[request.priority].spend(request.tokens)
+            stats = self.stats[request.priority]
+            stats["calls"] += 1
+            stats["tokens"] += request.tokens
+            stats["wait_seconds"] += time.monotonic() - request.started
+            return None
+        if request.priority == INTERACTIVE and self.preempt_batch:
+            self._preempt_batch()
+        remaining = request.deadline - time.monotonic()
+        if remaining <= 0:
+            self._leave(entry)
+            self.stats[request.priority]["timeouts"] += 1
+            raise LLMQueueTimeout(f"{request.priority} LLM call waited more than {self.queue_timeout:.0f}s")
+        return remaining if delay is None else min(remaining, delay)
+    
+    def _leave(self, entry):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        # Our leaving may unblock lower-priority waiters
+        self._notify()
+    
+    def _release(self, priority: str):
+        with self._cond:
+            self.running[priority] -= 1
+            self._notify()
+    
+    def _notify(self):
+        self._cond.notify_all()
+        for _, _, request in self._waiting:
+            if request.wake is not None:
+                request.wake()
+    
+    def _admission_delay(self, entry) -> Optional[float]:
+        """0.0 if the waiter may start now, else how long to sleep before re-checking (None: until notified)."""
+        request = entry[2]
+        # Strict priority, FIFO within a class: only the head of the heap may start
+        if self._waiting[0] is not entry:
+            return None
+        if sum(self.running.values()) >= self.max_concurrency:
+            return None
+        if self.running[request.priority] >= self.concurrency.get(request.priority, self.max_concurrency):
+            return None
+        wait = self.budgets[request.priority].wait_time(request.tokens)
+        return wait if wait > 0 else 0.0
+    
+    def _preempt_batch(self):
+        preempted = 0
+        for _, _, request in self._waiting:
+            if request.priority == BATCH and not request.preempted:
+                request.preempted = True
+                preempted += 1
+        if preempted:
+            logger.info(f"Preempted {preempted} queued batch LLM call(s) for interactive load")
+            self._notify()
+    
+    def _adjust(self, request: _Request, actual_tokens: int):
+        with self._cond:
+            self.budgets[request.priority].spend(actual_tokens - request.tokens)
+            self.stats[request.priority]["tokens"] += actual_tokens - request.tokens
+            request.tokens = actual_tokens
+
+
+def estimate_tokens(text: str) -> int:
+    # Gemini averages roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=settings.llm_max_concurrency,
+    concurrency={
+        INTERACTIVE: settings.llm_interactive_concurrency,
+        NEAR_REAL_TIME: settings.llm_near_real_time_concurrency,
+        BATCH: settings.llm_batch_concurrency
+    },
+    tokens_per_minute={
+        INTERACTIVE: settings.llm_interactive_tokens_per_minute,
+        NEAR_REAL_TIME: settings.llm_near_real_time_tokens_per_minute,
+        BATCH: settings.llm_batch_tokens_per_minute
+    },
+    queue_timeout=settings.llm_queue_timeout,
+    preempt_batch=settings.llm_preempt_batch
+)
@@ -14,8 +14,9 @@ def seed_data():
         # Check if characters exist
         if db.query(Character).first():
             logger.info("✅ Database already seeded.")
+            _sync_system_prompts(db)
             return
-
+        
         logger.info(f"🌱 Seeding database with {len(ALL_CHARACTERS)} characters...")
         
         for char_id, profile in ALL_CHARACTERS.items():
@@ -41,9 +42,24 @@ def seed_data():
         
         db.commit()
         logger.info("✅ Database seeding completed successfully!")
-        
+    
     except Exception as e:
         logger.error(f"❌ Error seeding database: {e}")
         db.rollback()
     finally:
         db.close()
+
+
+def _sync_system_prompts(db: Session):
+    """Store the current persona prompts for characters whose definition changed."""
+    updated = 0
+    for character in db.query(Character).all():
+        profile = ALL_CHARACTERS.get(character.id)
+        if profile:
+            system_prompt = profile.build_system_prompt()
+            if character.system_prompt != system_prompt:
+                character.system_prompt = system_prompt
+                updated += 1
+    if updated:
+        db.commit()
+        logger.info(f"✅ Updated the stored system prompt of {updated} character(s)")
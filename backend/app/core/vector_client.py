@@ -0,0 +1,174 @@
+import socket
+import threading
+import numpy as np
+from typing import List, Dict, Optional, Tuple
+from app.core.vector_rpc import send_frame, recv_frame
+
+
+class VectorStoreClient:
+    """
+    Stand-in for `VectorStore` that forwards calls to the shared vector store
+    server (`run_vector_store.py`) over a Unix socket, so every API worker on
+    a host sees the same memories and only the server holds the index.
+
+    Each thread keeps its own connection and the server handles connections
+    concurrently. Failures are reported and swallowed like `VectorStore` does.
+    """
+    
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections: List[socket.socket] = []
+        self._connections_lock = threading.Lock()
+    
+    def add_memory(
+        self,
+        memory_id: str,
+        embedding: List[float],
+        metadata: Dict
+    ):
+        self.add_memories([(memory_id, embedding, metadata)])
+    
+    def add_memories(self, memories: List[Tuple[str, List[float], Dict]]):
+        try:
+            self._call("add_memories", [
+                (memory_id, np.asarray(embedding, dtype=np.float32), metadata)
+                for memory_id, embedding, metadata in memories
+            ])
+        except Exception as e:
+            print(f"Error adding memory to vector store: {e}")
+    
+    def search_similar(
+        self,
+        query_embedding: List[float],
+        user_id: Optional[str] = None,
+        character_id: Optional[str] = None,
+        n_results: int = 5,
+        exclude_conversation_id: Optional[str] = None
+    ) -> List[Dict]:
+        return self.search_similar_batch([{
+            'query_embedding': query_embedding,
+            'user_id': user_id,
+            'character_id': character_id,
+            'n_results': n_results,
+            'exclude_conversation_id': exclude_conversation_id
+        }])[0]
+    
+    def search_similar_batch(self, queries: List[Dict]) -> List[List[Dict]]:
+        try:
+            return self._call("search_similar_batch", [
+                {**query, 'query_embedding': np.asarray(query['query_embedding'], dtype=np.float32)}
+                for query in queries
+            ])
+        except Exception as e:
+            print(f"Error searching vector store: {e}")
+            return [[] for _ in queries]
+    
+    def delete_memory(
+        self,
+        memory_id: str,
+        user_id: Optional[str] = None,
+        character_id: Optional[str] = None
+    ):
+        self.delete_memories([memory_id], user_id=user_id, character_id=character_id)
+    
+    def delete_memories(
+        self,
+        memory_ids: List[str],
+        user_id: Optional[str] = None,
+        character_id: Optional[str] = None
+    ):
+        try:
+            self._call("delete_memories", memory_ids, user_id=user_id, character_id=character_id)
+        except Exception as e:
+            print(f"Error deleting memory: {e}")
+    
+    def get_collection_count(self) -> int:
+        try:
+            return self._call("get_collection_count")
+        except Exception as e:
+            print(f"Error reading vector store count: {e}")
+            return 0
+    
+    def get_stats(self) -> Dict:
+        try:
+            return self._call("get_stats")
+        except Exception as e:
+            print(f"Error reading vector store stats: {e}")
+            return {"live": 0, "deleted": 0, "partitions": 0, "loaded_partitions": 0}
+    
+    def save_index(self):
+        try:
+            self._call("save_index")
+        except Exception as e:
+            print(f"Error saving index: {e}")
+    
+    def partition_keys(self) -> List[Tuple[str, str]]:
+        return [tuple(key) for key in self._call("partition_keys")]
+    
+    def export_partition(self, key: Tuple[str, str]) -> List[Tuple[str, np.ndarray, Dict]]:
+        return self._call("export_partition", key)
+    
+    def import_memories(self, memories: List[Tuple[str, List[float], Dict]]):
+        self._call("import_memories", [
+            (memory_id, np.asarray(embedding, dtype=np.float32), metadata)
+            for memory_id, embedding, metadata in memories
+        ])
+    
+    def drop_partition(self, key: Tuple[str, str]):
+        self._call("drop_partition", key)
+    
+    def close(self):
+        """Close this process's connections; the server keeps running."""
+        with self._connections_lock:
+            for sock in self._connections:
+                sock.close()
+            self._connections = []
+        self._local = threading.local()
+    
+    def _call(self, method: str, *args, **kwargs):
+        reused = getattr(self._local, "sock", None) is not None
+        try:
+            sock = self._connection()
+            send_frame(sock, (method, args, kwargs))
+            reply = recv_frame(sock)
+            if reply is None:
+                raise ConnectionError("Vector store server closed the connection")
+        except socket.timeout:
+            # The server may still apply the request, so it is not retried
+            self._drop_connection()
+            raise
+        except OSError:
+            self._drop_connection()
+            if not reused:
+                raise
+            # A kept-alive connection can go stale when the server restarts;
+            # the request never reached it, so retry once on a fresh one
+            return self._call(method, *args, **kwargs)
+        
+        status, result = reply
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+    
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+            with self._connections_lock:
+                self._connections.append(sock)
+        return sock
+    
+    def _drop_connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            return
+        self._local.sock = None
+        with self._connections_lock:
+            if sock in self._connections:
+                self._connections.remove(sock)
+        sock.close()
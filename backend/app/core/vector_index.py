@@ -0,0 +1,198 @@
+import math
+import faiss
+import numpy as np
+from typing import Iterable, Optional
+
+
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+QUANTIZATIONS = ("none", "fp16", "sq8", "pq")
+# Modes whose search results are re-ranked against full-precision copies
+LOSSY_QUANTIZATIONS = ("sq8", "pq")
+
+# FAISS warns below ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def requires_training(index_type: str, quantization: str) -> bool:
+    return index_type == "ivf" or quantization in LOSSY_QUANTIZATIONS
+
+
+def create_index(
+    index_type: str,
+    dimension: int,
+    quantization: str = "none",
+    hnsw_m: int = 32,
+    hnsw_ef_construction: int = 80,
+    hnsw_ef_search: int = 64
+) -> faiss.Index:
+    """
+    Build an empty ID-mapped index of the configured type.
+
+    IVF and the SQ8/PQ quantizers need training data, so those start out
+    uncompressed and are replaced by `build_index` once enough vectors have
+    been collected. fp16 needs no training and applies right away.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type '{index_type}', expected one of {INDEX_TYPES}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown vector quantization '{quantization}', expected one of {QUANTIZATIONS}")
+    
+    fp16 = quantization == "fp16"
+    if index_type == "hnsw":
+        if fp16:
+            base = faiss.IndexHNSWSQ(dimension, _SQ_TYPES["fp16"], hnsw_m)
+        else:
+            base = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        base.hnsw.efConstruction = hnsw_ef_construction
+        base.hnsw.efSearch = hnsw_ef_search
+    elif index_type == "flat" and fp16:
+        base = faiss.IndexScalarQuantizer(dimension, _SQ_TYPES["fp16"])
+    else:
+        base = faiss.IndexFlatL2(dimension)
+    
+    return faiss.IndexIDMap2(base)
+
+
+def ivf_nlist(n_vectors: int, max_nlist: int) -> int:
+    nlist = min(max_nlist, int(4 * math.sqrt(n_vectors)), n_vectors // MIN_POINTS_PER_CENTROID)
+    return max(nlist, 1)
+
+
+def build_index(
+    index_type: str,
+    quantization: str,
+    vectors: np.ndarray,
+    ids: np.ndarray,
+    hnsw_m: int = 32,
+    hnsw_ef_construction: int = 80,
+    hnsw_ef_search: int = 64,
+    max_nlist: int = 1024,
+    nprobe: int = 16,
+    pq_m: int = 96,
+    pq_nbits: int = 8
+) -> faiss.Index:
+    """Train an index of the configured type and quantization on `vectors` and add them under `ids`."""
+    dimension = vectors.shape[1]
+    
+    # IndexPQ rejects search parameters, so flat PQ is an IVF-PQ with a single
+    # list: still an exhaustive scan, but one that accepts ID selectors
+    if index_type == "ivf" or (index_type == "flat" and quantization == "pq"):
+        nlist = ivf_nlist(len(vectors), max_nlist) if index_type == "ivf" else 1
+        quantizer = faiss.IndexFlatL2(dimension)
+        if quantization == "pq":
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits)
+        elif quantization in _SQ_TYPES:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, _SQ_TYPES[quantization])
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        index.train(vectors)
+        # IVF stores IDs natively; the hashtable direct map keeps them
+        # reconstructable and removable
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        index.add_with_ids(vectors, ids)
+        index.nprobe = min(nprobe, nlist)
+        return index
+    
+    if index_type == "hnsw":
+        if quantization == "pq":
+            base = faiss.IndexHNSWPQ(dimension, pq_m, hnsw_m, pq_nbits)
+        elif quantization in _SQ_TYPES:
+            base = faiss.IndexHNSWSQ(dimension, _SQ_TYPES[quantization], hnsw_m)
+        else:
+            base = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        base.hnsw.efConstruction = hnsw_ef_construction
+        base.hnsw.efSearch = hnsw_ef_search
+    elif quantization in _SQ_TYPES:
+        base = faiss.IndexScalarQuantizer(dimension, _SQ_TYPES[quantization])
+    else:
+        base = faiss.IndexFlatL2(dimension)
+    base.train(vectors)
+    
+    # Lossy indexes are re-ranked from stored full-precision vectors and never
+    # reconstructed, so they skip IndexIDMap2's reverse map
+    if quantization in LOSSY_QUANTIZATIONS:
+        index = faiss.IndexIDMap(base)
+    else:
+        index = faiss.IndexIDMap2(base)
+    index.add_with_ids(vectors, ids)
+    return index
+
+
+def base_index(index: faiss.Index) -> faiss.Index:
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def supports_removal(index: faiss.Index) -> bool:
+    return not isinstance(base_index(index), faiss.IndexHNSW)
+
+
+def tune_index(index: faiss.Index, hnsw_ef_search: int, ivf_nprobe: int):
+    """Apply query-time parameters, which may differ from the ones an index was saved with."""
+    base = base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = hnsw_ef_search
+    elif isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(ivf_nprobe, base.nlist)
+
+
+def search_params(index: faiss.Index, selector: Optional[faiss.IDSelector]) -> Optional[faiss.SearchParameters]:
+    """
+    Wrap an ID selector in the parameter type the underlying index expects.
+
+    Typed parameters override the index's own query-time settings, so those
+    are copied over too.
+    """
+    if selector is None:
+        return None
+    
+    base = base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = base.hnsw.efSearch
+    elif isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = base.nprobe
+    else:
+        params = faiss.SearchParameters()
+    params.sel = selector
+    return params
+
+
+def rerank(query_vector: np.ndarray, ids: np.ndarray, vectors: np.ndarray, k: int):
+    """Exact L2 distances for candidate `ids`, returning the `k` closest as (distances, ids)."""
+    distances = ((vectors - query_vector) ** 2).sum(axis=1)
+    order = np.argsort(distances)[:k]
+    return distances[order], ids[order]
+
+
+def remove_ids(index: faiss.Index, ids: Iterable[int]) -> int:
+    # IDSelectorArray borrows the array, so keep it referenced during the call
+    ids = np.fromiter(ids, dtype=np.int64)
+    return index.remove_ids(faiss.IDSelectorArray(ids))
+
+
+def reconstruct_ids(index: faiss.Index, ids: np.ndarray) -> np.ndarray:
+    if len(ids) == 0:
+        return np.empty((0, index.d), dtype=np.float32)
+    return index.reconstruct_batch(ids)
+
+
+def read_index(path: str, mmap: bool = False) -> faiss.Index:
+    """
+    Load an index, memory-mapping its data where this FAISS build supports it.
+
+    Mapped indexes are read-only; reload with `mmap=False` before modifying.
+    """
+    flags = 0
+    if mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        # Newer FAISS releases can also map flat vector storage
+        flags |= getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    return faiss.read_index(path, flags)
@@ -0,0 +1,278 @@
+import calendar
+import os
+import shutil
+import faiss
+import numpy as np
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+class Interner:
+    """Maps repeated strings (roles, conversation IDs) to small integer codes."""
+    
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values = list(values or [])
+        self.codes = {value: code for code, value in enumerate(self.values)}
+    
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+    
+    def lookup(self, value: str) -> Optional[int]:
+        return self.codes.get(value)
+    
+    def value(self, code: int) -> str:
+        return self.values[code]
+
+
+class MetadataColumns:
+    """
+    Per-vector metadata stored as NumPy columns indexed by vector ID.
+    
+    Vector IDs are assigned sequentially, so row `i` describes vector `i`.
+    Columns grow by doubling, keeping appends amortised O(1), and filters are
+    evaluated as whole-column masks that FAISS consumes as an ID bitmap.
+    
+    Columns loaded from disk are read-only memory maps shared through the OS
+    page cache; they are copied into private growable arrays on first write.
+    A memory_id -> row map for point lookups is built on first use and kept
+    up to date afterwards.
+    """
+    
+    SCHEMA = {
+        "memory_id": np.dtype("S16"),
+        "message_id": np.dtype(np.int64),
+        "conversation": np.dtype(np.int32),
+        "role": np.dtype(np.int16),
+        "timestamp": np.dtype(np.int64),
+        "live": np.dtype(np.bool_),
+    }
+    
+    def __init__(self, capacity: int = 64):
+        self.size = 0
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.SCHEMA.items()}
+        self.conversations = Interner()
+        self.roles = Interner()
+        self.writable = True
+        self._rows: Optional[Dict[bytes, int]] = None
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def append(self, memory_id: str, metadata: Dict) -> int:
+        self.ensure_writable()
+        if self.size == len(self.columns["live"]):
+            self._grow(self.size * 2)
+        
+        encoded_id = memory_id.encode()
+        if len(encoded_id) > self.columns["memory_id"].itemsize:
+            self.columns["memory_id"] = self.columns["memory_id"].astype(f"S{len(encoded_id)}")
+        
+        row = self.size
+        self.columns["memory_id"][row] = encoded_id
+        self.columns["message_id"][row] = int(metadata.get("message_id") or -1)
+        self.columns["conversation"][row] = self.conversations.code(str(metadata.get("conversation_id", "")))
+        self.columns["role"][row] = self.roles.code(metadata.get("role", ""))
+        self.columns["timestamp"][row] = _to_epoch(metadata.get("timestamp"))
+        self.columns["live"][row] = True
+        self.size += 1
+        if self._rows is not None:
+            self._rows[encoded_id] = row
+        return row
+    
+    def mark_deleted(self, row: int):
+        self.ensure_writable()
+        self.columns["live"][row] = False
+        if self._rows is not None:
+            encoded_id = bytes(self.columns["memory_id"][row])
+            if self._rows.get(encoded_id) == row:
+                del self._rows[encoded_id]
+                # An earlier live row with the same ID (a duplicate add) takes over
+                earlier = self._scan(encoded_id)
+                if earlier is not None:
+                    self._rows[encoded_id] = earlier
+    
+    def find(self, memory_id: str) -> Optional[int]:
+        """The last live row holding `memory_id`."""
+        if self._rows is None:
+            live = np.flatnonzero(self.columns["live"][:self.size])
+            # Later rows overwrite earlier duplicates
+            self._rows = dict(zip(self.columns["memory_id"][live].tolist(), live.tolist()))
+        return self._rows.get(memory_id.encode())
+    
+    def memory_id(self, row: int) -> str:
+        return self.columns["memory_id"][row].decode()
+    
+    def row(self, row: int) -> Dict:
+        message_id = int(self.columns["message_id"][row])
+        return {
+            "message_id": str(message_id) if message_id >= 0 else None,
+            "conversation_id": self.conversations.value(self.columns["conversation"][row]),
+            "role": self.roles.value(self.columns["role"][row]),
+            "timestamp": datetime.utcfromtimestamp(int(self.columns["timestamp"][row])).isoformat(),
+        }
+    
+    def filter_mask(self, exclude_conversation_id: Optional[str] = None) -> np.ndarray:
+        mask = np.array(self.columns["live"][:self.size])
+        if exclude_conversation_id is not None:
+            code = self.conversations.lookup(str(exclude_conversation_id))
+            if code is not None:
+                mask &= self.columns["conversation"][:self.size] != code
+        return mask
+    
+    def snapshot(self) -> Dict:
+        return {
+            "columns": {name: np.array(column[:self.size]) for name, column in self.columns.items()},
+            "conversations": list(self.conversations.values),
+            "roles": list(self.roles.values),
+        }
+    
+    @staticmethod
+    def write_snapshot(snapshot: Dict, directory: str) -> Dict:
+        """Write the column files and return the small header fields to store alongside."""
+        for name, column in snapshot["columns"].items():
+            np.save(os.path.join(directory, f"col_{name}.npy"), column)
+        return {"conversations": snapshot["conversations"], "roles": snapshot["roles"]}
+    
+    @classmethod
+    def load(cls, directory: str, header: Dict, mmap: bool = True) -> "MetadataColumns":
+        columns = cls(capacity=0)
+        columns.columns = {
+            name: np.load(os.path.join(directory, f"col_{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in cls.SCHEMA
+        }
+        columns.size = len(columns.columns["live"])
+        columns.conversations = Interner(header["conversations"])
+        columns.roles = Interner(header["roles"])
+        columns.writable = not mmap
+        return columns
+    
+    def ensure_writable(self):
+        if not self.writable:
+            self._grow(max(self.size * 2, 64))
+            self.writable = True
+    
+    def _scan(self, encoded_id: bytes) -> Optional[int]:
+        matches = np.flatnonzero(
+            (self.columns["memory_id"][:self.size] == encoded_id)
+            & self.columns["live"][:self.size]
+        )
+        return int(matches[-1]) if len(matches) else None
+    
+    def _grow(self, capacity: int):
+        capacity = max(capacity, 64)
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+
+class RawVectors:
+    """
+    Full-precision copies of the vectors held by a lossy (SQ8/PQ) index, used
+    to re-rank search candidates exactly. Row `i` is vector ID `i`.
+
+    Checkpointed rows live in memory-mapped segment files that each new
+    partition version hard-links rather than rewrites, so they stay on disk
+    instead of in RAM. Rows added since the last checkpoint are kept in memory.
+    """
+    
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.segments: List[np.ndarray] = []
+        self.segment_paths: List[str] = []
+        # Start row of each segment, plus the start of the in-memory tail
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.tail = np.zeros((0, dimension), dtype=np.float32)
+        self.tail_size = 0
+    
+    def __len__(self) -> int:
+        return int(self.offsets[-1]) + self.tail_size
+    
+    def append(self, vectors: np.ndarray):
+        needed = self.tail_size + len(vectors)
+        if needed > len(self.tail):
+            grown = np.zeros((max(needed, len(self.tail) * 2, 64), self.dimension), dtype=np.float32)
+            grown[:self.tail_size] = self.tail[:self.tail_size]
+            self.tail = grown
+        self.tail[self.tail_size:needed] = vectors
+        self.tail_size = needed
+    
+    def get(self, ids: np.ndarray) -> np.ndarray:
+        vectors = np.empty((len(ids), self.dimension), dtype=np.float32)
+        located = np.searchsorted(self.offsets, ids, side="right") - 1
+        for segment in np.unique(located):
+            rows = located == segment
+            local_ids = ids[rows] - self.offsets[segment]
+            if segment == len(self.segments):
+                vectors[rows] = self.tail[local_ids]
+            else:
+                vectors[rows] = self.segments[segment][local_ids]
+        return vectors
+    
+    def snapshot(self) -> Dict:
+        return {
+            "segments": list(self.segment_paths),
+            "tail": np.array(self.tail[:self.tail_size])
+        }
+    
+    @staticmethod
+    def write_snapshot(snapshot: Dict, directory: str) -> int:
+        """Write the segment files for a snapshot and return how many there are."""
+        paths = list(snapshot["segments"])
+        tail = snapshot["tail"]
+        # Fold trailing segments no larger than the new rows into them, like
+        # a binary counter, so there are O(log n) segments and each row is
+        # rewritten O(log n) times
+        while paths and len(tail) and len(np.load(paths[-1], mmap_mode="r")) <= len(tail):
+            tail = np.concatenate([np.load(paths.pop()), tail])
+        
+        for i, path in enumerate(paths):
+            target = os.path.join(directory, f"vec_{i}.npy")
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copyfile(path, target)
+        if len(tail):
+            np.save(os.path.join(directory, f"vec_{len(paths)}.npy"), tail)
+            return len(paths) + 1
+        return len(paths)
+    
+    @classmethod
+    def load(cls, dimension: int, directory: str, segment_count: int) -> "RawVectors":
+        raw = cls(dimension)
+        raw._map_segments(directory, segment_count)
+        return raw
+    
+    def checkpointed(self, directory: str, segment_count: int):
+        """Switch to the segments written for a snapshot, dropping the tail rows they now hold."""
+        stored = int(self.offsets[-1])
+        self._map_segments(directory, segment_count)
+        written = int(self.offsets[-1]) - stored
+        self.tail_size -= written
+        self.tail = np.array(self.tail[written:written + self.tail_size])
+    
+    def _map_segments(self, directory: str, segment_count: int):
+        self.segment_paths = [os.path.join(directory, f"vec_{i}.npy") for i in range(segment_count)]
+        self.segments = [np.load(path, mmap_mode="r") for path in self.segment_paths]
+        self.offsets = np.concatenate([[0], np.cumsum([len(segment) for segment in self.segments])]).astype(np.int64)
+
+
+class BitmapSelector:
+    """IDSelectorBitmap that owns its bitmap (FAISS only borrows the buffer)."""
+    
+    def __init__(self, mask: np.ndarray):
+        self.bitmap = np.packbits(mask, bitorder="little")
+        self.selector = faiss.IDSelectorBitmap(len(self.bitmap), faiss.swig_ptr(self.bitmap))
+
+
+def _to_epoch(timestamp) -> int:
+    if not timestamp:
+        return 0
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return calendar.timegm(timestamp.utctimetuple())
@@ -0,0 +1,54 @@
+import pickle
+import socket
+import struct
+from typing import Any, Optional
+
+
+# Store methods the vector store server exposes; single-item calls are
+# batches of one on the client side
+METHODS = (
+    "add_memories",
+    "search_similar_batch",
+    "delete_memories",
+    "get_collection_count",
+    "get_stats",
+    "save_index",
+    # Used to move partitions between shards
+    "partition_keys",
+    "export_partition",
+    "import_memories",
+    "drop_partition",
+)
+
+_FRAME = struct.Struct("<I")
+
+
+def send_frame(sock: socket.socket, payload: Any):
+    data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_FRAME.pack(len(data)) + data)
+
+
+def recv_frame(sock: socket.socket) -> Optional[Any]:
+    """Read one length-prefixed pickle frame; None if the peer closed the connection."""
+    header = _recv_exact(sock, _FRAME.size)
+    if header is None:
+        return None
+    (length,) = _FRAME.unpack(header)
+    data = _recv_exact(sock, length)
+    if data is None:
+        raise ConnectionError("Connection closed mid-frame")
+    return pickle.loads(data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            if remaining == size:
+                return None
+            raise ConnectionError("Connection closed mid-frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
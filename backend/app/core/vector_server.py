@@ -0,0 +1,110 @@
+"""
+Shared vector store server.
+
+Owns the one `VectorStore` for a host and serves it to API workers
+(`VectorStoreClient`) over a Unix socket, so N workers neither duplicate the
+index in RAM nor overwrite each other's files. Start it before the workers,
+with the same VECTOR_STORE_SOCKET setting:
+
+    python run_vector_store.py
+"""
+
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+from app.config import settings
+from app.core.vector_rpc import METHODS, send_frame, recv_frame
+from app.core.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection: a sequence of (method, args, kwargs) frames."""
+    
+    def handle(self):
+        store = self.server.store
+        while True:
+            try:
+                request = recv_frame(self.request)
+            except (OSError, EOFError) as e:
+                logger.warning(f"Dropping vector store client connection: {e}")
+                return
+            if request is None:
+                return
+            
+            method, args, kwargs = request
+            if method not in METHODS:
+                reply = ("error", f"Unknown vector store method '{method}'")
+            else:
+                try:
+                    reply = ("ok", getattr(store, method)(*args, **kwargs))
+                except Exception as e:
+                    logger.error(f"Vector store {method} failed: {e}")
+                    reply = ("error", str(e))
+            
+            try:
+                send_frame(self.request, reply)
+            except OSError:
+                return
+
+
+class VectorStoreServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Every API thread keeps its own connection, so bursts of connects are normal
+    request_queue_size = 128
+    
+    def __init__(self, socket_path: str, store: VectorStore):
+        self.store = store
+        super().__init__(socket_path, _RequestHandler)
+        # Only processes running as the same user may talk to the store
+        os.chmod(socket_path, 0o600)
+
+
+def _remove_stale_socket(socket_path: str):
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"A vector store server is already listening on {socket_path}")
+
+
+def main():
+    logging.basicConfig(
+        level=getattr(logging, settings.log_level),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    socket_path = settings.vector_store_socket
+    if not socket_path:
+        raise SystemExit("Set VECTOR_STORE_SOCKET to the socket path shared with the API workers")
+    
+    _remove_stale_socket(socket_path)
+    store = VectorStore()
+    server = VectorStoreServer(socket_path, store)
+    # serve_forever() must be stopped from another thread
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    
+    logger.info(f"Vector store serving {store.get_collection_count()} memories on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        store.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        logger.info("Vector store server stopped")
+
+
+if __name__ == "__main__":
+    main()
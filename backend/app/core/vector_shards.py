@@ -0,0 +1,286 @@
+"""
+Horizontal sharding for the vector store.
+
+Users are hash-partitioned across shards with a consistent-hash ring, so all
+of a user's (user, character) partitions live on one shard. Writes and
+per-user searches go to the owning shard only; searches without a user are
+scattered to every shard and the per-shard top-k lists merged by distance.
+
+Shards are configured with VECTOR_SHARDS as comma-separated `name=target`
+entries, where the target is either
+
+    local:<directory>   a `VectorStore` inside this process (a stand-in for
+                        testing several shards on one machine)
+    unix:<socket path>  a shard served by `run_vector_store.py`
+
+Adding a shard moves only the users the ring reassigns to it. After changing
+VECTOR_SHARDS, stop the API and move existing memories with
+
+    python -m app.core.vector_shards rebalance
+"""
+
+import bisect
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+from app.config import settings
+from app.core.rwlock import ReadWriteLock
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """Consistent-hash ring mapping user IDs to shard names."""
+    
+    def __init__(self, names: List[str], replicas: int = 64):
+        points = sorted(
+            (_hash(f"{name}#{replica}"), name)
+            for name in names
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+    
+    def owner(self, user_id: Optional[str]) -> str:
+        position = bisect.bisect(self._hashes, _hash(user_id or "")) % len(self._hashes)
+        return self._names[position]
+
+
+class ShardedVectorStore:
+    """
+    Routes `VectorStore` calls to shards by user ID.
+
+    Exposes the same API as `VectorStore`, so `RAGService` works unchanged.
+    Routing changes (`add_shard`, `rebalance`) hold the routing lock
+    exclusively, pausing other calls until the moved partitions have landed.
+    """
+    
+    def __init__(self, shards: Dict[str, object], replicas: int = 64):
+        if not shards:
+            raise ValueError("ShardedVectorStore needs at least one shard")
+        self.shards = dict(shards)
+        self.replicas = replicas
+        self.ring = HashRing(list(self.shards), replicas)
+        self._routing = ReadWriteLock()
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="vector-shard")
+    
+    def add_memory(
+        self,
+        memory_id: str,
+        embedding: List[float],
+        metadata: Dict
+    ):
+        self.add_memories([(memory_id, embedding, metadata)])
+    
+    def add_memories(self, memories: List[Tuple[str, List[float], Dict]]):
+        with self._routing.read():
+            by_shard: Dict[str, List] = {}
+            for memory in memories:
+                by_shard.setdefault(self.ring.owner(memory[2].get('user_id')), []).append(memory)
+            self._scatter([
+                (self.shards[name].add_memories, (batch,), {})
+                for name, batch in by_shard.items()
+            ])
+    
+    def import_memories(self, memories: List[Tuple[str, List[float], Dict]]):
+        """Like `add_memories`, but skips memories already stored and raises if any shard fails."""
+        with self._routing.read():
+            by_shard: Dict[str, List] = {}
+            for memory in memories:
+                by_shard.setdefault(self.ring.owner(memory[2].get('user_id')), []).append(memory)
+            futures = [
+                self._executor.submit(self.shards[name].import_memories, batch)
+                for name, batch in by_shard.items()
+            ]
+            for future in futures:
+                future.result()
+    
+    def search_similar(
+        self,
+        query_embedding: List[float],
+        user_id: Optional[str] = None,
+        character_id: Optional[str] = None,
+        n_results: int = 5,
+        exclude_conversation_id: Optional[str] = None
+    ) -> List[Dict]:
+        return self.search_similar_batch([{
+            'query_embedding': query_embedding,
+            'user_id': user_id,
+            'character_id': character_id,
+            'n_results': n_results,
+            'exclude_conversation_id': exclude_conversation_id
+        }])[0]
+    
+    def search_similar_batch(self, queries: List[Dict]) -> List[List[Dict]]:
+        """Search each query on its user's shard, or on every shard when no user is given."""
+        with self._routing.read():
+            by_shard: Dict[str, List[int]] = {}
+            for i, query in enumerate(queries):
+                user_id = query.get('user_id')
+                targets = [self.ring.owner(user_id)] if user_id else list(self.shards)
+                for name in targets:
+                    by_shard.setdefault(name, []).append(i)
+            
+            names = list(by_shard)
+            replies = self._scatter([
+                (self.shards[name].search_similar_batch, ([queries[i] for i in by_shard[name]],), {})
+                for name in names
+            ])
+        
+        results: List[List[Dict]] = [[] for _ in queries]
+        for name, reply in zip(names, replies):
+            for i, memories in zip(by_shard[name], reply or []):
+                results[i].extend(memories)
+        for query, memories in zip(queries, results):
+            memories.sort(key=lambda m: m['distance'])
+            del memories[query.get('n_results', 5):]
+        return results
+    
+    def delete_memory(
+        self,
+        memory_id: str,
+        user_id: Optional[str] = None,
+        character_id: Optional[str] = None
+    ):
+        self.delete_memories([memory_id], user_id=user_id, character_id=character_id)
+    
+    def delete_memories(
+        self,
+        memory_ids: List[str],
+        user_id: Optional[str] = None,
+        character_id: Optional[str] = None
+    ):
+        with self._routing.read():
+            names = [self.ring.owner(user_id)] if user_id else list(self.shards)
+            self._scatter([
+                (self.shards[name].delete_memories, (memory_ids,), {'user_id': user_id, 'character_id': character_id})
+                for name in names
+            ])
+    
+    def get_collection_count(self) -> int:
+        with self._routing.read():
+            return sum(count or 0 for count in self._scatter([
+                (store.get_collection_count, (), {}) for store in self.shards.values()
+            ]))
+    
+    def get_stats(self) -> Dict:
+        with self._routing.read():
+            per_shard = self._scatter([(store.get_stats, (), {}) for store in self.shards.values()])
+        stats = {"live": 0, "deleted": 0, "partitions": 0, "loaded_partitions": 0}
+        for shard_stats in per_shard:
+            for name, value in (shard_stats or {}).items():
+                stats[name] = stats.get(name, 0) + value
+        stats["shards"] = len(per_shard)
+        return stats
+    
+    def partition_keys(self) -> List[Tuple[str, str]]:
+        with self._routing.read():
+            return [key for keys in self._scatter([
+                (store.partition_keys, (), {}) for store in self.shards.values()
+            ]) for key in keys or []]
+    
+    def save_index(self):
+        with self._routing.read():
+            self._scatter([(store.save_index, (), {}) for store in self.shards.values()])
+    
+    def add_shard(self, name: str, store) -> int:
+        """Add a shard and move the users the ring now assigns to it; returns the partitions moved."""
+        with self._routing.write():
+            if name in self.shards:
+                raise ValueError(f"Vector shard '{name}' already exists")
+            self.shards[name] = store
+            self.ring = HashRing(list(self.shards), self.replicas)
+            return self._rebalance()
+    
+    def rebalance(self) -> int:
+        """Move every partition that is not on the shard owning its user; returns the partitions moved."""
+        with self._routing.write():
+            return self._rebalance()
+    
+    def close(self):
+        with self._routing.write():
+            for store in self.shards.values():
+                store.close()
+            self._executor.shutdown(wait=False)
+    
+    def _rebalance(self) -> int:
+        # The destination skips memories it already holds, so a move that
+        # failed after importing is safely redone by the next rebalance
+        moved = 0
+        for source_name, source in list(self.shards.items()):
+            for key in source.partition_keys():
+                owner = self.ring.owner(key[0])
+                if owner == source_name:
+                    continue
+                self.shards[owner].import_memories(source.export_partition(key))
+                source.drop_partition(key)
+                moved += 1
+                logger.info(f"Moved vector partition {key} from shard {source_name} to {owner}")
+        return moved
+    
+    def _scatter(self, calls: List[Tuple]) -> List:
+        """Run (function, args, kwargs) calls concurrently; a failed call yields None."""
+        if len(calls) == 1:
+            function, args, kwargs = calls[0]
+            return [_call_shard(function, args, kwargs)]
+        futures = [self._executor.submit(_call_shard, function, args, kwargs) for function, args, kwargs in calls]
+        return [future.result() for future in futures]
+
+
+def create_sharded_store(spec: str, replicas: int = 64) -> ShardedVectorStore:
+    """Build a `ShardedVectorStore` from a VECTOR_SHARDS value."""
+    from app.core.vector_client import VectorStoreClient
+    from app.core.vector_store import VectorStore
+    
+    shards = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, target = entry.partition("=")
+        kind, _, location = target.partition(":")
+        if not name or not location or name in shards:
+            raise ValueError(f"Invalid vector shard entry '{entry}'")
+        if kind == "local":
+            shards[name] = VectorStore(location)
+        elif kind == "unix":
+            shards[name] = VectorStoreClient(location, timeout=settings.vector_store_timeout)
+        else:
+            raise ValueError(f"Unknown vector shard type '{kind}' in '{entry}', expected local or unix")
+    return ShardedVectorStore(shards, replicas)
+
+
+def _call_shard(function, args, kwargs):
+    try:
+        return function(*args, **kwargs)
+    except Exception as e:
+        logger.error(f"Vector shard call {function.__name__} failed: {e}")
+        return None
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def main():
+    import sys
+    logging.basicConfig(
+        level=getattr(logging, settings.log_level),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if sys.argv[1:] != ["rebalance"]:
+        raise SystemExit("Usage: python -m app.core.vector_shards rebalance")
+    if not settings.vector_shards:
+        raise SystemExit("Set VECTOR_SHARDS to the shard list to rebalance")
+    
+    # With VECTOR_SHARDS set the module-level store is the sharded store;
+    # building a second one would open every local shard twice
+    from app.core.vector_store import vector_store as store
+    try:
+        moved = store.rebalance()
+        store.save_index()
+        logger.info(f"Rebalanced {moved} partitions across {len(store.shards)} shards")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
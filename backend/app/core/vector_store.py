@@ -1,142 +1,948 @@
 import faiss
 import numpy as np
 import pickle
+import hashlib
 import os
-from typing import List, Dict, Optional
-from datetime import datetime
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from app.config import settings
+from app.core.vector_wal import WriteAheadLog, atomic_write
+from app.core import vector_index
+from app.core.rwlock import ReadWriteLock
+from app.core.vector_metadata import MetadataColumns, RawVectors, BitmapSelector
+
+
+PartitionKey = Tuple[str, str]
+
+# Partition directories are named `<key digest>-<checkpoint lsn>`
+_PARTITION_DIR = re.compile(r"^[0-9a-f]{32}-\d+(\.tmp)?$")
+
+
+class Partition:
+    """Sub-index holding the memories of one (user_id, character_id) pair."""
+    
+    def __init__(self, key: PartitionKey, dimension: int):
+        self.key = key
+        self.dimension = dimension
+        self.index = vector_index.create_index(
+            settings.vector_index_type,
+            dimension,
+            quantization=settings.vector_quantization,
+            hnsw_m=settings.vector_hnsw_m,
+            hnsw_ef_search=settings.vector_hnsw_ef_search
+        )
+        # Set while `index` is a read-only memory map of this file
+        self.mapped_index_path: Optional[str] = None
+        self.trained_size = 0
+        # Full-precision vectors for re-ranking, once the index is lossy
+        self.raw: Optional[RawVectors] = None
+        # Row i of the metadata columns describes vector ID i
+        self.columns = MetadataColumns()
+        self.live_count = 0
+        # Deleted IDs still present in the index until the next compaction
+        self.tombstones = set()
+        self.lsn = 0
+        # Modification counter; the partition is dirty until a checkpoint has
+        # written out everything up to `changes`
+        self.changes = 0
+        self.saved_changes = 0
+        self.last_used = time.monotonic()
+        self._live_selector = None
+    
+    @property
+    def dirty(self) -> bool:
+        return self.changes != self.saved_changes
+    
+    def mark_dirty(self):
+        self.changes += 1
+    
+    @property
+    def dead_count(self) -> int:
+        return len(self.tombstones)
+    
+    @property
+    def next_id(self) -> int:
+        return len(self.columns)
+    
+    def add(self, memory_id: str, vector: np.ndarray, metadata: Dict):
+        self.ensure_writable()
+        vector_id = self.columns.append(memory_id, metadata)
+        self.index.add_with_ids(vector, np.array([vector_id], dtype=np.int64))
+        if self.raw is not None:
+            self.raw.append(vector)
+        self.live_count += 1
+        self._live_selector = None
+    
+    def delete(self, memory_id: str) -> bool:
+        vector_id = self.columns.find(memory_id)
+        if vector_id is None:
+            return False
+        self.columns.mark_deleted(vector_id)
+        self.tombstones.add(vector_id)
+        self.live_count -= 1
+        self._live_selector = None
+        return True
+    
+    def contains(self, memory_id: str) -> bool:
+        return self.columns.find(memory_id) is not None
+    
+    def export(self) -> List[Tuple[str, np.ndarray, Dict]]:
+        ids = self.live_ids()
+        vectors = self.vectors(ids)
+        return [
+            (
+                self.columns.memory_id(vector_id),
+                vectors[i],
+                {'user_id': self.key[0], 'character_id': self.key[1], **self.columns.row(vector_id)}
+            )
+            for i, vector_id in enumerate(ids)
+        ]
+    
+    def live_ids(self) -> np.ndarray:
+        return np.flatnonzero(self.columns.filter_mask()).astype(np.int64)
+    
+    def vectors(self, ids: np.ndarray) -> np.ndarray:
+        if self.raw is not None:
+            return self.raw.get(ids)
+        return vector_index.reconstruct_ids(self.index, ids)
+    
+    def ensure_writable(self):
+        if self.mapped_index_path:
+            self.index = vector_index.read_index(self.mapped_index_path)
+            self._tune()
+            self.mapped_index_path = None
+        self.columns.ensure_writable()
+    
+    def needs_training(self) -> bool:
+        index_type, quantization = settings.vector_index_type, settings.vector_quantization
+        if not vector_index.requires_training(index_type, quantization):
+            return False
+        
+        threshold = 0
+        if index_type == "ivf":
+            threshold = settings.vector_ivf_train_threshold
+        if quantization in vector_index.LOSSY_QUANTIZATIONS:
+            threshold = max(threshold, settings.vector_quantizer_train_threshold)
+        if self.index.ntotal < threshold:
+            return False
+        if not self.trained_size:
+            return True
+        # Only IVF partitions are retrained as they grow; codebooks stay put
+        return index_type == "ivf" and self.index.ntotal >= self.trained_size * settings.vector_ivf_retrain_growth
+    
+    def needs_compaction(self) -> bool:
+        if not self.tombstones:
+            return False
+        return self.dead_count >= settings.vector_compaction_ratio * self.index.ntotal
+    
+    def remove_tombstones(self):
+        self.ensure_writable()
+        vector_index.remove_ids(self.index, self.tombstones)
+        self.tombstones = set()
+    
+    def replace_index(self, index: faiss.Index, tombstones: set, raw: Optional[RawVectors] = None):
+        self.index = index
+        self.mapped_index_path = None
+        self.tombstones = tombstones
+        if raw is not None:
+            self.raw = raw
+    
+    def search(
+        self,
+        query_vector: np.ndarray,
+        n_results: int,
+        exclude_conversation_id: Optional[str] = None
+    ) -> List[Dict]:
+        if not self.live_count:
+            return []
+        
+        if exclude_conversation_id is not None and self.columns.conversations.lookup(str(exclude_conversation_id)) is None:
+            exclude_conversation_id = None
+        
+        # Filters run inside FAISS as an ID bitmap rather than on the hits
+        selector = None
+        if exclude_conversation_id is not None:
+            selector = BitmapSelector(self.columns.filter_mask(exclude_conversation_id))
+        elif self.tombstones:
+            if self._live_selector is None:
+                self._live_selector = BitmapSelector(self.columns.filter_mask())
+            selector = self._live_selector
+        
+        k = min(n_results, self.live_count)
+        # Lossy indexes fetch extra candidates and re-rank them exactly
+        rerank = self.raw is not None and settings.vector_rerank_factor > 1
+        candidates = min(k * settings.vector_rerank_factor, self.live_count) if rerank else k
+        distances, ids = self.index.search(
+            query_vector, candidates,
+            params=vector_index.search_params(self.index, selector.selector if selector else None)
+        )
+        distances, ids = distances[0], ids[0]
+        if rerank:
+            ids = ids[ids != -1]
+            distances, ids = vector_index.rerank(query_vector, ids, self.raw.get(ids), k)
+        
+        memories = []
+        for i, vector_id in enumerate(ids):
+            if vector_id == -1:
+                continue
+            
+            memories.append({
+                'id': self.columns.memory_id(vector_id),
+                'metadata': {
+                    'user_id': self.key[0],
+                    'character_id': self.key[1],
+                    **self.columns.row(vector_id)
+                },
+                'distance': float(distances[i])
+            })
+        
+        return memories
+    
+    def snapshot(self) -> Dict:
+        """Copy the partition's state so it can be written without holding the store lock."""
+        return {
+            # A still-mapped index is unchanged since load, and serializing a
+            # mapped IVF index would only record a reference to its file
+            'index': None if self.mapped_index_path else faiss.serialize_index(self.index),
+            'index_path': self.mapped_index_path,
+            'columns': self.columns.snapshot(),
+            'raw': self.raw.snapshot() if self.raw is not None else None,
+            'raw_source': self.raw,
+            'header': {
+                'key': self.key,
+                'live_count': self.live_count,
+                'tombstones': set(self.tombstones),
+                'lsn': self.lsn,
+                'trained_size': self.trained_size
+            }
+        }
+    
+    @staticmethod
+    def write_snapshot(snapshot: Dict, directory: str) -> Dict:
+        """Write a snapshot into a new partition directory and return its header."""
+        os.makedirs(directory)
+        index_path = os.path.join(directory, "index.faiss")
+        if snapshot['index'] is None:
+            shutil.copyfile(snapshot['index_path'], index_path)
+        else:
+            with open(index_path, 'wb') as f:
+                f.write(snapshot['index'].tobytes())
+        header = dict(snapshot['header'])
+        header.update(MetadataColumns.write_snapshot(snapshot['columns'], directory))
+        header['raw_segments'] = None
+        if snapshot['raw'] is not None:
+            header['raw_segments'] = RawVectors.write_snapshot(snapshot['raw'], directory)
+        with open(os.path.join(directory, "header.pkl"), 'wb') as f:
+            pickle.dump(header, f)
+        return header
+    
+    def checkpointed(self, snapshot: Dict, changes: int, directory: str, header: Dict):
+        """Point the partition at the files written for `snapshot`."""
+        self.saved_changes = changes
+        if self.mapped_index_path:
+            # The index was not modified since the snapshot, so the new file
+            # holds the same data
+            self.mapped_index_path = os.path.join(directory, "index.faiss")
+        if self.raw is not None and self.raw is snapshot['raw_source']:
+            self.raw.checkpointed(directory, header['raw_segments'])
+    
+    @classmethod
+    def load(cls, key: PartitionKey, dimension: int, directory: str, mmap: bool = True) -> "Partition":
+        with open(os.path.join(directory, "header.pkl"), 'rb') as f:
+            header = pickle.load(f)
+        
+        partition = cls(key, dimension)
+        index_path = os.path.join(directory, "index.faiss")
+        partition.index = vector_index.read_index(index_path, mmap=mmap)
+        partition.mapped_index_path = index_path if mmap else None
+        partition._tune()
+        partition.columns = MetadataColumns.load(directory, header, mmap=mmap)
+        partition.live_count = header['live_count']
+        partition.tombstones = header['tombstones']
+        partition.lsn = header['lsn']
+        partition.trained_size = header['trained_size']
+        if header.get('raw_segments') is not None:
+            partition.raw = RawVectors.load(dimension, directory, header['raw_segments'])
+        return partition
+    
+    def _tune(self):
+        vector_index.tune_index(
+            self.index,
+            hnsw_ef_search=settings.vector_hnsw_ef_search,
+            ivf_nprobe=settings.vector_ivf_nprobe
+        )
 
 
 class VectorStore:
+    """
+    FAISS-backed memory store partitioned by (user_id, character_id).
+
+    Only vectors, IDs and small filter columns are held here; message text
+    stays in the database and search hits are hydrated by the caller.
     
-    def __init__(self):
+    Each partition has its own ID-mapped sub-index, so a filtered query only
+    scans the caller's memories. Partitions are loaded lazily from
+    `partitions/` and evicted least-recently-used once they are idle or over
+    the resident limit. Writes go to a write-ahead log and reach disk in
+    background checkpoints. Deletes tombstone an ID (excluded from searches
+    right away) and compaction later removes it from the index.
+
+    Checkpointed partitions are immutable directories that are memory-mapped
+    on load, so startup cost does not grow with the number of stored vectors.
+
+    Concurrency: searches run in parallel under the read side of `_rwlock`.
+    Writers are serialized by `_write_lock`, which also fixes the order of
+    write-ahead log records, and only take the write side of `_rwlock` while
+    applying a change in memory, so every search sees the store as of a
+    single point in the log. The partition table has its own small lock
+    because searches load partitions on demand; only writers evict them.
+    """
+    
+    def __init__(self, data_dir: Optional[str] = None):
         self.dimension = 768
-        self.index_path = "./data/faiss_index.bin"
-        self.metadata_path = "./data/faiss_metadata.pkl"
+        self.data_dir = data_dir or settings.vector_store_dir
+        self.partition_dir = os.path.join(self.data_dir, "partitions")
+        self.manifest_path = os.path.join(self.data_dir, "faiss_manifest.pkl")
+        self.wal_path = os.path.join(self.data_dir, "faiss_wal.log")
+        # Single-index files written by earlier versions, migrated on first start
+        self.legacy_index_path = os.path.join(self.data_dir, "faiss_index.bin")
+        self.legacy_metadata_path = os.path.join(self.data_dir, "faiss_metadata.pkl")
+        
+        os.makedirs(self.partition_dir, exist_ok=True)
+        
+        self._rwlock = ReadWriteLock()
+        self._write_lock = threading.Lock()
+        self._partitions_lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._checkpoint_requested = threading.Event()
+        self._closed = threading.Event()
+        self.lsn = 0
+        self.checkpoint_lsn = 0
         
-        os.makedirs("./data", exist_ok=True)
+        self.partitions: "OrderedDict[PartitionKey, Partition]" = OrderedDict()
+        # (live, tombstoned) counts per partition, plus running totals
+        self.catalog: Dict[PartitionKey, Tuple[int, int]] = {}
+        # Checkpoint LSN naming each partition's current directory on disk
+        self.versions: Dict[PartitionKey, int] = {}
+        self._dropped_paths: List[str] = []
+        self.live_count = 0
+        self.dead_count = 0
         
-        if os.path.exists(self.index_path) and os.path.exists(self.metadata_path):
+        if os.path.exists(self.manifest_path):
             self.load_index()
-        else:
-            self.index = faiss.IndexFlatL2(self.dimension)
-            self.metadata = []
-            self.id_to_idx = {}
+        elif os.path.exists(self.legacy_index_path) and os.path.exists(self.legacy_metadata_path):
+            self._migrate_legacy_index()
+        self._remove_unreferenced_partitions()
+        
+        self.wal = WriteAheadLog(self.wal_path, fsync=settings.vector_wal_fsync)
+        self._replay_wal()
+        
+        self._checkpointer = threading.Thread(
+            target=self._checkpoint_loop,
+            name="vector-store-checkpoint",
+            daemon=True
+        )
+        self._checkpointer.start()
     
     def add_memory(
         self,
         memory_id: str,
-        text: str,
         embedding: List[float],
         metadata: Dict
     ):
+        self.add_memories([(memory_id, embedding, metadata)])
+    
+    def add_memories(self, memories: List[Tuple[str, List[float], Dict]]):
+        """Add (memory_id, embedding, metadata) triples with one log flush and lock acquisition."""
         try:
-            vector = np.array([embedding], dtype=np.float32)
-            
-            self.index.add(vector)
-            
-            idx = len(self.metadata)
-            self.id_to_idx[memory_id] = idx
-            self.metadata.append({
-                'id': memory_id,
-                'text': text,
-                **metadata
-            })
-            
-            self.save_index()
+            self._add_memories(memories)
         except Exception as e:
             print(f"Error adding memory to vector store: {e}")
     
+    def import_memories(self, memories: List[Tuple[str, List[float], Dict]]):
+        """
+        Like `add_memories`, but skips memories already stored so a retried
+        shard move is harmless. Raises on failure, since the caller is about
+        to drop the source copy.
+        """
+        self._add_memories(memories, skip_existing=True)
+    
+    def export_partition(self, key: PartitionKey) -> List[Tuple[str, np.ndarray, Dict]]:
+        """Live memories of one partition as (memory_id, vector, metadata), e.g. to move it to another shard."""
+        key = tuple(key)
+        with self._rwlock.read():
+            if key not in self.catalog:
+                return []
+            return self._get_partition(key, evict=False).export()
+    
+    def drop_partition(self, key: PartitionKey):
+        """Remove a whole (user_id, character_id) partition."""
+        key = tuple(key)
+        with self._write_lock:
+            if key not in self.catalog:
+                return
+            self.lsn += 1
+            self.wal.append(self.lsn, ("drop", key))
+            with self._rwlock.write():
+                self._apply_drop(self.lsn, key)
+    
+    def partition_keys(self) -> List[PartitionKey]:
+        with self._rwlock.read():
+            return list(self.catalog)
+    
+    def _add_memories(self, memories: List[Tuple[str, List[float], Dict]], skip_existing: bool = False):
+        records = [
+            (memory_id, np.array([embedding], dtype=np.float32), metadata)
+            for memory_id, embedding, metadata in memories
+        ]
+        
+        with self._write_lock:
+            if skip_existing:
+                # Only writers modify partitions, so the lookup needs no read lock
+                records = self._without_existing(records)
+            if not records:
+                return
+            first_lsn = self.lsn + 1
+            self.wal.append_many([
+                (lsn, ("add", memory_id, vector, metadata))
+                for lsn, (memory_id, vector, metadata) in enumerate(records, first_lsn)
+            ])
+            self.lsn += len(records)
+            with self._rwlock.write():
+                for lsn, (memory_id, vector, metadata) in enumerate(records, first_lsn):
+                    self._apply_add(lsn, memory_id, vector, metadata)
+            pending = self.lsn - self.checkpoint_lsn
+        
+        if pending >= settings.vector_checkpoint_max_ops:
+            self._checkpoint_requested.set()
+    
     def search_similar(
         self,
         query_embedding: List[float],
         user_id: Optional[str] = None,
         character_id: Optional[str] = None,
-        n_results: int = 5
+        n_results: int = 5,
+        exclude_conversation_id: Optional[str] = None
     ) -> List[Dict]:
-        try:
-            if self.index.ntotal == 0:
-                return []
-            
-            query_vector = np.array([query_embedding], dtype=np.float32)
-            
-            k = min(n_results * 3, self.index.ntotal)
-            distances, indices = self.index.search(query_vector, k)
-            
-            memories = []
-            for i, idx in enumerate(indices[0]):
-                if idx == -1:
-                    continue
-                
-                meta = self.metadata[idx]
-                
-                if user_id and meta.get('user_id') != user_id:
-                    continue
-                if character_id and meta.get('character_id') != character_id:
-                    continue
-                
-                memories.append({
-                    'id': meta['id'],
-                    'text': meta['text'],
-                    'metadata': {k: v for k, v in meta.items() if k not in ['id', 'text']},
-                    'distance': float(distances[0][i])
-                })
-                
-                if len(memories) >= n_results:
-                    break
-            
-            return memories
-        except Exception as e:
-            print(f"Error searching vector store: {e}")
-            return []
+        return self.search_similar_batch([{
+            'query_embedding': query_embedding,
+            'user_id': user_id,
+            'character_id': character_id,
+            'n_results': n_results,
+            'exclude_conversation_id': exclude_conversation_id
+        }])[0]
+    
+    def search_similar_batch(self, queries: List[Dict]) -> List[List[Dict]]:
+        """Run several searches (dicts of `search_similar` arguments) against one consistent snapshot."""
+        results = []
+        with self._rwlock.read():
+            for query in queries:
+                try:
+                    results.append(self._search(**query))
+                except Exception as e:
+                    print(f"Error searching vector store: {e}")
+                    results.append([])
+        return results
+    
+    def delete_memory(
+        self,
+        memory_id: str,
+        user_id: Optional[str] = None,
+        character_id: Optional[str] = None
+    ):
+        self.delete_memories([memory_id], user_id=user_id, character_id=character_id)
     
-    def delete_memory(self, memory_id: str):
+    def delete_memories(
+        self,
+        memory_ids: List[str],
+        user_id: Optional[str] = None,
+        character_id: Optional[str] = None
+    ):
+        """Delete memories, looking them up only in the given user's/character's partitions when known."""
         try:
-            if memory_id in self.id_to_idx:
-                idx = self.id_to_idx[memory_id]
-                self.metadata[idx]['deleted'] = True
-                self.save_index()
+            # Only writers modify partitions, so the lookup needs no read lock
+            with self._write_lock:
+                keys = self._matching_keys(user_id, character_id)
+                deletes = []
+                for memory_id in memory_ids:
+                    for key in keys:
+                        if self._get_partition(key).contains(memory_id):
+                            deletes.append((memory_id, key))
+                            break
+                if not deletes:
+                    return
+                
+                first_lsn = self.lsn + 1
+                self.wal.append_many([
+                    (lsn, ("delete", memory_id, key))
+                    for lsn, (memory_id, key) in enumerate(deletes, first_lsn)
+                ])
+                self.lsn += len(deletes)
+                with self._rwlock.write():
+                    for lsn, (memory_id, key) in enumerate(deletes, first_lsn):
+                        self._apply_delete(lsn, memory_id, key)
         except Exception as e:
             print(f"Error deleting memory: {e}")
     
     def get_collection_count(self) -> int:
-        try:
-            return sum(1 for m in self.metadata if not m.get('deleted', False))
-        except Exception as e:
-            print(f"Error getting collection count: {e}")
-            return 0
+        return self.live_count
+    
+    def get_stats(self) -> Dict:
+        with self._rwlock.read():
+            return {
+                "live": self.live_count,
+                "deleted": self.dead_count,
+                "partitions": len(self.catalog),
+                "loaded_partitions": len(self.partitions)
+            }
     
     def save_index(self):
-        try:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump({
-                    'metadata': self.metadata,
-                    'id_to_idx': self.id_to_idx
-                }, f)
-        except Exception as e:
-            print(f"Error saving index: {e}")
+        self.checkpoint(force=True)
+    
+    def checkpoint(self, force: bool = False):
+        """
+        Persist dirty partitions plus the manifest and truncate the write-ahead log.
+
+        Only the log rotation and the in-memory snapshot block writers; file
+        writes run without blocking new adds, and searches are only paused
+        while the written versions are swapped in. Each partition
+        is written to a fresh directory and the manifest switched over to it,
+        so memory maps of the previous version stay valid.
+        """
+        with self._checkpoint_lock:
+            try:
+                with self._write_lock:
+                    resident = self._resident_partitions()
+                    has_dirty = any(p.dirty for p in resident)
+                    if self.lsn == self.checkpoint_lsn and not has_dirty and not force:
+                        return
+                    self.wal.rotate()
+                    snapshot_lsn = self.lsn
+                    dirty = [
+                        (partition, partition.changes, partition.snapshot())
+                        for partition in resident if partition.dirty
+                    ]
+                
+                headers = [
+                    self._write_partition(partition.key, snapshot_lsn, snapshot)
+                    for partition, _, snapshot in dirty
+                ]
+                
+                with self._write_lock, self._rwlock.write():
+                    superseded, self._dropped_paths = self._dropped_paths, []
+                    for (partition, changes, snapshot), header in zip(dirty, headers):
+                        key = partition.key
+                        if self.partitions.get(key) is not partition:
+                            # Dropped while its snapshot was being written
+                            superseded.append(self._partition_path(key, snapshot_lsn))
+                            continue
+                        if key in self.versions and self.versions[key] != snapshot_lsn:
+                            superseded.append(self._partition_path(key, self.versions[key]))
+                        self.versions[key] = snapshot_lsn
+                        partition.checkpointed(snapshot, changes, self._partition_path(key, snapshot_lsn), header)
+                    manifest = self._manifest_bytes(snapshot_lsn)
+                
+                atomic_write(self.manifest_path, manifest)
+                self.wal.discard_rotated()
+                self.checkpoint_lsn = snapshot_lsn
+                # Open memory maps keep unlinked files readable
+                for path in superseded:
+                    shutil.rmtree(path, ignore_errors=True)
+            except Exception as e:
+                print(f"Error saving index: {e}")
     
     def load_index(self):
         try:
-            self.index = faiss.read_index(self.index_path)
-            with open(self.metadata_path, 'rb') as f:
+            with open(self.manifest_path, 'rb') as f:
                 data = pickle.load(f)
-                self.metadata = data['metadata']
-                self.id_to_idx = data['id_to_idx']
+                self.catalog = {
+                    key: counts if isinstance(counts, tuple) else (counts, 0)
+                    for key, counts in data['catalog'].items()
+                }
+                self.versions = data.get('versions', {})
+                self.lsn = self.checkpoint_lsn = data['lsn']
+            self.live_count = sum(live for live, _ in self.catalog.values())
+            self.dead_count = sum(dead for _, dead in self.catalog.values())
         except Exception as e:
             print(f"Error loading index: {e}")
-            self.index = faiss.IndexFlatL2(self.dimension)
-            self.metadata = []
-            self.id_to_idx = {}
+            self.catalog = {}
+            self.versions = {}
     
     def reset_collection(self):
         try:
-            self.index = faiss.IndexFlatL2(self.dimension)
-            self.metadata = []
-            self.id_to_idx = {}
-            self.save_index()
+            with self._checkpoint_lock, self._write_lock, self._rwlock.write(), self._partitions_lock:
+                self.partitions = OrderedDict()
+                self.catalog = {}
+                self.versions = {}
+                self._dropped_paths = []
+                self.live_count = 0
+                self.dead_count = 0
+                self.wal.truncate()
+                atomic_write(self.manifest_path, self._manifest_bytes(self.lsn))
+                self.checkpoint_lsn = self.lsn
+                self._remove_unreferenced_partitions()
         except Exception as e:
             print(f"Error resetting collection: {e}")
+    
+    def train_partitions(self):
+        """(Re)build IVF indexes for partitions that have grown past the training threshold."""
+        with self._partitions_lock:
+            candidates = [p for p in self.partitions.values() if p.needs_training()]
+        
+        for partition in candidates:
+            try:
+                if self._rebuild_partition(partition, trained=True):
+                    print(f"Trained {settings.vector_index_type}/{settings.vector_quantization} index for partition {partition.key} on {partition.trained_size} vectors")
+            except Exception as e:
+                print(f"Error training partition index: {e}")
+    
+    def compact_partitions(self):
+        """
+        Physically remove tombstoned vectors once they make up more than
+        `vector_compaction_ratio` of a partition's index.
+
+        Flat and IVF indexes drop the IDs in place; HNSW cannot remove
+        vectors, so its graph is rebuilt from the live ones.
+        """
+        with self._write_lock, self._rwlock.write():
+            rebuild = []
+            for partition in self._resident_partitions():
+                if not partition.needs_compaction():
+                    continue
+                if vector_index.supports_removal(partition.index):
+                    partition.remove_tombstones()
+                    partition.mark_dirty()
+                    self._update_catalog(partition)
+                else:
+                    rebuild.append(partition)
+        
+        for partition in rebuild:
+            try:
+                self._rebuild_partition(partition, trained=bool(partition.trained_size))
+            except Exception as e:
+                print(f"Error compacting partition index: {e}")
+    
+    def close(self):
+        """Stop the background checkpointer and flush everything to disk."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._checkpoint_requested.set()
+        self._checkpointer.join(timeout=10)
+        self.checkpoint()
+        self.wal.close()
+    
+    def _rebuild_partition(self, partition: Partition, trained: bool) -> bool:
+        """
+        Build a replacement index from a partition's live vectors, trained
+        (IVF, SQ8/PQ) or in the uncompressed form partitions start out with.
+
+        The build runs on a copy without blocking writers or searches;
+        vectors added meanwhile are appended to the new index before it is
+        swapped in, and only deletes that happened during the build stay
+        tombstoned.
+        """
+        with self._rwlock.read():
+            ids = partition.live_ids()
+            vectors = partition.vectors(ids)
+            snapshot_next_id = partition.next_id
+            snapshot_tombstones = set(partition.tombstones)
+        
+        index = self._build_index(vectors, ids, trained)
+        
+        with self._write_lock, self._rwlock.write():
+            if self.partitions.get(partition.key) is not partition:
+                return False
+            new_ids = partition.live_ids()
+            new_ids = new_ids[new_ids >= snapshot_next_id]
+            new_vectors = partition.vectors(new_ids)
+            if len(new_ids):
+                index.add_with_ids(new_vectors, new_ids)
+            tombstones = {
+                vector_id for vector_id in partition.tombstones - snapshot_tombstones
+                if vector_id < snapshot_next_id
+            }
+            
+            raw = None
+            if trained and partition.raw is None and settings.vector_quantization in vector_index.LOSSY_QUANTIZATIONS:
+                # Keep exact copies before the index drops them; rows of
+                # deleted vectors are left zeroed
+                rows = np.zeros((partition.next_id, self.dimension), dtype=np.float32)
+                rows[ids] = vectors
+                rows[new_ids] = new_vectors
+                raw = RawVectors(self.dimension)
+                raw.append(rows)
+            
+            partition.replace_index(index, tombstones, raw)
+            if trained:
+                partition.trained_size = index.ntotal
+            partition.mark_dirty()
+            self._update_catalog(partition)
+        return True
+    
+    def _build_index(self, vectors: np.ndarray, ids: np.ndarray, trained: bool) -> faiss.Index:
+        if not trained:
+            index = vector_index.create_index(
+                settings.vector_index_type,
+                self.dimension,
+                quantization=settings.vector_quantization,
+                hnsw_m=settings.vector_hnsw_m,
+                hnsw_ef_search=settings.vector_hnsw_ef_search
+            )
+            index.add_with_ids(vectors, ids)
+            return index
+        
+        return vector_index.build_index(
+            settings.vector_index_type,
+            settings.vector_quantization,
+            vectors, ids,
+            hnsw_m=settings.vector_hnsw_m,
+            hnsw_ef_search=settings.vector_hnsw_ef_search,
+            max_nlist=settings.vector_ivf_max_nlist,
+            nprobe=settings.vector_ivf_nprobe,
+            pq_m=settings.vector_pq_m,
+            pq_nbits=settings.vector_pq_nbits
+        )
+    
+    def _search(
+        self,
+        query_embedding: List[float],
+        user_id: Optional[str] = None,
+        character_id: Optional[str] = None,
+        n_results: int = 5,
+        exclude_conversation_id: Optional[str] = None
+    ) -> List[Dict]:
+        query_vector = np.array([query_embedding], dtype=np.float32)
+        memories = []
+        for key in self._matching_keys(user_id, character_id):
+            partition = self._get_partition(key, evict=False)
+            memories.extend(partition.search(query_vector, n_results, exclude_conversation_id))
+        
+        memories.sort(key=lambda m: m['distance'])
+        return memories[:n_results]
+    
+    def _without_existing(self, records: List[Tuple[str, np.ndarray, Dict]]) -> List[Tuple[str, np.ndarray, Dict]]:
+        # Point lookups, so a retried batch costs O(batch) however large the partition
+        seen = set()
+        kept = []
+        for record in records:
+            key = _partition_key(record[2])
+            if (key, record[0]) in seen:
+                continue
+            seen.add((key, record[0]))
+            if key in self.catalog and self._get_partition(key).contains(record[0]):
+                continue
+            kept.append(record)
+        return kept
+    
+    def _matching_keys(self, user_id: Optional[str], character_id: Optional[str]) -> List[PartitionKey]:
+        if user_id and character_id:
+            key = (user_id, character_id)
+            return [key] if key in self.catalog else []
+        return [
+            key for key in self.catalog
+            if (not user_id or key[0] == user_id)
+            and (not character_id or key[1] == character_id)
+        ]
+    
+    def _get_partition(self, key: PartitionKey, create: bool = False, evict: bool = True) -> Partition:
+        # Searches pass evict=False: a writer may hold a partition it has not
+        # dirtied yet, so only writers (holding `_write_lock`) evict
+        with self._partitions_lock:
+            partition = self.partitions.get(key)
+            if partition is None:
+                if key in self.versions:
+                    partition = Partition.load(
+                        key, self.dimension,
+                        self._partition_path(key, self.versions[key]),
+                        mmap=settings.vector_mmap
+                    )
+                elif create or key in self.catalog:
+                    partition = Partition(key, self.dimension)
+                else:
+                    raise KeyError(key)
+                if evict:
+                    self._evict_partitions(settings.vector_max_loaded_partitions - 1)
+                self.partitions[key] = partition
+            else:
+                self.partitions.move_to_end(key)
+            partition.last_used = time.monotonic()
+            return partition
+    
+    def _resident_partitions(self) -> List[Partition]:
+        with self._partitions_lock:
+            return list(self.partitions.values())
+    
+    def _evict_partitions(self, max_loaded: int, idle_seconds: Optional[float] = None):
+        # Caller holds `_write_lock` and `_partitions_lock`. Partitions are kept
+        # in LRU order; dirty ones stay resident until a checkpoint has
+        # written them out
+        now = time.monotonic()
+        for key, partition in list(self.partitions.items()):
+            if partition.dirty:
+                continue
+            over_capacity = len(self.partitions) > max_loaded
+            idle = idle_seconds is not None and now - partition.last_used > idle_seconds
+            if not (over_capacity or idle):
+                break
+            del self.partitions[key]
+    
+    def _partition_path(self, key: PartitionKey, version: int) -> str:
+        digest = hashlib.blake2b(f"{key[0]}\x00{key[1]}".encode(), digest_size=16).hexdigest()
+        return os.path.join(self.partition_dir, f"{digest}-{version}")
+    
+    def _write_partition(self, key: PartitionKey, version: int, snapshot: Dict) -> Dict:
+        path = self._partition_path(key, version)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        header = Partition.write_snapshot(snapshot, tmp_path)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+        return header
+    
+    def _remove_unreferenced_partitions(self):
+        # Superseded versions and leftovers from interrupted checkpoints
+        current = {
+            os.path.basename(self._partition_path(key, version))
+            for key, version in self.versions.items()
+        }
+        for name in os.listdir(self.partition_dir):
+            if name in current or not _PARTITION_DIR.match(name):
+                continue
+            shutil.rmtree(os.path.join(self.partition_dir, name), ignore_errors=True)
+    
+    def _manifest_bytes(self, lsn: int) -> bytes:
+        return pickle.dumps({
+            'catalog': dict(self.catalog),
+            'versions': dict(self.versions),
+            'lsn': lsn
+        })
+    
+    def _apply_add(self, lsn: int, memory_id: str, vector: np.ndarray, metadata: Dict):
+        key = _partition_key(metadata)
+        partition = self._get_partition(key, create=True)
+        if lsn <= partition.lsn:
+            return
+        partition.add(memory_id, vector, metadata)
+        self._mark_applied(partition, lsn)
+    
+    def _apply_delete(self, lsn: int, memory_id: str, key: PartitionKey):
+        if key not in self.catalog:
+            return
+        partition = self._get_partition(key)
+        if lsn <= partition.lsn or not partition.delete(memory_id):
+            return
+        self._mark_applied(partition, lsn)
+    
+    def _apply_drop(self, lsn: int, key: PartitionKey):
+        if key not in self.catalog:
+            return
+        partition = self._get_partition(key)
+        if lsn <= partition.lsn:
+            return
+        with self._partitions_lock:
+            self.partitions.pop(key, None)
+        live, dead = self.catalog.pop(key)
+        self.live_count -= live
+        self.dead_count -= dead
+        version = self.versions.pop(key, None)
+        if version is not None:
+            # Deleted once a checkpoint has stopped referencing it
+            self._dropped_paths.append(self._partition_path(key, version))
+    
+    def _mark_applied(self, partition: Partition, lsn: int):
+        partition.lsn = lsn
+        partition.mark_dirty()
+        self._update_catalog(partition)
+    
+    def _update_catalog(self, partition: Partition):
+        live, dead = self.catalog.get(partition.key, (0, 0))
+        self.live_count += partition.live_count - live
+        self.dead_count += partition.dead_count - dead
+        self.catalog[partition.key] = (partition.live_count, partition.dead_count)
+    
+    def _replay_wal(self):
+        replayed = 0
+        for lsn, record in self.wal.replay():
+            op = record[0]
+            if op == "add":
+                _, memory_id, vector, metadata = record
+                self._apply_add(lsn, memory_id, vector, metadata)
+            elif op == "delete" and len(record) == 3:
+                self._apply_delete(lsn, record[1], record[2])
+            elif op == "drop":
+                self._apply_drop(lsn, record[1])
+            self.lsn = max(self.lsn, lsn)
+            replayed += 1
+        if replayed:
+            print(f"Replayed {replayed} vector store operations from write-ahead log")
+    
+    def _migrate_legacy_index(self):
+        try:
+            index = faiss.read_index(self.legacy_index_path)
+            with open(self.legacy_metadata_path, 'rb') as f:
+                data = pickle.load(f)
+            vectors = index.reconstruct_n(0, index.ntotal)
+            self.lsn = self.checkpoint_lsn = data.get('lsn', 0)
+            
+            for row, meta in enumerate(data['metadata']):
+                meta = dict(meta)
+                memory_id = meta.pop('id')
+                if meta.pop('deleted', False):
+                    continue
+                key = (meta.get('user_id') or "", meta.get('character_id') or "")
+                partition = self._get_partition(key, create=True)
+                partition.mark_dirty()
+                partition.add(memory_id, vectors[row:row + 1], meta)
+            
+            for partition in self.partitions.values():
+                partition.lsn = self.lsn
+                self._update_catalog(partition)
+                self._write_partition(partition.key, self.lsn, partition.snapshot())
+                self.versions[partition.key] = self.lsn
+                partition.saved_changes = partition.changes
+            atomic_write(self.manifest_path, self._manifest_bytes(self.lsn))
+            print(f"Migrated {len(data['metadata'])} memories into {len(self.catalog)} partitions")
+        except Exception as e:
+            print(f"Error migrating legacy index: {e}")
+    
+    def _checkpoint_loop(self):
+        while not self._closed.is_set():
+            self._checkpoint_requested.wait(settings.vector_checkpoint_interval)
+            self._checkpoint_requested.clear()
+            if self._closed.is_set():
+                break
+            self.train_partitions()
+            self.compact_partitions()
+            self.checkpoint()
+            with self._write_lock, self._partitions_lock:
+                self._evict_partitions(
+                    settings.vector_max_loaded_partitions,
+                    idle_seconds=settings.vector_partition_idle_seconds
+                )
+
+
+def _partition_key(metadata: Dict) -> PartitionKey:
+    return (metadata.get('user_id') or "", metadata.get('character_id') or "")
+
+
+def create_vector_store():
+    """
+    Open the store in-process, or connect to the shared vector store server
+    when VECTOR_STORE_SOCKET is set (multi-worker deployments). With
+    VECTOR_SHARDS set, a `ShardedVectorStore` over the listed shards.
+    """
+    if settings.vector_shards:
+        from app.core.vector_shards import create_sharded_store
+        return create_sharded_store(settings.vector_shards, settings.vector_shard_replicas)
+    if settings.vector_store_socket:
+        from app.core.vector_client import VectorStoreClient
+        return VectorStoreClient(settings.vector_store_socket, timeout=settings.vector_store_timeout)
+    return VectorStore()
 
 
-vector_store = VectorStore()
+vector_store = create_vector_store()
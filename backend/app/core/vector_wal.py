@@ -0,0 +1,91 @@
+import os
+import pickle
+import struct
+import zlib
+from typing import Iterator, List, Tuple, Any
+
+
+_HEADER = struct.Struct("<QII")
+
+
+class WriteAheadLog:
+    """
+    Append-only log of vector store operations.
+
+    Each record is framed as (lsn, length, crc32) followed by a pickled payload,
+    so a torn write at the tail is detected and ignored on replay. The active
+    log is rotated to `<path>.old` when a checkpoint starts and that file is
+    dropped once the checkpoint is safely on disk.
+    """
+    
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.rotated_path = path + ".old"
+        self.fsync = fsync
+        self._file = open(self.path, "ab")
+    
+    def append(self, lsn: int, payload: Any):
+        self.append_many([(lsn, payload)])
+    
+    def append_many(self, records: List[Tuple[int, Any]]):
+        """Append several records with a single flush (and fsync)."""
+        for lsn, payload in records:
+            data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+            self._file.write(_HEADER.pack(lsn, len(data), zlib.crc32(data)) + data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+    
+    def rotate(self):
+        self._file.close()
+        if os.path.exists(self.rotated_path):
+            # A previous checkpoint never completed; keep its records too
+            with open(self.rotated_path, "ab") as old, open(self.path, "rb") as cur:
+                old.write(cur.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.rotated_path)
+        self._file = open(self.path, "ab")
+    
+    def discard_rotated(self):
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+    
+    def truncate(self):
+        self._file.close()
+        self.discard_rotated()
+        self._file = open(self.path, "wb")
+    
+    def replay(self) -> Iterator[Tuple[int, Any]]:
+        for path in (self.rotated_path, self.path):
+            if os.path.exists(path):
+                yield from self._read_records(path)
+    
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+    
+    @staticmethod
+    def _read_records(path: str) -> Iterator[Tuple[int, Any]]:
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                lsn, length, crc = _HEADER.unpack(header)
+                data = f.read(length)
+                if len(data) < length or zlib.crc32(data) != crc:
+                    print(f"Ignoring torn write-ahead log record in {path}")
+                    return
+                yield lsn, pickle.loads(data)
+
+
+def atomic_write(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -4,8 +4,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.api import characters, chat, health, auth
-from app.core.database import init_db
+from app.core.database import async_engine, init_db
+from app.core.vector_store import vector_store
+from app.services.ai_service import ai_service
+from app.services.embedding_service import embedding_service
+from app.services.indexing_queue import indexing_queue
 import logging
+import threading
 
 # Configure logging
 logging.basicConfig(
@@ -14,6 +19,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# In-process background job workers, started with the app
+job_workers = []
+
 app = FastAPI(
     title=settings.app_name,
     version=settings.version,
@@ -49,10 +57,33 @@ async def startup_event():
     """Initialize database on startup."""
     init_db()
     seed_data()
+    # Register character prompt prefixes with the prompt cache without
+    # holding up startup
+    threading.Thread(target=ai_service.warm_prompt_cache, daemon=True, name="prompt-cache-warm").start()
+    if settings.job_queue_enabled and settings.job_workers > 0:
+        # Imported here so the queue file is only created when it is used
+        from app.services.jobs import start_workers
+        job_workers.extend(start_workers(settings.job_workers, name="api"))
     logger.info(f"✅ {settings.app_name} v{settings.version} started successfully!")
     logger.info(f"🔒 CORS Origins loaded: {settings.cors_origins}")
 
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """Finish background work and flush pending vector store writes to disk."""
+    if job_workers:
+        from app.services.jobs import stop_workers
+        stop_workers(job_workers)
+    indexing_queue.close()
+    vector_store.close()
+    embedding_service.close()
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
+
+
 @app.get("/")
 def root():
     return {
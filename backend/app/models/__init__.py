@@ -2,7 +2,7 @@
 from app.models.character import Character
 from app.models.conversation import Conversation
 from app.models.message import Message, ConversationMemory
-from app.models.user_preference import UserPreference
+from app.models.user_preference import UserPreference, PreferenceExtraction
 from app.models.user import User
 
-__all__ = ["Character", "Conversation", "Message", "ConversationMemory", "UserPreference", "User"]
+__all__ = ["Character", "Conversation", "Message", "ConversationMemory", "UserPreference", "PreferenceExtraction", "User"]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -16,6 +16,11 @@ class Message(Base):
     
     conversation = relationship("Conversation", back_populates="messages")
     
+    __table_args__ = (
+        # Serves the newest-first history queries; id breaks timestamp ties
+        Index("ix_messages_conversation_timestamp", "conversation_id", "timestamp", "id"),
+    )
+    
     def __repr__(self):
         return f"<Message(id={self.id}, role='{self.role}')>"
 
@@ -15,3 +15,13 @@ class UserPreference(Base):
     confidence = Column(Float, default=0.5)
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+
+class PreferenceExtraction(Base):
+    """Turns whose extracted preferences were applied, so a retried extraction is a no-op."""
+    __tablename__ = "preference_extractions"
+    
+    # The turn's message IDs joined with "-"
+    source = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
@@ -0,0 +1,142 @@
+from typing import Dict, List, Optional
+from app.config import settings
+from app.core.llm_scheduler import estimate_tokens
+
+# Order of the optional sections in the prompt
+CONTEXT_SECTIONS = ("summary", "rag", "profile", "emotion")
+# Separators and labels around the history and the new message
+PROMPT_FRAMING_TOKENS = 16
+# Per-message "User: " / "You: " label
+MESSAGE_OVERHEAD_TOKENS = 3
+
+
+class ContextAssembler:
+    """
+    Fits a reply prompt into a token budget. The character prompt, the
+    new message and the emotion line always go in; the history, summary,
+    RAG memories and user profile share what is left. Each of those first
+    gets up to its minimum, in priority order, then any remainder goes to
+    them in the same order. A section over its share is trimmed from the
+    end (oldest messages first for the history).
+    """
+    
+    def __init__(
+        self,
+        token_budget: int,
+        priorities: List[str],
+        min_tokens: Dict[str, int],
+        max_messages: int
+    ):
+        self.token_budget = token_budget
+        self.priorities = priorities
+        self.min_tokens = min_tokens
+        self.max_messages = max_messages
+    
+    def assemble(
+        self,
+        prompt_tokens: int,
+        conversation_history: List[Dict[str, str]],
+        user_message: str,
+        sections: Dict[str, str]
+    ) -> Dict:
+        """
+        Returns {"context", "history", "tokens"}: the context text to add to
+        the character prompt, the history messages to send and the estimated
+        tokens of each part of the prompt.
+        """
+        history = conversation_history[-self.max_messages:] if self.max_messages else []
+        emotion = sections.get("emotion", "")
+        fixed = prompt_tokens + estimate_tokens(user_message) + self._tokens(emotion) + PROMPT_FRAMING_TOKENS
+        
+        needed = {name: self._tokens(sections.get(name, "")) for name in self.priorities if name != "history"}
+        needed["history"] = sum(self._message_tokens(msg) for msg in history)
+        
+        # Minimums first, then the remainder, both in priority order
+        left = max(self.token_budget - fixed, 0)
+        granted = {}
+        for name in self.priorities:
+            granted[name] = min(needed[name], self.min_tokens.get(name, 0), left)
+            left -= granted[name]
+        for name in self.priorities:
+            extra = min(needed[name] - granted[name], left)
+            granted[name] += extra
+            left -= extra
+        
+        # Sections left out of the priorities get no room
+        texts = {
+            name: self._trim(sections.get(name, ""), granted.get(name, 0))
+            for name in CONTEXT_SECTIONS if name != "emotion"
+        }
+        texts["emotion"] = emotion
+        context = "\n\n".join(texts[name] for name in CONTEXT_SECTIONS if texts[name])
+        history = self.fit_history(
+            history, min(granted.get("history", 0), self.history_budget(prompt_tokens, user_message, context))
+        )
+        
+        tokens = {"system": prompt_tokens}
+        tokens.update({name: self._tokens(texts[name]) for name in CONTEXT_SECTIONS})
+        tokens["history"] = sum(self._message_tokens(msg) for msg in history)
+        tokens["message"] = estimate_tokens(user_message)
+        tokens["total"] = sum(tokens.values()) + PROMPT_FRAMING_TOKENS
+        return {"context": context, "history": history, "tokens": tokens}
+    
+    def history_budget(self, prompt_tokens: int, user_message: str, context: str) -> int:
+        """Tokens left for the history once everything else is in the prompt."""
+        used = prompt_tokens + estimate_tokens(user_message) + self._tokens(context) + PROMPT_FRAMING_TOKENS
+        return max(self.token_budget - used, 0)
+    
+    def fit_history(self, conversation_history: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+        """The most recent messages (at most `max_messages`) that fit in `budget` tokens."""
+        kept = []
+        used = 0
+        for msg in reversed(conversation_history[-self.max_messages:] if self.max_messages else []):
+            used += self._message_tokens(msg)
+            if used > budget:
+                break
+            kept.append(msg)
+        kept.reverse()
+        return kept
+    
+    def _trim(self, text: str, budget: int) -> str:
+        """
+        Keep whole lines of `text` from the top while they fit in `budget`
+        tokens, cutting the first line that does not at a word boundary.
+        A section reduced to its heading is dropped.
+        """
+        if self._tokens(text) <= budget:
+            return text
+        lines = text.split("\n")
+        kept: List[str] = []
+        used = 0
+        for line in lines:
+            cost = self._tokens(line)
+            if used + cost > budget:
+                room = (budget - used) * 4
+                if room > 40:
+                    kept.append(line[:room].rsplit(" ", 1)[0] + "...")
+                break
+            kept.append(line)
+            used += cost
+        # Only the heading left
+        if len(kept) <= 1 and len(lines) > 1:
+            return ""
+        return "\n".join(kept)
+    
+    def _message_tokens(self, msg: Dict[str, str]) -> int:
+        return estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+    
+    def _tokens(self, text: Optional[str]) -> int:
+        return estimate_tokens(text) if text else 0
+
+
+context_assembler = ContextAssembler(
+    token_budget=settings.context_token_budget,
+    priorities=[name.strip() for name in settings.context_priorities.split(",") if name.strip()],
+    min_tokens={
+        "history": settings.context_history_min_tokens,
+        "summary": settings.context_summary_min_tokens,
+        "profile": settings.context_profile_min_tokens,
+        "rag": settings.context_rag_min_tokens
+    },
+    max_messages=settings.max_conversation_history
+)
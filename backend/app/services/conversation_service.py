@@ -1,10 +1,50 @@
 
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from app.config import settings
+from app.core.history_cache import history_cache
+from app.core.llm_scheduler import estimate_tokens
 from app.models import Conversation, Message
+from app.services.context_assembler import MESSAGE_OVERHEAD_TOKENS
 from datetime import datetime
 from typing import List, Dict, Optional
 
 
+def _tail_query(conversation_id: int, limit: int):
+    # Newest first through ix_messages_conversation_timestamp, so only
+    # `limit` index entries are read however long the conversation is
+    return select(Message.id, Message.role, Message.content).where(
+        Message.conversation_id == conversation_id
+    ).order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
+
+
+def _stamp_query(conversation_id: int):
+    return select(Conversation.last_message_at).where(Conversation.id == conversation_id)
+
+
+def _tail_history(rows, token_budget: Optional[int]) -> List[Dict[str, str]]:
+    """Newest-first rows to oldest-first messages, stopping at the first that overflows the budget."""
+    history = []
+    used = 0
+    for _, role, content in rows:
+        if token_budget is not None:
+            used += estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+            # Always keep the newest message
+            if used > token_budget and history:
+                break
+        history.append({"role": role, "content": content})
+    history.reverse()
+    return history
+
+
+def _record(conversation_id: int, message: Message, previous: Optional[datetime], stamp: Optional[datetime]):
+    if stamp is None:
+        history_cache.invalidate(conversation_id)
+    else:
+        history_cache.append(conversation_id, (message.id, message.role, message.content), previous, stamp)
+
+
 class ConversationService:
     
     @staticmethod
@@ -53,14 +93,18 @@ class ConversationService:
         )
         db.add(message)
         
+        # Re-read the stamp so a write from another session shows up
         conversation = db.query(Conversation).filter(
             Conversation.id == conversation_id
-        ).first()
+        ).populate_existing().first()
+        previous = conversation.last_message_at if conversation else None
+        now = datetime.utcnow()
         if conversation:
-            conversation.last_message_at = datetime.utcnow()
+            conversation.last_message_at = now
         
         db.commit()
         db.refresh(message)
+        _record(conversation_id, message, previous, now if conversation else None)
         return message
     
     @staticmethod
@@ -74,6 +118,15 @@ class ConversationService:
             for msg in messages
         ]
     
+    @staticmethod
+    def count_user_messages(db: Session, conversation_id: int) -> int:
+        """The conversation's turn count, including a turn still awaiting its reply."""
+        return db.execute(
+            select(func.count()).select_from(Message).where(
+                Message.conversation_id == conversation_id,
+                Message.role == "user"
+            )
+        ).scalar()
     
     @staticmethod
     def get_active_conversation(
@@ -98,6 +151,98 @@ class ConversationService:
         if conversation and not conversation.title:
             conversation.title = title
             db.commit()
+    
+    
+    # Async counterparts used by the chat routes
+    
+    @staticmethod
+    async def create_conversation_async(
+        db: AsyncSession,
+        character_id: str,
+        user_id: Optional[str] = None,
+        title: Optional[str] = None
+    ) -> Conversation:
+        conversation = Conversation(
+            character_id=character_id,
+            user_id=user_id,
+            title=title
+        )
+        db.add(conversation)
+        await db.commit()
+        await db.refresh(conversation)
+        return conversation
+    
+    @staticmethod
+    async def get_conversation_async(db: AsyncSession, conversation_id: int) -> Optional[Conversation]:
+        return await db.get(Conversation, conversation_id)
+    
+    @staticmethod
+    async def add_message_async(
+        db: AsyncSession,
+        conversation_id: int,
+        role: str,
+        content: str
+    ) -> Message:
+        message = Message(
+            conversation_id=conversation_id,
+            role=role,
+            content=content
+        )
+        db.add(message)
+        
+        conversation = await db.get(Conversation, conversation_id, populate_existing=True)
+        previous = conversation.last_message_at if conversation else None
+        now = datetime.utcnow()
+        if conversation:
+            conversation.last_message_at = now
+        
+        await db.commit()
+        await db.refresh(message)
+        _record(conversation_id, message, previous, now if conversation else None)
+        return message
+    
+    @staticmethod
+    async def delete_message_async(db: AsyncSession, message_id: int):
+        message = await db.get(Message, message_id)
+        if message is None:
+            return
+        await db.delete(message)
+        await db.commit()
+        history_cache.invalidate(message.conversation_id)
+    
+    @staticmethod
+    async def get_recent_history_async(
+        db: AsyncSession,
+        conversation_id: int,
+        limit: Optional[int] = None,
+        token_budget: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """
+        The conversation's last `limit` messages (default
+        MAX_CONVERSATION_HISTORY), oldest first. With `token_budget`, only
+        the most recent of those that fit in it. Served from the history
+        cache when it holds them.
+        """
+        limit = limit or settings.max_conversation_history
+        rows = history_cache.get(conversation_id, limit)
+        if rows is None:
+            # Stamp before rows: a message committed in between only makes
+            # the stamp stale, which the next append detects
+            stamp = (await db.execute(_stamp_query(conversation_id))).scalar()
+            rows = (await db.execute(_tail_query(conversation_id, limit))).all()
+            history_cache.prime(conversation_id, [tuple(row) for row in reversed(rows)], stamp, len(rows) < limit)
+        return _tail_history(rows, token_budget)
+    
+    @staticmethod
+    async def update_conversation_title_async(
+        db: AsyncSession,
+        conversation_id: int,
+        title: str
+    ):
+        conversation = await db.get(Conversation, conversation_id)
+        if conversation and not conversation.title:
+            conversation.title = title
+            await db.commit()
 
 
 conversation_service = ConversationService()
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import multiprocessing
+import re
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional
+import numpy as np
+from app.config import settings
+
+# The vector store's index dimension; every provider must produce it
+EMBEDDING_DIMENSION = 768
+
+_TOKEN = re.compile(r"\w+")
+
+
+class EmbeddingProvider(ABC):
+    """
+    Turns texts into embeddings.
+
+    `embed` returns one entry per text, in order, with None for texts that
+    could not be embedded; callers must skip those rather than substitute a
+    placeholder vector. `name` identifies the vector space, so it is part of
+    the embedding cache key.
+    """
+    
+    name = ""
+    dimension = EMBEDDING_DIMENSION
+    
+    @abstractmethod
+    def embed(self, texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+        ...
+    
+    async def embed_async(self, texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+        # Local providers are CPU-bound, so run them off the event loop
+        return await asyncio.to_thread(self.embed, texts, task_type)
+    
+    def close(self):
+        pass
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Remote `text-embedding-004`, one request per batch of up to `batch_size` texts and `batch_max_bytes` bytes."""
+    
+    def __init__(self, batch_size: int = 100, batch_max_bytes: int = 1_000_000):
+        import google.generativeai as genai
+        genai.configure(api_key=settings.gemini_api_key)
+        self.genai = genai
+        self.name = "models/text-embedding-004"
+        self.batch_size = batch_size
+        self.batch_max_bytes = batch_max_bytes
+    
+    def embed(self, texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        for batch in self._batches(texts):
+            self._embed_batch(texts, batch, task_type, embeddings)
+        return embeddings
+    
+    async def embed_async(self, texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        for batch in self._batches(texts):
+            try:
+                result = await self.genai.embed_content_async(
+                    model=self.name,
+                    content=[texts[i] for i in batch],
+                    task_type=task_type
+                )
+                for i, embedding in zip(batch, result['embedding']):
+                    embeddings[i] = embedding
+            except Exception:
+                # Rare; isolate the bad text with the blocking bisection
+                await asyncio.to_thread(self._embed_batch, texts, batch, task_type, embeddings)
+        return embeddings
+    
+    def _batches(self, texts: List[str]) -> Iterator[List[int]]:
+        batch: List[int] = []
+        batch_bytes = 0
+        for i, text in enumerate(texts):
+            size = len(text.encode())
+            if batch and (len(batch) >= self.batch_size or batch_bytes + size > self.batch_max_bytes):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(i)
+            batch_bytes += size
+        if batch:
+            yield batch
+    
+    def _embed_batch(
+        self,
+        texts: List[str],
+        indices: List[int],
+        task_type: str,
+        embeddings: List[Optional[List[float]]]
+    ):
+        try:
+            result = self.genai.embed_content(
+                model=self.name,
+                content=[texts[i] for i in indices],
+                task_type=task_type
+            )
+            for i, embedding in zip(indices, result['embedding']):
+                embeddings[i] = embedding
+        except Exception as e:
+            if len(indices) == 1:
+                print(f"Error generating embedding: {e}")
+                return
+            # One bad text fails the whole request, so split the batch to
+            # isolate it and still embed the rest
+            middle = len(indices) // 2
+            self._embed_batch(texts, indices[:middle], task_type, embeddings)
+            self._embed_batch(texts, indices[middle:], task_type, embeddings)
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Local CPU embeddings from a signed hashing vectorizer over words, word
+    bigrams and character trigrams. No model download or network access;
+    quality is lexical rather than semantic, so it suits offline use.
+
+    Large batches are split across a process pool of `workers` processes
+    (0 embeds in the calling thread).
+    """
+    
+    name = "local/hashing-v1"
+    # Hashing takes ~0.1 ms per message, so below this many texts pickling
+    # them to worker processes costs more than it saves
+    POOL_MIN_BATCH = 1024
+    
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+    
+    def embed(self, texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+        if self.workers <= 0 or len(texts) < self.POOL_MIN_BATCH:
+            return hash_embed(texts)
+        if self._pool is None:
+            # spawn: forking a threaded server process is unsafe
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        chunk_size = -(-len(texts) // self.workers)
+        chunks = [texts[start:start + chunk_size] for start in range(0, len(texts), chunk_size)]
+        return [embedding for chunk in self._pool.map(hash_embed, chunks) for embedding in chunk]
+    
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class DeterministicEmbeddingProvider(EmbeddingProvider):
+    """Pseudo-random unit vectors seeded by the text, for tests: same text, same vector, no I/O."""
+    
+    name = "test/deterministic"
+    
+    def embed(self, texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+        embeddings = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            embeddings.append((vector / np.linalg.norm(vector)).tolist())
+        return embeddings
+
+
+def hash_embed(texts: List[str], dimension: int = EMBEDDING_DIMENSION) -> List[Optional[List[float]]]:
+    """Hashing-vectorizer embeddings; None for texts without any word characters."""
+    embeddings = []
+    for text in texts:
+        tokens = _TOKEN.findall(text.lower())
+        if not tokens:
+            embeddings.append(None)
+            continue
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for token in tokens:
+            padded = f"<{token}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        
+        hashes = np.fromiter((zlib.crc32(feature.encode()) for feature in features), dtype=np.uint32, count=len(features))
+        # Low bits pick the bucket, the top bit the sign, so colliding
+        # features tend to cancel out instead of piling up
+        signs = np.where(hashes >> 31, -1.0, 1.0)
+        vector = np.bincount(hashes % dimension, weights=signs, minlength=dimension)
+        norm = np.linalg.norm(vector)
+        embeddings.append((vector / norm).astype(np.float32).tolist() if norm else None)
+    return embeddings
+
+
+def create_embedding_provider(name: str) -> EmbeddingProvider:
+    if name == "gemini":
+        return GeminiEmbeddingProvider(settings.embedding_batch_size, settings.embedding_batch_max_bytes)
+    if name == "hashing":
+        return HashingEmbeddingProvider(settings.embedding_workers)
+    if name == "deterministic":
+        return DeterministicEmbeddingProvider()
+    raise ValueError(f"Unknown embedding provider '{name}', expected gemini, hashing or deterministic")
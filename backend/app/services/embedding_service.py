@@ -1,42 +1,112 @@
-import google.generativeai as genai
-from typing import List
+import asyncio
+from typing import Dict, List, Optional
 from app.config import settings
+from app.core.embedding_cache import EmbeddingCache
+from app.services.embedding_providers import EmbeddingProvider, create_embedding_provider
 
 
 class EmbeddingService:
     
-    def __init__(self):
-        genai.configure(api_key=settings.gemini_api_key)
-        self.model = "models/text-embedding-004"
-    
-    def generate_embedding(self, text: str) -> List[float]:
-        try:
-            result = genai.embed_content(
-                model=self.model,
-                content=text,
-                task_type="retrieval_document"
-            )
-            return result['embedding']
-        except Exception as e:
-            print(f"Error generating embedding: {e}")
-            return [0.0] * 768
-    
-    def generate_query_embedding(self, query: str) -> List[float]:
-        try:
-            result = genai.embed_content(
-                model=self.model,
-                content=query,
-                task_type="retrieval_query"
-            )
-            return result['embedding']
-        except Exception as e:
-            print(f"Error generating query embedding: {e}")
-            return [0.0] * 768
-    
-    def generate_batch_embeddings(self, texts: List[str]) -> List[List[float]]:
-        embeddings = []
-        for text in texts:
-            embeddings.append(self.generate_embedding(text))
-        return embeddings
+    def __init__(self, provider: Optional[EmbeddingProvider] = None):
+        self.provider = provider or create_embedding_provider(settings.embedding_provider)
+        self.model = self.provider.name
+        self.cache = EmbeddingCache(
+            settings.embedding_cache_path or None,
+            memory_size=settings.embedding_cache_size,
+            disk_max_entries=settings.embedding_cache_max_entries
+        )
+    
+    def generate_embedding(self, text: str) -> Optional[List[float]]:
+        """Document embedding for `text`, or None if it could not be embedded."""
+        return self.generate_batch_embeddings([text])[0]
+    
+    def generate_query_embedding(self, query: str) -> Optional[List[float]]:
+        return self.generate_batch_embeddings([query], task_type="retrieval_query")[0]
+    
+    def generate_batch_embeddings(
+        self,
+        texts: List[str],
+        task_type: str = "retrieval_document"
+    ) -> List[Optional[List[float]]]:
+        """
+        Embed many texts with as few provider calls as it allows.
+
+        Returns one entry per text, in order; texts that could not be embedded
+        get None instead of failing the whole call. Cached texts are not sent
+        at all, and failures are not cached.
+        """
+        keys, found, missing = self._lookup(texts, task_type)
+        if missing:
+            missing_keys = list(missing)
+            try:
+                embeddings = self.provider.embed([missing[key] for key in missing_keys], task_type)
+            except Exception as e:
+                print(f"Error generating embeddings: {e}")
+                embeddings = [None] * len(missing_keys)
+            self._store(found, missing_keys, embeddings)
+        return [found.get(key) for key in keys]
+    
+    async def generate_query_embedding_async(self, query: str) -> Optional[List[float]]:
+        return (await self.generate_batch_embeddings_async([query], task_type="retrieval_query"))[0]
+    
+    async def generate_batch_embeddings_async(
+        self,
+        texts: List[str],
+        task_type: str = "retrieval_document"
+    ) -> List[Optional[List[float]]]:
+        # Only the memory tier is used on the event loop; SQLite shares a
+        # lock with job workers' batch writes, so it runs in a thread
+        keys = self._keys(texts, task_type)
+        found = self.cache.get_memory(keys)
+        if self.cache.on_disk and len(found) < len(set(keys)):
+            found = await asyncio.to_thread(self.cache.get_disk, keys, found)
+        else:
+            found = self.cache.get_disk(keys, found)
+        missing = self._missing(keys, texts, found)
+        if missing:
+            missing_keys = list(missing)
+            try:
+                embeddings = await self.provider.embed_async([missing[key] for key in missing_keys], task_type)
+            except Exception as e:
+                print(f"Error generating embeddings: {e}")
+                embeddings = [None] * len(missing_keys)
+            embedded = self._embedded(found, missing_keys, embeddings)
+            vectors = self.cache.put_memory(embedded)
+            if vectors and self.cache.on_disk:
+                # Not awaited: the caller only needs the embeddings
+                asyncio.get_running_loop().run_in_executor(None, self.cache.put_disk, vectors)
+        return [found.get(key) for key in keys]
+    
+    def _keys(self, texts: List[str], task_type: str) -> List[bytes]:
+        return [EmbeddingCache.key(self.model, task_type, text) for text in texts]
+    
+    def _lookup(self, texts: List[str], task_type: str):
+        """Cache keys, cached embeddings by key, and the distinct texts still to embed by key."""
+        keys = self._keys(texts, task_type)
+        found = self.cache.get_many(keys)
+        return keys, found, self._missing(keys, texts, found)
+    
+    def _missing(self, keys: List[bytes], texts: List[str], found: Dict) -> Dict[bytes, str]:
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        return missing
+    
+    def _embedded(self, found: Dict, missing_keys: List[bytes], embeddings: List[Optional[List[float]]]) -> List:
+        """Record new embeddings in `found` and return them as (key, embedding) pairs to cache."""
+        embedded = [(key, embedding) for key, embedding in zip(missing_keys, embeddings) if embedding is not None]
+        found.update(embedded)
+        return embedded
+    
+    def _store(self, found: Dict, missing_keys: List[bytes], embeddings: List[Optional[List[float]]]):
+        self.cache.put_many(self._embedded(found, missing_keys, embeddings))
+    
+    def get_cache_stats(self) -> Dict:
+        return self.cache.get_stats()
+    
+    def close(self):
+        self.provider.close()
+        self.cache.close()
 
 embedding_service = EmbeddingService()
@@ -0,0 +1,150 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+from app.config import settings
+from app.models import Message
+from app.services.rag_service import rag_service
+
+logger = logging.getLogger(__name__)
+
+IndexEntry = Tuple[str, str, Message]
+
+_STOP = object()
+
+
+class IndexingQueue:
+    """
+    Indexes chat messages into the RAG store off the request path.
+
+    Worker threads take messages from a bounded queue and coalesce whatever
+    arrives within `batch_window` seconds (up to `batch_size` messages) into
+    one embedding request and one vector store add. When the queue is full,
+    `enqueue` waits up to `enqueue_timeout` seconds and then indexes the
+    messages itself, so a backlog slows callers down instead of growing
+    without bound or losing messages.
+    """
+    
+    def __init__(
+        self,
+        workers: int = 2,
+        max_size: int = 1000,
+        batch_size: int = 64,
+        batch_window: float = 0.05,
+        enqueue_timeout: float = 1.0
+    ):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.enqueue_timeout = enqueue_timeout
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max_size)
+        self.stats = {"enqueued": 0, "indexed": 0, "batches": 0, "inline": 0}
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+    
+    def enqueue_message(
+        self,
+        message_id: int,
+        conversation_id: int,
+        user_id: str,
+        character_id: str,
+        role: str,
+        content: str,
+        timestamp: datetime
+    ):
+        self.enqueue([(user_id, character_id, Message(
+            id=message_id,
+            conversation_id=conversation_id,
+            role=role,
+            content=content,
+            timestamp=timestamp
+        ))])
+    
+    def enqueue(self, entries: List[IndexEntry]):
+        """Queue (user_id, character_id, message) entries; messages must carry plain column values, not lazy ones."""
+        if self.workers <= 0:
+            self._index(entries)
+            return
+        self._start()
+        
+        for i, entry in enumerate(entries):
+            try:
+                self.queue.put(entry, timeout=self.enqueue_timeout)
+            except queue.Full:
+                logger.warning(f"Indexing queue full ({self.queue.qsize()} waiting), indexing inline")
+                with self._lock:
+                    self.stats["inline"] += len(entries) - i
+                self._index(entries[i:])
+                return
+            with self._lock:
+                self.stats["enqueued"] += 1
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "depth": self.queue.qsize(), "workers": len(self._threads)}
+    
+    def close(self, timeout: float = 10.0):
+        """Index what is still queued (within `timeout`) and stop the workers."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        deadline = time.monotonic() + timeout
+        for _ in threads:
+            try:
+                self.queue.put(_STOP, timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        if self.queue.qsize():
+            logger.warning(f"Stopped with {self.queue.qsize()} messages left unindexed")
+    
+    def _start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"rag-indexer-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+    
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is _STOP:
+                return
+            batch = [entry]
+            stop = False
+            # Coalesce messages arriving shortly after the first one
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stop = True
+                    break
+                batch.append(entry)
+            
+            self._index(batch)
+            with self._lock:
+                self.stats["batches"] += 1
+            if stop:
+                return
+    
+    def _index(self, entries: List[IndexEntry]):
+        rag_service.index_batch(entries)
+        with self._lock:
+            self.stats["indexed"] += len(entries)
+
+indexing_queue = IndexingQueue(
+    workers=settings.indexing_workers,
+    max_size=settings.indexing_queue_size,
+    batch_size=settings.indexing_batch_size,
+    batch_window=settings.indexing_batch_window,
+    enqueue_timeout=settings.indexing_enqueue_timeout
+)
@@ -0,0 +1,203 @@
+"""
+Background jobs for work that can happen after a chat reply is returned.
+
+Jobs are stored in a durable SQLite queue (`JOB_QUEUE_PATH`), so work queued
+by a process that dies is picked up again. Workers run inside the API process
+(`JOB_WORKERS`) or as a separate process:
+
+    python run_worker.py --workers 4
+"""
+
+import argparse
+import logging
+import signal
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.core.database import SessionLocal
+from app.core.job_queue import JobDeferred, JobQueue, JobWorker
+from app.core.llm_scheduler import LLMPreempted
+from app.models import Message
+from app.services.preference_service import preference_service
+from app.services.rag_service import rag_service
+from app.services.summarization_service import summarization_service
+
+logger = logging.getLogger(__name__)
+
+
+class JobHandler(ABC):
+    """
+    Runs one type of job. `run` receives the payloads of all jobs of that
+    type claimed together and must be safe to re-run after a failure. Jobs
+    whose LLM calls were preempted by chat traffic are deferred rather than
+    failed, so sustained load does not use up their attempts.
+    """
+    
+    job_type = ""
+    
+    def run(self, payloads: List[Dict]):
+        db = SessionLocal()
+        try:
+            self.handle(db, payloads)
+        except LLMPreempted as e:
+            raise JobDeferred(str(e), delay=settings.job_retry_backoff)
+        finally:
+            db.close()
+    
+    @abstractmethod
+    def handle(self, db: Session, payloads: List[Dict]):
+        ...
+
+
+class RAGIndexJob(JobHandler):
+    """Embeds and indexes messages; all claimed jobs share one embedding batch."""
+    
+    job_type = "index_messages"
+    
+    def handle(self, db: Session, payloads: List[Dict]):
+        owners = {}
+        for payload in payloads:
+            for message_id in payload["message_ids"]:
+                owners[message_id] = (payload["user_id"], payload["character_id"])
+        # Messages deleted in the meantime are simply not indexed
+        messages = db.query(Message).filter(Message.id.in_(list(owners))).all()
+        rag_service.index_batch(
+            [(*owners[msg.id], msg) for msg in messages],
+            raise_errors=True
+        )
+
+
+class PreferenceJob(JobHandler):
+    """
+    Extracts preferences per turn. Each turn is applied in its own
+    transaction and recorded, so a retry skips the turns that succeeded.
+    """
+    
+    job_type = "extract_preferences"
+    
+    def handle(self, db: Session, payloads: List[Dict]):
+        errors = []
+        for payload in payloads:
+            try:
+                messages = db.query(Message).filter(
+                    Message.id.in_(payload["message_ids"])
+                ).order_by(Message.timestamp).all()
+                preference_service.extract_preferences(
+                    db,
+                    messages=messages,
+                    user_id=payload["user_id"],
+                    character_id=payload["character_id"],
+                    raise_errors=True,
+                    source=_turn_key(payload["message_ids"])
+                )
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Preference extraction failed for messages {payload['message_ids']}: {e}")
+                errors.append(e)
+        if errors:
+            # Defer rather than fail if chat traffic preempted any of them
+            raise next((e for e in errors if isinstance(e, LLMPreempted)), errors[0])
+
+
+class SummarizationJob(JobHandler):
+    """Updates the progressive summary and key facts; a no-op once the conversation is summarized."""
+    
+    job_type = "summarize_conversation"
+    
+    def handle(self, db: Session, payloads: List[Dict]):
+        for conversation_id in {payload["conversation_id"] for payload in payloads}:
+            if summarization_service.should_summarize(db, conversation_id):
+                summarization_service.create_progressive_summary(db, conversation_id)
+
+
+HANDLERS: Dict[str, JobHandler] = {
+    handler.job_type: handler
+    for handler in (RAGIndexJob(), PreferenceJob(), SummarizationJob())
+}
+
+job_queue = JobQueue(
+    settings.job_queue_path,
+    visibility_timeout=settings.job_visibility_timeout,
+    max_attempts=settings.job_max_attempts,
+    retry_backoff=settings.job_retry_backoff
+)
+
+
+def enqueue_chat_jobs(
+    db: Session,
+    conversation_id: int,
+    user_id: str,
+    character_id: str,
+    message_ids: List[int],
+    extract_preferences: bool
+):
+    """Queue the post-response work for one chat turn."""
+    payload = {"user_id": user_id, "character_id": character_id, "message_ids": message_ids}
+    turn = _turn_key(message_ids)
+    job_queue.enqueue(RAGIndexJob.job_type, payload, idempotency_key=f"index_messages:{turn}")
+    if extract_preferences:
+        job_queue.enqueue(PreferenceJob.job_type, payload, idempotency_key=f"extract_preferences:{turn}")
+    if summarization_service.should_summarize(db, conversation_id):
+        job_queue.enqueue(
+            SummarizationJob.job_type,
+            {"conversation_id": conversation_id},
+            idempotency_key=f"summarize_conversation:{turn}"
+        )
+
+
+def _turn_key(message_ids: List[int]) -> str:
+    return "-".join(str(message_id) for message_id in message_ids)
+
+
+def start_workers(count: int, name: Optional[str] = None) -> List[JobWorker]:
+    workers = [
+        JobWorker(
+            job_queue,
+            {job_type: handler.run for job_type, handler in HANDLERS.items()},
+            batch_size=settings.job_batch_size,
+            poll_interval=settings.job_poll_interval,
+            retention=settings.job_retention_seconds,
+            name=name
+        )
+        for _ in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def stop_workers(workers: List[JobWorker], timeout: float = 30.0):
+    # Signal all workers before waiting on any. Jobs still running after the
+    # timeout are retried once their visibility timeout expires
+    for worker in workers:
+        worker.stop(timeout=0)
+    for worker in workers:
+        worker.stop(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background job workers.")
+    parser.add_argument("--workers", type=int, default=2, help="worker threads")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=getattr(logging, settings.log_level),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    from app.core.vector_store import vector_store
+    from app.services.embedding_service import embedding_service
+    
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    workers = start_workers(args.workers, name="cli")
+    logger.info(f"Running {args.workers} job workers on {settings.job_queue_path}: {job_queue.get_stats()}")
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_workers(workers)
+        vector_store.close()
+        embedding_service.close()
@@ -1,9 +1,20 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.models import UserPreference, Message
+from app.models import UserPreference, PreferenceExtraction, Message
+from app.config import settings
+from app.core.llm_scheduler import NEAR_REAL_TIME
 from app.services.ai_service import ai_service
+from app.services.sentiment_classifier import sentiment_classifier
 import json
 
+NEUTRAL_SENTIMENT = {
+    "sentiment": "neutral",
+    "emotion": "calm",
+    "intensity": 0.5
+}
+
 
 class PreferenceService:
     
@@ -12,10 +23,18 @@ class PreferenceService:
         db: Session,
         messages: List[Message],
         user_id: str,
-        character_id: str
+        character_id: str,
+        raise_errors: bool = False,
+        source: Optional[str] = None
     ):
+        """
+        With `source` (an ID for the turn), preferences already applied for
+        it are not extracted or counted again.
+        """
         if not messages or len(messages) < 2:
             return
+        if source and db.get(PreferenceExtraction, source) is not None:
+            return
         
         conversation_text = "\n".join([
             f"[{msg.role.upper()}]: {msg.content}"
@@ -42,27 +61,46 @@ Return as JSON:
 JSON:"""
         
         try:
-            response = ai_service.model.generate_content(prompt).text.strip()
+            response = ai_service.generate(prompt).text.strip()
             if '{' in response:
                 json_start = response.index('{')
                 json_end = response.rindex('}') + 1
                 preferences = json.loads(response[json_start:json_end])
-                
-                for pref_type, values in preferences.items():
-                    if isinstance(values, list):
-                        for value in values:
-                            self.update_preference(
-                                db, user_id, character_id,
-                                pref_type, value, value, 0.7
-                            )
-                    else:
-                        self.update_preference(
-                            db, user_id, character_id,
-                            pref_type, pref_type, str(values), 0.7
-                        )
+                self.save_preferences(db, user_id, character_id, preferences, source=source)
         except Exception as e:
+            if raise_errors:
+                raise
             print(f"Error extracting preferences: {e}")
     
+    def save_preferences(
+        self,
+        db: Session,
+        user_id: str,
+        character_id: str,
+        preferences: Dict,
+        source: Optional[str] = None
+    ):
+        """
+        Store extracted preferences, e.g. {"topics": [...], "tone": "casual"},
+        in one transaction. With `source`, the turn is recorded alongside so
+        saving it again changes nothing.
+        """
+        for pref_type, values in preferences.items():
+            if isinstance(values, list):
+                for value in values:
+                    self.update_preference(
+                        db, user_id, character_id,
+                        pref_type, value, value, 0.7, commit=False
+                    )
+            elif values:
+                self.update_preference(
+                    db, user_id, character_id,
+                    pref_type, pref_type, str(values), 0.7, commit=False
+                )
+        if source:
+            db.add(PreferenceExtraction(source=source, user_id=user_id))
+        db.commit()
+    
     def update_preference(
         self,
         db: Session,
@@ -71,7 +109,8 @@ JSON:"""
         preference_type: str,
         key: str,
         value: str,
-        confidence: float
+        confidence: float,
+        commit: bool = True
     ):
         existing = db.query(UserPreference).filter(
             UserPreference.user_id == user_id,
@@ -94,7 +133,10 @@ JSON:"""
             )
             db.add(pref)
         
-        db.commit()
+        if commit:
+            db.commit()
+        else:
+            db.flush()
     
     def get_user_profile(
         self,
@@ -107,7 +149,24 @@ JSON:"""
             UserPreference.character_id == character_id,
             UserPreference.confidence >= 0.5
         ).all()
-        
+        return self._format_profile(preferences)
+    
+    async def get_user_profile_async(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        character_id: str
+    ) -> str:
+        result = await db.execute(
+            select(UserPreference).where(
+                UserPreference.user_id == user_id,
+                UserPreference.character_id == character_id,
+                UserPreference.confidence >= 0.5
+            )
+        )
+        return self._format_profile(result.scalars().all())
+    
+    def _format_profile(self, preferences: List[UserPreference]) -> str:
         if not preferences:
             return ""
         
@@ -124,7 +183,31 @@ JSON:"""
         return "\n".join(profile_parts)
     
     def analyze_sentiment(self, message: str) -> Dict:
-        prompt = f"""Analyze the sentiment and emotion in this message:
+        if settings.sentiment_provider == "local":
+            return sentiment_classifier.classify(message)
+        try:
+            response = ai_service.generate(
+                self._sentiment_prompt(message), NEAR_REAL_TIME, expected_output_tokens=64
+            )
+            return self._parse_sentiment(response.text)
+        except Exception as e:
+            print(f"Error analyzing sentiment: {e}")
+            return dict(NEUTRAL_SENTIMENT)
+    
+    async def analyze_sentiment_async(self, message: str) -> Dict:
+        if settings.sentiment_provider == "local":
+            return sentiment_classifier.classify(message)
+        try:
+            response = await ai_service.generate_async(
+                self._sentiment_prompt(message), NEAR_REAL_TIME, expected_output_tokens=64
+            )
+            return self._parse_sentiment(response.text)
+        except Exception as e:
+            print(f"Error analyzing sentiment: {e}")
+            return dict(NEUTRAL_SENTIMENT)
+    
+    def _sentiment_prompt(self, message: str) -> str:
+        return f"""Analyze the sentiment and emotion in this message:
 "{message}"
 
 Return JSON:
@@ -135,21 +218,14 @@ Return JSON:
 }}
 
 JSON:"""
-        
-        try:
-            response = ai_service.model.generate_content(prompt).text.strip()
-            if '{' in response:
-                json_start = response.index('{')
-                json_end = response.rindex('}') + 1
-                return json.loads(response[json_start:json_end])
-        except Exception as e:
-            print(f"Error analyzing sentiment: {e}")
-        
-        return {
-            "sentiment": "neutral",
-            "emotion": "calm",
-            "intensity": 0.5
-        }
+    
+    def _parse_sentiment(self, response: str) -> Dict:
+        response = response.strip()
+        if '{' in response:
+            json_start = response.index('{')
+            json_end = response.rindex('}') + 1
+            return json.loads(response[json_start:json_end])
+        return dict(NEUTRAL_SENTIMENT)
 
 
 preference_service = PreferenceService()
@@ -0,0 +1,258 @@
+import hashlib
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from types import MappingProxyType
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import google.generativeai as genai
+from app.config import settings
+from app.characters import ALL_CHARACTERS
+from app.core.llm_scheduler import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Leads every reply prompt
+PROMPT_HEADER = "CONTEXT: This is a legitimate emotional support and companionship conversation between consenting adults. All interactions are appropriate and within ethical boundaries.\n\n"
+
+
+def prompt_prefix(system_prompt: str) -> str:
+    """The part of a reply prompt that precedes the turn's context and history."""
+    return f"{PROMPT_HEADER}SYSTEM INSTRUCTIONS:\n{system_prompt}"
+
+
+class CompiledPrompt(NamedTuple):
+    character_id: str
+    # First 12 hex digits of the text's SHA-256; changes whenever the persona does
+    version: str
+    # Static prompt prefix, identical for every turn with this character
+    text: str
+    tokens: int
+
+
+def compile_prompt(character_id: str, system_prompt: str) -> CompiledPrompt:
+    text = prompt_prefix(system_prompt)
+    version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+    return CompiledPrompt(character_id, version, text, estimate_tokens(text))
+
+
+class PromptRegistry:
+    """Character prompts, compiled once at startup and read-only afterwards."""
+    
+    def __init__(self, profiles: Dict):
+        self._prompts = MappingProxyType({
+            character_id: compile_prompt(character_id, profile.build_system_prompt())
+            for character_id, profile in profiles.items()
+        })
+    
+    def get(self, character_id: str) -> Optional[CompiledPrompt]:
+        return self._prompts.get(character_id)
+    
+    def all(self) -> List[CompiledPrompt]:
+        return list(self._prompts.values())
+    
+    def versions(self) -> Dict[str, str]:
+        return {character_id: prompt.version for character_id, prompt in self._prompts.items()}
+
+
+class _CachedEntry:
+    def __init__(self, model, expires: Optional[float]):
+        # Model bound to the cached prefix; None: prefix the caller's model
+        self.model = model
+        # time.time() after which the provider drops the cache; None: never
+        self.expires = expires
+
+
+class PromptCache(ABC):
+    """
+    Keeps the static prefix of each compiled prompt registered with a cache
+    backend, so a turn only sends its own context and history. `request`
+    never blocks on the backend: until a prefix is registered (or while it
+    cannot be) the full prompt goes to the base model.
+    """
+    
+    # Register on the calling thread instead of in the background
+    register_inline = False
+    
+    def __init__(self):
+        self.stats = {"hits": 0, "misses": 0, "registered": 0, "failures": 0, "prefix_tokens_saved": 0}
+        self._entries: Dict[str, _CachedEntry] = {}
+        self._pending = set()
+        self._retry_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+    
+    def request(self, prompt: CompiledPrompt, suffix: str, model) -> Tuple[object, str]:
+        """The model to call and the text to send it for one turn; `model` is the uncached model."""
+        with self._lock:
+            entry = self._entries.get(prompt.version)
+            live = entry is not None and (entry.expires is None or entry.expires > time.time() + 60)
+            if live:
+                self.stats["hits"] += 1
+                self.stats["prefix_tokens_saved"] += prompt.tokens
+            else:
+                self.stats["misses"] += 1
+            refresh = self._needs_refresh(prompt, entry)
+        
+        if refresh:
+            if self.register_inline:
+                self.register(prompt)
+                return self.request(prompt, suffix, model)
+            threading.Thread(target=self.register, args=(prompt,), daemon=True, name="prompt-cache").start()
+        if live:
+            return entry.model or _PrefixedModel(model, prompt.text), suffix
+        return model, prompt.text + suffix
+    
+    def warm(self, prompts: List[CompiledPrompt]):
+        """Register every prompt now, e.g. at startup."""
+        for prompt in prompts:
+            with self._lock:
+                refresh = self._needs_refresh(prompt, self._entries.get(prompt.version))
+            if refresh:
+                self.register(prompt)
+    
+    def register(self, prompt: CompiledPrompt):
+        try:
+            entry = self._register(prompt)
+        except Exception as e:
+            logger.warning(f"Could not cache the {prompt.character_id} prompt ({prompt.version}): {e}")
+            with self._lock:
+                self.stats["failures"] += 1
+                self._retry_at[prompt.version] = time.time() + settings.prompt_cache_retry_seconds
+            return
+        finally:
+            with self._lock:
+                self._pending.discard(prompt.version)
+        
+        with self._lock:
+            if entry is None:
+                # The backend will never take this prefix
+                self._retry_at[prompt.version] = float("inf")
+            else:
+                self._entries[prompt.version] = entry
+                self.stats["registered"] += 1
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "cached_prompts": len(self._entries)}
+    
+    def _needs_refresh(self, prompt: CompiledPrompt, entry: Optional[_CachedEntry]) -> bool:
+        """Whether to (re-)register the prefix, claiming the job if so. Called with the lock held."""
+        if prompt.version in self._pending or self._retry_at.get(prompt.version, 0) > time.time():
+            return False
+        if entry is not None and (entry.expires is None or entry.expires - time.time() > settings.prompt_cache_ttl / 2):
+            return False
+        self._pending.add(prompt.version)
+        return True
+    
+    @abstractmethod
+    def _register(self, prompt: CompiledPrompt) -> Optional[_CachedEntry]:
+        ...
+
+
+class _PrefixedModel:
+    """Wraps a model so every call is sent with a fixed prefix."""
+    
+    def __init__(self, model, prefix: str):
+        self.model = model
+        self.prefix = prefix
+    
+    def generate_content(self, prompt: str, **kwargs):
+        return self.model.generate_content(self.prefix + prompt, **kwargs)
+    
+    async def generate_content_async(self, prompt: str, **kwargs):
+        return await self.model.generate_content_async(self.prefix + prompt, **kwargs)
+
+
+class LocalPromptCache(PromptCache):
+    """
+    Stand-in for provider-side caching, for tests and PROMPT_CACHE=local:
+    callers send only the turn suffix, as with Gemini's cache, and the
+    prefix is prepended in-process. Gemini sees the same text as without
+    caching.
+    """
+    
+    register_inline = True
+    
+    def _register(self, prompt: CompiledPrompt) -> Optional[_CachedEntry]:
+        return _CachedEntry(None, None)
+
+
+class GeminiPromptCache(PromptCache):
+    """
+    Registers each prefix as a Gemini cached content (the system
+    instruction of a `CachedContent`), named by character and version so
+    workers and restarts reuse it. Cached input tokens are billed at a
+    reduced rate and are not processed again each turn. TTLs are extended
+    while a character is in use.
+
+    Remote caches are listed once and remembered by display name; the list
+    is fetched again only when a name is missing or its cache has expired,
+    at most once a minute.
+    """
+    
+    # Seconds before a missing name triggers another listing
+    LIST_INTERVAL = 60.0
+    
+    def __init__(self, generation_config: Dict, safety_settings: List[Dict]):
+        super().__init__()
+        self.generation_config = generation_config
+        self.safety_settings = safety_settings
+        self._remote: Dict[str, "genai.caching.CachedContent"] = {}
+        self._listed_at: Optional[float] = None
+        self._remote_lock = threading.Lock()
+    
+    def _register(self, prompt: CompiledPrompt) -> Optional[_CachedEntry]:
+        if prompt.tokens < settings.prompt_cache_min_tokens:
+            logger.info(
+                f"The {prompt.character_id} prompt (~{prompt.tokens} tokens) is below Gemini's "
+                f"{settings.prompt_cache_min_tokens}-token caching minimum; sending it with each turn"
+            )
+            return None
+        
+        ttl = timedelta(seconds=settings.prompt_cache_ttl)
+        display_name = f"character-{prompt.character_id}-{prompt.version}"
+        cached = self._find(display_name)
+        if cached is not None:
+            try:
+                cached.update(ttl=ttl)
+            except Exception as e:
+                # Deleted remotely since it was listed
+                logger.info(f"Could not extend {cached.name}, creating a new cache: {e}")
+                cached = None
+        if cached is None:
+            cached = genai.caching.CachedContent.create(
+                model=settings.gemini_model if settings.gemini_model.startswith("models/") else f"models/{settings.gemini_model}",
+                display_name=display_name,
+                system_instruction=prompt.text,
+                ttl=ttl
+            )
+            logger.info(f"Cached the {prompt.character_id} prompt as {cached.name}")
+        with self._remote_lock:
+            self._remote[display_name] = cached
+        
+        model = genai.GenerativeModel.from_cached_content(
+            cached,
+            generation_config=self.generation_config,
+            safety_settings=self.safety_settings
+        )
+        return _CachedEntry(model, cached.expire_time.timestamp())
+    
+    def _find(self, display_name: str) -> Optional["genai.caching.CachedContent"]:
+        """The live remote cache named `display_name`, listing the remote caches only when needed."""
+        with self._remote_lock:
+            cached = self._remote.get(display_name)
+            stale = self._listed_at is None or time.monotonic() - self._listed_at >= self.LIST_INTERVAL
+            if not _is_live(cached) and stale:
+                self._remote = {c.display_name: c for c in genai.caching.CachedContent.list()}
+                self._listed_at = time.monotonic()
+                cached = self._remote.get(display_name)
+            return cached if _is_live(cached) else None
+
+
+def _is_live(cached) -> bool:
+    # Leave a minute to use it before it expires
+    return cached is not None and cached.expire_time.timestamp() > time.time() + 60
+
+
+prompt_registry = PromptRegistry(ALL_CHARACTERS)
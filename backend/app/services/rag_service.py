@@ -1,10 +1,16 @@
+import asyncio
 import logging
-from typing import List, Dict
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 from app.core.vector_store import vector_store
 from app.services.embedding_service import embedding_service
 from app.services.conversation_service import conversation_service
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models import Message
+from app.config import settings
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -14,6 +20,10 @@ class RAGService:
     def __init__(self):
         self.vector_store = vector_store
         self.embedding_service = embedding_service
+        # Bounded LRU of recently retrieved message texts (message_id -> content)
+        self.text_cache: "OrderedDict[int, str]" = OrderedDict()
+        self.text_cache_size = settings.rag_text_cache_size
+        self._cache_lock = threading.Lock()
     
     def index_message(
         self,
@@ -25,25 +35,52 @@ class RAGService:
         content: str,
         timestamp: datetime
     ):
+        self.index_messages(user_id, character_id, [Message(
+            id=message_id,
+            conversation_id=conversation_id,
+            role=role,
+            content=content,
+            timestamp=timestamp
+        )])
+    
+    def index_messages(self, user_id: str, character_id: str, messages: List[Message]):
+        """Embed messages in batched requests and add them to the vector store in one call."""
+        self.index_batch([(user_id, character_id, msg) for msg in messages])
+    
+    def index_batch(self, entries: List[Tuple[str, str, Message]], raise_errors: bool = False):
+        """
+        Like `index_messages`, for (user_id, character_id, message) entries from any number of users.
+        
+        With `raise_errors`, already indexed messages are skipped and any
+        failure raises after the rest are indexed, so a job can retry the batch.
+        """
         try:
-            embedding = self.embedding_service.generate_embedding(content)
-            metadata = {
-                "message_id": str(message_id),
-                "conversation_id": str(conversation_id),
-                "user_id": user_id,
-                "character_id": character_id,
-                "role": role,
-                "timestamp": timestamp.isoformat()
-            }
-            memory_id = f"msg_{message_id}"
-            self.vector_store.add_memory(
-                memory_id=memory_id,
-                text=content,
-                embedding=embedding,
-                metadata=metadata
-            )
+            embeddings = self.embedding_service.generate_batch_embeddings([msg.content for _, _, msg in entries])
+            memories = []
+            failed = 0
+            for (user_id, character_id, msg), embedding in zip(entries, embeddings):
+                if embedding is None:
+                    logger.warning(f"Skipping message {msg.id}: embedding failed")
+                    failed += 1
+                    continue
+                memories.append((f"msg_{msg.id}", embedding, {
+                    "message_id": str(msg.id),
+                    "conversation_id": str(msg.conversation_id),
+                    "user_id": user_id,
+                    "character_id": character_id,
+                    "role": msg.role,
+                    "timestamp": msg.timestamp.isoformat()
+                }))
+            if memories and raise_errors:
+                self.vector_store.import_memories(memories)
+            elif memories:
+                self.vector_store.add_memories(memories)
+            if failed and raise_errors:
+                raise RuntimeError(f"Could not embed {failed} of {len(entries)} messages")
         except Exception as e:
-            logger.error(f"Failed to index message {message_id}: {e}", exc_info=True)
+            if raise_errors:
+                raise
+            logger.error(f"Failed to index {len(entries)} messages: {e}", exc_info=True)
     
     def index_conversation(
         self,
@@ -56,19 +93,11 @@ class RAGService:
             Message.conversation_id == conversation_id
         ).order_by(Message.timestamp).all()
         
-        for msg in messages:
-            self.index_message(
-                message_id=msg.id,
-                conversation_id=conversation_id,
-                user_id=user_id,
-                character_id=character_id,
-                role=msg.role,
-                content=msg.content,
-                timestamp=msg.timestamp
-            )
+        self.index_messages(user_id, character_id, messages)
     
-    def retrieve_relevant_context(
+    async def retrieve_relevant_context_async(
         self,
+        db: AsyncSession,
         user_message: str,
         user_id: str,
         character_id: str,
@@ -76,54 +105,106 @@ class RAGService:
         n_results: int = 5
     ) -> str:
         try:
-            query_embedding = self.embedding_service.generate_query_embedding(user_message)
-            memories = self.vector_store.search_similar(
+            query_embedding = await self.embedding_service.generate_query_embedding_async(user_message)
+            if query_embedding is None:
+                return ""
+            # FAISS searches (or vector store RPCs) block, so run off the loop
+            relevant_memories = await asyncio.to_thread(
+                self.vector_store.search_similar,
                 query_embedding=query_embedding,
                 user_id=user_id,
                 character_id=character_id,
-                n_results=n_results * 2
+                n_results=n_results,
+                exclude_conversation_id=str(current_conversation_id)
             )
-            
-            relevant_memories = [
-                m for m in memories
-                if m['metadata'].get('conversation_id') != str(current_conversation_id)
-            ][:n_results]
-            
-            if not relevant_memories:
-                return ""
-            
-            context_parts = ["RELEVANT PAST CONTEXT:"]
-            total_chars = len(context_parts[0])
-            max_context_chars = 1500
-            
-            # Build context incrementally, respecting token limits
-            # Each memory is truncated individually, then we stop adding when total limit is reached
-            # This prevents overwhelming the AI model while maintaining conversation continuity
-            for i, memory in enumerate(relevant_memories, 1):
-                role = memory['metadata'].get('role', 'unknown')
-                text = memory['text']
-                
-                max_memory_chars = 200
-                if len(text) > max_memory_chars:
-                    text = text[:max_memory_chars] + "..."
-                
-                memory_line = f"{i}. [{role.upper()}]: {text}"
-                
-                if total_chars + len(memory_line) > max_context_chars:
-                    logger.info(f"RAG context limit reached at {i} memories")
-                    break
-                
-                context_parts.append(memory_line)
-                total_chars += len(memory_line)
-            
-            return "\n".join(context_parts)
+            return self._format_context(await self._hydrate_async(db, relevant_memories))
         except Exception as e:
             logger.error(f"Failed to retrieve RAG context: {e}", exc_info=True)
             return ""
     
+    def _format_context(self, relevant_memories: List[Dict]) -> str:
+        if not relevant_memories:
+            return ""
+        
+        context_parts = ["RELEVANT PAST CONTEXT:"]
+        
+        # Each memory is truncated individually and kept to one line, most
+        # relevant first; the context assembler drops lines from the end
+        # when RAG is over its share of the prompt budget
+        for i, memory in enumerate(relevant_memories, 1):
+            role = memory['metadata'].get('role', 'unknown')
+            text = " ".join(memory['text'].split())
+            
+            max_memory_chars = 200
+            if len(text) > max_memory_chars:
+                text = text[:max_memory_chars] + "..."
+            
+            context_parts.append(f"{i}. [{role.upper()}]: {text}")
+        
+        return "\n".join(context_parts)
+    
+    async def _hydrate_async(self, db: AsyncSession, memories: List[Dict]) -> List[Dict]:
+        """
+        Attach message text to search hits, fetching cache misses in one query.
+        
+        Hits whose message no longer exists in the database are dropped.
+        """
+        texts, missing = self._cached_texts(memories)
+        if missing:
+            result = await db.execute(select(Message.id, Message.content).where(Message.id.in_(missing)))
+            self._add_texts(texts, result.all())
+        return self._attach_texts(memories, texts)
+    
+    def _cached_texts(self, memories: List[Dict]) -> Tuple[Dict[int, str], List[int]]:
+        message_ids = [int(m['metadata']['message_id']) for m in memories if m['metadata'].get('message_id')]
+        texts = {}
+        with self._cache_lock:
+            for message_id in message_ids:
+                text = self.text_cache.get(message_id)
+                if text is not None:
+                    self.text_cache.move_to_end(message_id)
+                    texts[message_id] = text
+        return texts, [message_id for message_id in message_ids if message_id not in texts]
+    
+    def _add_texts(self, texts: Dict[int, str], rows):
+        for message_id, content in rows:
+            texts[message_id] = content
+            self._cache_text(message_id, content)
+    
+    def _attach_texts(self, memories: List[Dict], texts: Dict[int, str]) -> List[Dict]:
+        hydrated = []
+        for memory in memories:
+            message_id = memory['metadata'].get('message_id')
+            text = texts.get(int(message_id)) if message_id else None
+            if text is not None:
+                hydrated.append({**memory, 'text': text})
+        return hydrated
+    
+    def _cache_text(self, message_id: int, text: str):
+        if self.text_cache_size <= 0:
+            return
+        with self._cache_lock:
+            self.text_cache[message_id] = text
+            self.text_cache.move_to_end(message_id)
+            while len(self.text_cache) > self.text_cache_size:
+                self.text_cache.popitem(last=False)
+    
+    def delete_messages(self, user_id: str, character_id: str, message_ids: List[int]):
+        self.vector_store.delete_memories(
+            [f"msg_{message_id}" for message_id in message_ids],
+            user_id=user_id,
+            character_id=character_id
+        )
+        with self._cache_lock:
+            for message_id in message_ids:
+                self.text_cache.pop(message_id, None)
+    
     def get_memory_stats(self) -> Dict:
+        stats = self.vector_store.get_stats()
         return {
-            "total_memories": self.vector_store.get_collection_count()
+            "total_memories": stats["live"],
+            "deleted_memories": stats["deleted"],
+            "embedding_cache": self.embedding_service.get_cache_stats()
         }
 
 rag_service = RAGService()
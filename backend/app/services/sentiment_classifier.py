@@ -0,0 +1,184 @@
+import re
+from typing import Dict, List, Tuple
+import numpy as np
+
+EMOTIONS = ("happy", "sad", "angry", "excited", "stressed", "calm", "confused")
+POSITIVE_EMOTIONS = ("happy", "excited")
+NEGATIVE_EMOTIONS = ("sad", "angry", "stressed")
+# Contribution of each emotion's score to positive/negative polarity
+VALENCE = {"happy": 1.0, "excited": 1.0, "calm": 0.3, "confused": 0.0, "sad": -1.0, "angry": -1.0, "stressed": -1.0}
+
+# Weighted cue words and two-word phrases per emotion
+LEXICON: Dict[str, Dict[str, float]] = {
+    "happy": {
+        "happy": 1.0, "glad": 1.0, "good": 0.5, "great": 0.8, "nice": 0.5, "love": 0.8, "loved": 0.8,
+        "lovely": 0.8, "wonderful": 1.0, "awesome": 0.9, "amazing": 0.9, "fantastic": 1.0, "joy": 1.0,
+        "joyful": 1.0, "pleased": 0.8, "grateful": 0.9, "thankful": 0.9, "thanks": 0.4, "thank": 0.4,
+        "proud": 0.8, "smile": 0.7, "smiling": 0.7, "laugh": 0.6, "laughing": 0.6, "fun": 0.6,
+        "enjoy": 0.7, "enjoyed": 0.7, "enjoying": 0.7, "delighted": 1.0, "cheerful": 1.0, "content": 0.6,
+        "better": 0.4, "best": 0.6, "blessed": 0.8, "yay": 0.9, "finally": 0.3, "relieved": 0.6,
+        "feel good": 0.8, "feeling good": 0.8, "went well": 0.9, "so happy": 0.5,
+    },
+    "sad": {
+        "sad": 1.0, "unhappy": 1.0, "depressed": 1.2, "down": 0.4, "lonely": 1.0, "alone": 0.6,
+        "cry": 1.0, "crying": 1.0, "cried": 1.0, "tears": 0.9, "miss": 0.7, "missing": 0.5,
+        "heartbroken": 1.3, "hurt": 0.8, "hurts": 0.8, "grief": 1.2, "grieving": 1.2, "lost": 0.5,
+        "loss": 0.8, "died": 1.0, "passed away": 1.2, "empty": 0.8, "hopeless": 1.2, "miserable": 1.2,
+        "upset": 0.7, "disappointed": 0.8, "sorry": 0.3, "awful": 0.7, "terrible": 0.7, "worst": 0.7,
+        "broke up": 1.0, "feel bad": 0.7, "feeling down": 1.0, "let down": 0.8, "gloomy": 0.9,
+        "worthless": 1.2, "rejected": 0.9, "left out": 0.8, "no one": 0.4, "nobody": 0.4,
+    },
+    "angry": {
+        "angry": 1.2, "mad": 1.0, "furious": 1.4, "annoyed": 0.9, "annoying": 0.8, "irritated": 0.9,
+        "irritating": 0.8, "hate": 1.0, "hated": 1.0, "pissed": 1.2, "rage": 1.3, "frustrated": 0.8,
+        "frustrating": 0.8, "unfair": 0.8, "ridiculous": 0.8, "stupid": 0.7, "sick of": 1.0,
+        "fed up": 1.1, "done with": 0.6, "outraged": 1.3, "livid": 1.4, "resent": 1.0, "disgusted": 1.0,
+        "betrayed": 1.0, "lied": 0.7, "yelled": 0.8, "screw": 0.8, "damn": 0.5, "wtf": 0.8,
+    },
+    "excited": {
+        "excited": 1.2, "exciting": 1.0, "thrilled": 1.3, "pumped": 1.1, "stoked": 1.1, "hyped": 1.1,
+        "cant wait": 1.3, "looking forward": 1.0, "eager": 0.9, "wow": 0.7, "omg": 0.6, "incredible": 0.7,
+        "ecstatic": 1.4, "psyched": 1.1, "new job": 0.6, "got accepted": 1.0, "got promoted": 1.1,
+        "big news": 0.9, "woohoo": 1.2, "celebrate": 0.9, "celebrating": 0.9, "adventure": 0.6,
+    },
+    "stressed": {
+        "stressed": 1.2, "stress": 1.0, "stressful": 1.0, "anxious": 1.2, "anxiety": 1.2, "worried": 1.0,
+        "worry": 0.9, "worrying": 0.9, "nervous": 1.0, "overwhelmed": 1.3, "pressure": 0.8,
+        "deadline": 0.7, "deadlines": 0.7, "exhausted": 0.9, "tired": 0.6, "burned out": 1.3,
+        "burnt out": 1.3, "burnout": 1.3, "panic": 1.2, "panicking": 1.2, "scared": 0.9, "afraid": 0.9,
+        "tense": 0.8, "cant sleep": 1.0, "too much": 0.7, "freaking out": 1.2, "swamped": 1.0,
+        "overthinking": 1.0, "on edge": 1.0, "fear": 0.8, "dread": 1.0,
+    },
+    "calm": {
+        "calm": 1.0, "relaxed": 1.0, "relaxing": 0.9, "peaceful": 1.0, "chill": 0.8, "fine": 0.4,
+        "okay": 0.3, "ok": 0.3, "alright": 0.3, "rest": 0.4, "resting": 0.5, "quiet": 0.5,
+        "serene": 1.0, "at ease": 1.0, "meditating": 0.8, "meditation": 0.7, "cozy": 0.7, "steady": 0.5,
+        "balanced": 0.6, "not bad": 0.6,
+    },
+    "confused": {
+        "confused": 1.2, "confusing": 1.0, "unsure": 0.9, "uncertain": 0.9, "lost": 0.3, "understand": 0.4,
+        "dont know": 0.8, "dont understand": 1.2, "not sure": 1.0, "no idea": 1.0, "why": 0.3,
+        "how": 0.2, "what": 0.2, "wondering": 0.6, "puzzled": 1.1, "no sense": 1.1, "which": 0.2,
+        "should i": 0.6, "doesnt make": 0.8, "mixed feelings": 1.0, "torn": 0.8,
+    },
+}
+
+NEGATORS = {
+    "not", "no", "never", "dont", "didnt", "doesnt", "isnt", "wasnt", "arent", "werent", "aint",
+    "cant", "cannot", "wont", "hardly", "barely", "without", "nothing", "neither", "nor",
+}
+INTENSIFIERS = {
+    "very": 1.5, "so": 1.4, "really": 1.4, "extremely": 1.8, "super": 1.5, "totally": 1.4,
+    "absolutely": 1.6, "incredibly": 1.7, "too": 1.3, "completely": 1.5, "deeply": 1.5, "truly": 1.4,
+    "kinda": 0.7, "kind": 0.8, "slightly": 0.6, "bit": 0.7, "little": 0.7, "somewhat": 0.7,
+}
+# Tokens a negator's scope reaches
+NEGATION_SCOPE = 3
+
+_TOKEN = re.compile(r"[a-z]+")
+
+
+class SentimentClassifier:
+    """
+    Local sentiment/emotion classifier returning the same shape as the LLM
+    path: {"sentiment", "emotion", "intensity"}.
+
+    A linear model over word and bigram features whose weights come from a
+    hand-built lexicon. Negated cues ("not happy") count toward the
+    opposite side, intensifiers scale the next cue, and "!" and "?" add
+    arousal and confusion. Tokenizing is per text; scoring a batch is one
+    NumPy scatter-add into a (texts x emotions) matrix.
+    """
+    
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        rows: List[np.ndarray] = []
+        for emotion, cues in LEXICON.items():
+            for cue, weight in cues.items():
+                row = self._row(cue, rows)
+                row[EMOTIONS.index(emotion)] += weight
+                # Negated cues lean the other way, more weakly
+                negated = self._row(f"not {cue}", rows)
+                if emotion in POSITIVE_EMOTIONS:
+                    negated[EMOTIONS.index("sad")] += 0.6 * weight
+                elif emotion in NEGATIVE_EMOTIONS:
+                    negated[EMOTIONS.index("calm")] += 0.5 * weight
+                elif emotion == "calm":
+                    negated[EMOTIONS.index("stressed")] += 0.5 * weight
+        self.weights = np.stack(rows).astype(np.float32)
+        self.valence = np.array([VALENCE[emotion] for emotion in EMOTIONS], dtype=np.float32)
+    
+    def classify(self, text: str) -> Dict:
+        return self.classify_batch([text])[0]
+    
+    def classify_batch(self, texts: List[str]) -> List[Dict]:
+        docs: List[int] = []
+        features: List[int] = []
+        scales: List[float] = []
+        extra = np.zeros((len(texts), len(EMOTIONS)), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for feature, scale in self._features(text):
+                docs.append(i)
+                features.append(feature)
+                scales.append(scale)
+            exclaims = min(text.count("!"), 3)
+            extra[i, EMOTIONS.index("excited")] += 0.15 * exclaims
+            extra[i, EMOTIONS.index("confused")] += 0.2 * min(text.count("?"), 2)
+        
+        scores = extra
+        if features:
+            scaled = self.weights[np.array(features)] * np.array(scales, dtype=np.float32)[:, None]
+            np.add.at(scores, np.array(docs), scaled)
+        return [self._result(row, text) for row, text in zip(scores, texts)]
+    
+    def _features(self, text: str) -> List[Tuple[int, float]]:
+        tokens = _TOKEN.findall(text.lower().replace("'", "").replace("’", ""))
+        found = []
+        negated_until = -1
+        scale = 1.0
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            # Prefer a two-word cue over its first word
+            bigram = f"{token} {tokens[i + 1]}" if i + 1 < len(tokens) else None
+            cue = bigram if bigram in self.vocabulary else token
+            width = 2 if cue is bigram else 1
+            
+            if cue in self.vocabulary:
+                negated = i <= negated_until and f"not {cue}" in self.vocabulary
+                found.append((self.vocabulary[f"not {cue}" if negated else cue], scale))
+                scale = 1.0
+            elif token in INTENSIFIERS:
+                scale *= INTENSIFIERS[token]
+            if token in NEGATORS and cue is not bigram:
+                negated_until = i + NEGATION_SCOPE
+            i += width
+        return found
+    
+    def _row(self, feature: str, rows: List[np.ndarray]) -> np.ndarray:
+        if feature not in self.vocabulary:
+            self.vocabulary[feature] = len(rows)
+            rows.append(np.zeros(len(EMOTIONS), dtype=np.float32))
+        return rows[self.vocabulary[feature]]
+    
+    def _result(self, scores: np.ndarray, text: str) -> Dict:
+        strongest = float(scores.max())
+        if strongest < 0.3:
+            return {"sentiment": "neutral", "emotion": "calm", "intensity": 0.5}
+        
+        emotion = EMOTIONS[int(scores.argmax())]
+        valence = float(scores @ self.valence)
+        if valence > 0.25:
+            sentiment = "positive"
+        elif valence < -0.25:
+            sentiment = "negative"
+        else:
+            sentiment = "neutral"
+        
+        intensity = 0.3 + 0.25 * strongest + 0.05 * min(text.count("!"), 3)
+        if sum(1 for word in text.split() if len(word) > 2 and word.isupper()):
+            intensity += 0.1
+        return {"sentiment": sentiment, "emotion": emotion, "intensity": round(min(intensity, 1.0), 2)}
+
+
+sentiment_classifier = SentimentClassifier()
@@ -1,6 +1,9 @@
 from typing import List
 from app.models import Message, ConversationMemory
+from app.core.llm_scheduler import LLMPreempted
 from app.services.ai_service import ai_service
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime
 import json
@@ -59,7 +62,7 @@ class SummarizationService:
             new_messages=new_messages
         )
         
-        summary = ai_service.model.generate_content(prompt).text.strip()
+        summary = ai_service.generate(prompt).text.strip()
         
         key_facts = self.extract_key_facts(new_messages)
         
@@ -145,12 +148,15 @@ CONVERSATION:
 KEY FACTS (JSON array):"""
         
         try:
-            response = ai_service.model.generate_content(prompt).text.strip()
+            response = ai_service.generate(prompt).text.strip()
             if response.startswith('['):
                 facts = json.loads(response)
                 return facts[:5]
             else:
                 return [f.strip('- ') for f in response.split('\n') if f.strip()][:5]
+        except LLMPreempted:
+            # Retry the whole summary later rather than store it without facts
+            raise
         except Exception as e:
             return []
     
@@ -165,6 +171,19 @@ KEY FACTS (JSON array):"""
         ).order_by(ConversationMemory.created_at.desc()).first()
         
         return summary.content if summary else ""
+    
+    async def get_conversation_summary_async(
+        self,
+        db: AsyncSession,
+        conversation_id: int
+    ) -> str:
+        result = await db.execute(
+            select(ConversationMemory.content).where(
+                ConversationMemory.conversation_id == conversation_id,
+                ConversationMemory.memory_type == "summary"
+            ).order_by(ConversationMemory.created_at.desc()).limit(1)
+        )
+        return result.scalar() or ""
 
 
 summarization_service = SummarizationService()
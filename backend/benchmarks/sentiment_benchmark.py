@@ -0,0 +1,114 @@
+"""
+Accuracy / latency benchmark for per-message sentiment analysis.
+
+Runs the local lexicon classifier (SENTIMENT_PROVIDER=local) over a labelled
+sample of chat messages and reports emotion and polarity accuracy, per-message
+latency and batch throughput. With --llm the same messages also go through the
+Gemini path (needs GEMINI_API_KEY) for comparison.
+
+Usage:
+    python benchmarks/sentiment_benchmark.py
+    python benchmarks/sentiment_benchmark.py --llm --errors
+
+Note: the bundled sample was written alongside the lexicon, so its local
+accuracy is optimistic; pass --sample with messages labelled from real
+conversations for a fair comparison.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.sentiment_classifier import sentiment_classifier
+
+DEFAULT_SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sentiment_sample.jsonl")
+
+
+def load_sample(path: str):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def score(rows, predictions):
+    emotion = np.mean([p.get("emotion") == r["emotion"] for r, p in zip(rows, predictions)])
+    polarity = np.mean([p.get("sentiment") == r["sentiment"] for r, p in zip(rows, predictions)])
+    return emotion, polarity
+
+
+def run_local(texts, repeat: int):
+    latencies = []
+    for _ in range(repeat):
+        for text in texts:
+            start = time.perf_counter()
+            sentiment_classifier.classify(text)
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        predictions = sentiment_classifier.classify_batch(texts)
+    batch_seconds = (time.perf_counter() - start) / (repeat * len(texts))
+    return predictions, np.array(latencies) * 1000, batch_seconds * 1000
+
+
+def run_llm(texts):
+    from app.config import settings
+    from app.services.preference_service import preference_service
+    settings.sentiment_provider = "gemini"
+    
+    predictions, latencies = [], []
+    for text in texts:
+        start = time.perf_counter()
+        predictions.append(preference_service.analyze_sentiment(text))
+        latencies.append(time.perf_counter() - start)
+    return predictions, np.array(latencies) * 1000
+
+
+def report(name, rows, predictions, latencies, batch_ms=None):
+    emotion, polarity = score(rows, predictions)
+    batch = f"{batch_ms:>13.4f}" if batch_ms is not None else f"{'-':>13}"
+    print(
+        f"{name:>8} {emotion:>9.3f} {polarity:>9.3f} "
+        f"{np.percentile(latencies, 50):>9.4f} {np.percentile(latencies, 99):>9.4f} {batch}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sample", default=DEFAULT_SAMPLE, help="JSONL with text, sentiment and emotion per line")
+    parser.add_argument("--repeat", type=int, default=50, help="passes over the sample for local timings")
+    parser.add_argument("--llm", action="store_true", help="also run the Gemini path")
+    parser.add_argument("--errors", action="store_true", help="list misclassified messages")
+    args = parser.parse_args()
+    
+    rows = load_sample(args.sample)
+    texts = [row["text"] for row in rows]
+    print(f"{len(rows)} labelled messages")
+    print(f"{'path':>8} {'emotion':>9} {'polarity':>9} {'p50 ms':>9} {'p99 ms':>9} {'batch ms/msg':>13}")
+    
+    local, latencies, batch_ms = run_local(texts, args.repeat)
+    report("local", rows, local, latencies, batch_ms)
+    results = [("local", local)]
+    
+    if args.llm:
+        llm, llm_latencies = run_llm(texts)
+        report("gemini", rows, llm, llm_latencies)
+        results.append(("gemini", llm))
+        agreement = np.mean([a.get("emotion") == b.get("emotion") for a, b in zip(local, llm)])
+        print(f"local/gemini emotion agreement: {agreement:.3f}")
+    
+    if args.errors:
+        for name, predictions in results:
+            for row, prediction in zip(rows, predictions):
+                if prediction.get("emotion") != row["emotion"] or prediction.get("sentiment") != row["sentiment"]:
+                    print(f"[{name}] expected {row['emotion']}/{row['sentiment']}, "
+                          f"got {prediction.get('emotion')}/{prediction.get('sentiment')}: {row['text']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Recall / latency benchmark for the RAG vector index types.
+
+Builds each index type on a synthetic clustered corpus and compares it with
+exact flat search, reporting recall@k and single-query p50/p99 latency.
+
+Usage:
+    python benchmarks/vector_index_benchmark.py --sizes 10000,100000,1000000,5000000
+
+Note: a 5M x 768 float32 corpus needs ~15 GB of RAM per index; use --dim to
+scale the corpus down on smaller machines.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import vector_index
+
+
+def make_corpus(n: int, dim: int, seed: int = 0, n_clusters: int = 256) -> np.ndarray:
+    """Gaussian clusters, closer to real embedding distributions than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    corpus = np.empty((n, dim), dtype=np.float32)
+    chunk = 100_000
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        labels = rng.integers(0, n_clusters, size=end - start)
+        corpus[start:end] = centers[labels] + 0.5 * rng.normal(size=(end - start, dim)).astype(np.float32)
+    return corpus
+
+
+def build(index_type: str, corpus: np.ndarray, args) -> faiss.Index:
+    if index_type == "ivf":
+        train_size = min(len(corpus), max(args.ivf_max_nlist * 64, 50_000))
+        sample = corpus[np.random.default_rng(1).choice(len(corpus), train_size, replace=False)]
+        index = vector_index.build_index(
+            "ivf", "none",
+            sample, np.arange(train_size, dtype=np.int64),
+            max_nlist=args.ivf_max_nlist, nprobe=args.ivf_nprobe
+        )
+        index.reset()
+        index.add_with_ids(corpus, np.arange(len(corpus), dtype=np.int64))
+        return index
+    
+    index = vector_index.create_index(
+        index_type,
+        corpus.shape[1],
+        hnsw_m=args.hnsw_m,
+        hnsw_ef_search=args.hnsw_ef_search
+    )
+    index.add_with_ids(corpus, np.arange(len(corpus), dtype=np.int64))
+    return index
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int):
+    latencies = []
+    results = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = ids[0]
+    return results, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated corpus sizes")
+    parser.add_argument("--types", default="flat,hnsw,ivf", help="comma-separated index types")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--hnsw-ef-search", type=int, default=64)
+    parser.add_argument("--ivf-max-nlist", type=int, default=1024)
+    parser.add_argument("--ivf-nprobe", type=int, default=16)
+    args = parser.parse_args()
+    
+    print(f"{'size':>10} {'type':>6} {'build s':>9} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        corpus = make_corpus(size, args.dim)
+        queries = make_corpus(args.queries, args.dim, seed=42)
+        
+        exact = faiss.IndexFlatL2(args.dim)
+        exact.add(corpus)
+        truth, _, _ = measure(exact, queries, args.k)
+        
+        for index_type in args.types.split(","):
+            start = time.perf_counter()
+            index = exact if index_type == "flat" else build(index_type, corpus, args)
+            build_seconds = time.perf_counter() - start
+            
+            found, p50, p99 = measure(index, queries, args.k)
+            print(f"{size:>10} {index_type:>6} {build_seconds:>9.2f} {recall_at_k(found, truth):>9.3f} {p50:>8.3f} {p99:>8.3f}")
+            if index is not exact:
+                del index
+        del exact, corpus
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Memory / recall / latency benchmark for the RAG vector quantization modes.
+
+Builds one index per quantization mode (none, fp16, sq8, pq) on a synthetic
+clustered corpus and reports, per mode:
+
+- RAM per million vectors, extrapolated from the serialized index size
+- disk per million vectors for the full-precision copies kept for re-ranking
+- recall@k against exact search, with and without re-ranking
+- single-query p50/p99 latency (re-ranking included)
+
+Usage:
+    python benchmarks/vector_quantization_benchmark.py --size 1000000 --type ivf
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import vector_index
+from vector_index_benchmark import make_corpus, recall_at_k
+
+
+def build(mode: str, corpus: np.ndarray, args):
+    """Train on a sample, then add the whole corpus; returns (index, fixed bytes)."""
+    train_size = min(len(corpus), args.train_size)
+    sample = corpus[np.random.default_rng(1).choice(len(corpus), train_size, replace=False)]
+    index = vector_index.build_index(
+        args.type, mode,
+        sample, np.arange(train_size, dtype=np.int64),
+        hnsw_m=args.hnsw_m,
+        hnsw_ef_search=args.hnsw_ef_search,
+        max_nlist=args.ivf_max_nlist,
+        nprobe=args.ivf_nprobe,
+        pq_m=args.pq_m,
+        pq_nbits=args.pq_nbits
+    )
+    index.reset()
+    # Codebooks, centroids and other per-index overhead
+    fixed_bytes = len(faiss.serialize_index(index))
+    index.add_with_ids(corpus, np.arange(len(corpus), dtype=np.int64))
+    return index, fixed_bytes
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int, corpus: np.ndarray, rerank_factor: int):
+    latencies = []
+    results = np.full((len(queries), k), -1, dtype=np.int64)
+    for i, query in enumerate(queries):
+        query = query[None, :]
+        start = time.perf_counter()
+        _, ids = index.search(query, k * rerank_factor)
+        ids = ids[0][ids[0] != -1]
+        if rerank_factor > 1:
+            # Stand-in for the memory-mapped full-precision vectors
+            _, ids = vector_index.rerank(query, ids, corpus[ids], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i, :len(ids[:k])] = ids[:k]
+    return results, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--type", default="flat", choices=vector_index.INDEX_TYPES)
+    parser.add_argument("--modes", default="none,fp16,sq8,pq", help="comma-separated quantization modes")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--train-size", type=int, default=50000)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    parser.add_argument("--pq-m", type=int, default=96)
+    parser.add_argument("--pq-nbits", type=int, default=8)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--hnsw-ef-search", type=int, default=64)
+    parser.add_argument("--ivf-max-nlist", type=int, default=1024)
+    parser.add_argument("--ivf-nprobe", type=int, default=16)
+    args = parser.parse_args()
+    
+    corpus = make_corpus(args.size, args.dim)
+    queries = make_corpus(args.queries, args.dim, seed=42)
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(corpus)
+    _, truth = exact.search(queries, args.k)
+    del exact
+    
+    print(f"{args.size} vectors x {args.dim} dims, {args.type} index")
+    print(f"{'mode':>12} {'build s':>9} {'RAM MB/M':>10} {'disk MB/M':>10} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in args.modes.split(","):
+        start = time.perf_counter()
+        index, fixed_bytes = build(mode, corpus, args)
+        build_seconds = time.perf_counter() - start
+        
+        per_vector = (len(faiss.serialize_index(index)) - fixed_bytes) / args.size
+        ram_mb = (fixed_bytes + per_vector * 1_000_000) / 2 ** 20
+        
+        variants = [(mode, 1, 0.0)]
+        if mode in vector_index.LOSSY_QUANTIZATIONS and args.rerank_factor > 1:
+            disk_mb = args.dim * 4 * 1_000_000 / 2 ** 20
+            variants.append((f"{mode}+rerank", args.rerank_factor, disk_mb))
+        
+        for label, rerank_factor, disk_mb in variants:
+            found, p50, p99 = measure(index, queries, args.k, corpus, rerank_factor)
+            print(
+                f"{label:>12} {build_seconds:>9.2f} {ram_mb:>10.1f} {disk_mb:>10.1f} "
+                f"{recall_at_k(found, truth):>9.3f} {p50:>8.3f} {p99:>8.3f}"
+            )
+        del index
+
+
+if __name__ == "__main__":
+    main()
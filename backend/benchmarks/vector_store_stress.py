@@ -0,0 +1,167 @@
+"""
+Concurrency stress test for the RAG vector store.
+
+Runs hundreds of threads that add, search and delete memories against a
+store in a temporary directory while background checkpoints, IVF training
+and compaction run with short intervals. Afterwards it checks that:
+
+- no operation reported an error
+- every partition's index, metadata columns and tombstones agree
+- each surviving memory is found by searching for its own vector, and no
+  deleted memory is ever returned
+- the same holds after closing the store and reopening it from disk
+
+Usage:
+    python benchmarks/vector_store_stress.py --threads 200 --ops 50
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+class ErrorCounter:
+    """stdout wrapper counting the vector store's "Error ..." messages."""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.messages = []
+        self._lock = threading.Lock()
+    
+    def write(self, text):
+        if text.startswith("Error"):
+            with self._lock:
+                self.messages.append(text)
+        return self.stream.write(text)
+    
+    def flush(self):
+        self.stream.flush()
+
+
+def check_integrity(store, vectors, live, deleted, label):
+    problems = []
+    stats = store.get_stats()
+    if stats["live"] != len(live):
+        problems.append(f"live count {stats['live']} != expected {len(live)}")
+    
+    for key in list(store.catalog):
+        partition = store._get_partition(key)
+        columns = partition.columns
+        if partition.index.ntotal != partition.live_count + partition.dead_count:
+            problems.append(f"{key}: index holds {partition.index.ntotal} vectors, catalog says {partition.live_count}+{partition.dead_count}")
+        if int(columns.filter_mask().sum()) != partition.live_count:
+            problems.append(f"{key}: {int(columns.filter_mask().sum())} live metadata rows, expected {partition.live_count}")
+        if partition.raw is not None and len(partition.raw) != partition.next_id:
+            problems.append(f"{key}: {len(partition.raw)} full-precision rows for {partition.next_id} IDs")
+    
+    for memory_id, (user_id, character_id) in live.items():
+        hits = store.search_similar(vectors[memory_id].tolist(), user_id, character_id, n_results=1)
+        if not hits or hits[0]["id"] != memory_id:
+            problems.append(f"{memory_id} not found by its own vector (got {hits[:1]})")
+    
+    for memory_id, (user_id, character_id) in deleted.items():
+        hits = store.search_similar(vectors[memory_id].tolist(), user_id, character_id, n_results=5)
+        if any(hit["id"] == memory_id for hit in hits):
+            problems.append(f"deleted {memory_id} still returned")
+    
+    print(f"{label}: {stats}, {len(problems)} problems")
+    for problem in problems[:20]:
+        print(f"  {problem}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=50, help="operations per thread")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--quantization", default="none")
+    args = parser.parse_args()
+    
+    data_dir = tempfile.mkdtemp(prefix="vector-stress-")
+    os.environ.update(
+        VECTOR_STORE_DIR=data_dir,
+        VECTOR_STORE_SOCKET="",
+        VECTOR_INDEX_TYPE=args.index_type,
+        VECTOR_QUANTIZATION=args.quantization,
+        VECTOR_CHECKPOINT_INTERVAL="0.2",
+        VECTOR_CHECKPOINT_MAX_OPS="200",
+        VECTOR_IVF_TRAIN_THRESHOLD="500",
+        VECTOR_QUANTIZER_TRAIN_THRESHOLD="1000",
+        VECTOR_COMPACTION_RATIO="0.1",
+        VECTOR_MAX_LOADED_PARTITIONS="4",
+    )
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    
+    errors = ErrorCounter(sys.stdout)
+    sys.stdout = errors
+    
+    # The module-level store opens VECTOR_STORE_DIR, i.e. the temp directory
+    from app.core.vector_store import VectorStore, vector_store as store
+    
+    rng = np.random.default_rng(0)
+    total = args.threads * args.ops
+    vectors = {f"mem_{i}": rng.random(args.dim, dtype=np.float32) for i in range(total)}
+    live = {}
+    deleted = {}
+    state_lock = threading.Lock()
+    start_barrier = threading.Barrier(args.threads)
+    
+    def worker(thread_no: int):
+        local_rng = np.random.default_rng(thread_no)
+        start_barrier.wait()
+        for op in range(args.ops):
+            memory_id = f"mem_{thread_no * args.ops + op}"
+            key = (f"user_{local_rng.integers(args.users)}", "mira")
+            store.add_memory(memory_id, vectors[memory_id].tolist(), {
+                "user_id": key[0],
+                "character_id": key[1],
+                "conversation_id": str(thread_no),
+                "message_id": str(thread_no * args.ops + op),
+                "role": "user",
+            })
+            with state_lock:
+                live[memory_id] = key
+            
+            store.search_similar(
+                local_rng.random(args.dim).tolist(), key[0], key[1],
+                n_results=5, exclude_conversation_id=str(thread_no)
+            )
+            if local_rng.random() < 0.2:
+                with state_lock:
+                    del live[memory_id]
+                    deleted[memory_id] = key
+                store.delete_memory(memory_id, key[0], key[1])
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(f"{args.threads} threads, {total} adds in {elapsed:.1f}s ({total / elapsed:.0f} adds/s with searches)")
+    
+    problems = check_integrity(store, vectors, live, deleted, "live store")
+    store.close()
+    reopened = VectorStore(data_dir)
+    problems += check_integrity(reopened, vectors, live, deleted, "reopened store")
+    reopened.close()
+    
+    sys.stdout = errors.stream
+    if errors.messages:
+        print(f"{len(errors.messages)} operations reported errors, e.g. {errors.messages[0].strip()}")
+    ok = not problems and not errors.messages
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
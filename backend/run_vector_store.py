@@ -0,0 +1,6 @@
+"""Shared vector store server runner (used when VECTOR_STORE_SOCKET is set)."""
+
+from app.core.vector_server import main
+
+if __name__ == "__main__":
+    main()
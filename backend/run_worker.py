@@ -0,0 +1,22 @@
+"""Background job worker runner (see app/services/jobs.py)."""
+
+from app.config import settings
+
+
+def _uses_shared_vector_store() -> bool:
+    # VECTOR_SHARDS takes precedence over VECTOR_STORE_SOCKET, and its
+    # local: shards are opened in-process
+    if settings.vector_shards:
+        targets = [entry.partition("=")[2] for entry in settings.vector_shards.split(",") if entry.strip()]
+        return all(target.strip().startswith("unix:") for target in targets)
+    return bool(settings.vector_store_socket)
+
+
+if __name__ == "__main__":
+    if not _uses_shared_vector_store():
+        # Importing the jobs opens the vector store, and two processes must
+        # not write the same vector store directory
+        raise SystemExit("Indexing jobs need the shared vector store: set VECTOR_STORE_SOCKET and run run_vector_store.py")
+    
+    from app.services.jobs import main
+    main()